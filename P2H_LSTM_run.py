@@ -1,6 +1,7 @@
 """ Handles building, training, and testing the model.
 """
 import argparse
+import json
 import os
 import sys
 
@@ -8,6 +9,8 @@ import sys
 sys.path.append("/Users/mihaileric/Documents/Research/LSTM-NLI/")
 
 from model.lstmp2h import LSTMP2H
+from util.length_stats import SIDES, lstmStepFlops, parseUnrollSteps, unrollCost
+from util.profiling import enableProfiling, writeProfileReport
 from util.utils import HeKaimingInitializer, GaussianDefaultInitializer
 
 
@@ -42,8 +45,13 @@ if __name__ == "__main__":
                         help="number of epochs to use for training")
     parser.add_argument("--learnRate", type=float,
                         help="learning rate used training")
-    parser.add_argument("--unrollSteps", type=int,
-                        help="number of steps to unroll LSTM layer")
+    parser.add_argument("--unrollSteps", type=str,
+                        help="number of steps to unroll LSTM layer, or 'auto:p<q>' (e.g. "
+                             "auto:p99) to unroll premise and hypothesis LSTMs for the q-th "
+                             "percentile of their sentence lengths in train data stats")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="number of examples to read from start of each data file; "
+                             "all if not given")
     parser.add_argument("--numExamplesToTrain", type=int,
                         default=-1, help="number of examples to use for training"
                                          "if you don't want to use full data")
@@ -54,12 +62,64 @@ if __name__ == "__main__":
                         default=0.0, help="L2/L1 regularization coefficient")
     parser.add_argument("--dropoutRate", type=float,
                         default=1.0, help="dropout probability rate")
+    parser.add_argument("--profile", action="store_true",
+                        help="compile train/predict functions with Theano profiling "
+                             "and dump a report of op times and compile stats")
+    parser.add_argument("--profileReport", type=str, default="profileReport.json",
+                        help="path to JSON file where profile report is written")
+    parser.add_argument("--memoryProfile", action="store_true",
+                        help="log RSS and memory attributed to data, embeddings, params "
+                             "and optimizer state at each phase of training")
+    parser.add_argument("--premiseDedup", action="store_true",
+                        help="run premise LSTM once per unique premise in each batch")
+    parser.add_argument("--checkpointFreq", type=int, default=0,
+                        help="number of minibatches between training checkpoints; "
+                             "0 disables checkpointing")
+    parser.add_argument("--checkpointPath", type=str, default=None,
+                        help="path of training checkpoint; derived from config if not given")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue training from checkpoint if it exists")
+    parser.add_argument("--keepCheckpoints", type=int, default=1,
+                        help="number of most recent training checkpoints kept")
+    parser.add_argument("--checkpointScratchDir", type=str, default=None,
+                        help="local directory checkpoints are written to before being "
+                             "moved to checkpointPath; system temp directory if not given")
+    parser.add_argument("--sharedData", action="store_true",
+                        help="hold data in shared variables and feed compiled functions "
+                             "only minibatch idx")
+    parser.add_argument("--sharedDataMaxMB", type=float, default=None,
+                        help="max MB of data held in shared variables at a time; larger "
+                             "data is swapped in in windows. Unbounded if not given")
     args = parser.parse_args()
 
+    if args.profile:
+        enableProfiling()
+
+    trainStats = {}
+    if args.trainDataStats is not None:
+        with open(args.trainDataStats, "r") as f:
+            trainStats = json.load(f)
+    unrollSteps = parseUnrollSteps(args.unrollSteps, trainStats)
+
     network = LSTMP2H(args.embedData, args.trainData, args.trainDataStats,
                       args.valData, args.valDataStats, args.testData,
                       args.testDataStats, args.logPath, heka, dimHidden=args.dimHidden,
-                      dimInput=args.dimInput, numTimestepsPremise=args.unrollSteps,
-                      numTimestepsHypothesis=args.unrollSteps)
+                      dimInput=args.dimInput, numTimestepsPremise=unrollSteps[0],
+                      numTimestepsHypothesis=unrollSteps[1], limit=args.limit)
+
+    stepFlops = lstmStepFlops(network.dimEmbedding, args.dimInput, args.dimHidden)
+    for side, numSteps in zip(SIDES, unrollSteps):
+        if "lengthHistogram" + side in trainStats:
+            network.logger.Log("{0} unroll cost on train data: {1}".format(
+                side, unrollCost(trainStats["lengthHistogram" + side], numSteps, stepFlops)))
     network.train(args.numEpochs, args.batchSize, args.learnRate, args.numExamplesToTrain,
-                  args.gradMax, args.L2regularization, args.dropoutRate)
+                  args.gradMax, args.L2regularization, args.dropoutRate,
+                  memoryProfile=args.memoryProfile, premiseDedup=args.premiseDedup,
+                  checkpointFreq=args.checkpointFreq, checkpointPath=args.checkpointPath,
+                  resume=args.resume, keepCheckpoints=args.keepCheckpoints,
+                  checkpointScratchDir=args.checkpointScratchDir, sharedData=args.sharedData,
+                  sharedDataMaxBytes=None if args.sharedDataMaxMB is None
+                                     else int(args.sharedDataMaxMB * 2**20))
+
+    if args.profile:
+        writeProfileReport(args.profileReport, network.logger)
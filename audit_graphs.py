@@ -0,0 +1,109 @@
+""" Compiles the functions of the LSTMP2H and SumEmbeddings models and audits
+their graphs for float64 variables, upcasts, folded constants and
+host/device transfers.
+"""
+import argparse
+import theano
+import theano.tensor as T
+
+from model.lstmp2h import LSTMP2H
+from model.sumembeddings import SumEmbeddings
+from util.afs_safe_logger import Logger
+from util.graph_audit import auditFunctions
+from util.utils import HeKaimingInitializer
+
+
+def lstmp2hFunctions(args):
+    """
+    Compile the train and predict functions of an LSTMP2H network.
+    :return: List of (name, function) pairs
+    """
+    network = LSTMP2H(args.embedData, None, None, None, None, None, None, args.logPath,
+                      HeKaimingInitializer(), dimHidden=args.dimHidden, dimInput=args.dimInput,
+                      numTimestepsPremise=args.unrollSteps,
+                      numTimestepsHypothesis=args.unrollSteps)
+
+    inputPremise = T.ftensor3(name="inputPremise")
+    inputHypothesis = T.ftensor3(name="inputHypothesis")
+    yTarget = T.ivector(name="yTarget")
+    learnRate = T.scalar(name="learnRate", dtype='float32')
+
+    fGradSharedPremise, fGradSharedHypothesis, fUpdatePremise, fUpdateHypothesis, \
+        costFn, gradsHypothesisFn, gradsPremiseFn = network.trainFunc(inputPremise,
+                                    inputHypothesis, yTarget, learnRate, args.gradMax,
+                                    args.L2regularization, args.dropoutRate,
+                                    args.sentenceAttention, args.wordwiseAttention,
+                                    args.batchSize)
+    predictFunc = network.predictFunc(inputPremise, inputHypothesis, args.dropoutRate)
+
+    return [("LSTMP2H gradSharedPremise", fGradSharedPremise),
+            ("LSTMP2H gradSharedHypothesis", fGradSharedHypothesis),
+            ("LSTMP2H updatePremise", fUpdatePremise),
+            ("LSTMP2H updateHypothesis", fUpdateHypothesis),
+            ("LSTMP2H cost", costFn),
+            ("LSTMP2H gradsHypothesis", gradsHypothesisFn),
+            ("LSTMP2H gradsPremise", gradsPremiseFn),
+            ("LSTMP2H predict", predictFunc)]
+
+
+def sumEmbeddingsFunctions(args):
+    """
+    Compile the train functions of a SumEmbeddings network.
+    :return: List of (name, function) pairs
+    """
+    network = SumEmbeddings(args.embedData, None, None, None, None, None, None,
+                            args.logPath, args.dimInput)
+
+    inputPremise = T.ftensor3(name="inputPremise")
+    inputHypothesis = T.ftensor3(name="inputHypothesis")
+    yTarget = T.ivector(name="yTarget")
+    learnRate = T.scalar(name="learnRate", dtype='float32')
+
+    fGradShared, fUpdate, costFunc = network.trainFunc(inputPremise, inputHypothesis,
+                                        yTarget, learnRate, args.gradMax, args.L2regularization)
+
+    return [("SumEmbeddings gradShared", fGradShared),
+            ("SumEmbeddings update", fUpdate),
+            ("SumEmbeddings cost", costFunc)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="audit compiled model graphs")
+    parser.add_argument("--embedData", type=str, default=None,
+                        help="path to precomputed word embeddings; default "
+                             "embedding size is used if not given")
+    parser.add_argument("--logPath", type=str, default=None,
+                        help="path to file where audit results will be logged")
+    parser.add_argument("--batchSize", type=int, default=5,
+                        help="batch size for training")
+    parser.add_argument("--dimHidden", type=int, default=8,
+                        help="dimension of hidden layer")
+    parser.add_argument("--dimInput", type=int, default=6,
+                        help="dimension of input to network")
+    parser.add_argument("--unrollSteps", type=int, default=4,
+                        help="number of steps to unroll LSTM layer")
+    parser.add_argument("--gradMax", type=float, default=3.0,
+                        help="maximum gradient magnitude for gradient clipping")
+    parser.add_argument("--L2regularization", type=float, default=0.0,
+                        help="L2 regularization coefficient")
+    parser.add_argument("--dropoutRate", type=float, default=1.0,
+                        help="dropout probability rate")
+    parser.add_argument("--sentenceAttention", action="store_true",
+                        help="audit graphs with sentence attention")
+    parser.add_argument("--wordwiseAttention", action="store_true",
+                        help="audit graphs with wordwise attention")
+    parser.add_argument("--largeConstantSize", type=int, default=10000,
+                        help="number of elements above which a constant is reported")
+    parser.add_argument("--strict", action="store_true",
+                        help="exit with an error if any issue is found")
+    args = parser.parse_args()
+
+    logger = Logger(log_path=args.logPath)
+    if theano.config.floatX != "float32":
+        logger.Log("floatX is {0}; run with THEANO_FLAGS=floatX=float32 to audit "
+                   "the graphs used for training".format(theano.config.floatX),
+                   level=Logger.WARNING)
+
+    functions = lstmp2hFunctions(args) + sumEmbeddingsFunctions(args)
+    auditFunctions(functions, logger, strict=args.strict,
+                   largeConstantSize=args.largeConstantSize)
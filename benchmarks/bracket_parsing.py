@@ -0,0 +1,124 @@
+""" Benchmark of reading bracketed SICK/SNLI parse files: the old
+regex-rewrite + eval() tree path against the linear-time bracket tokenizer.
+
+Runs on a tab-separated file of label, premise parse and hypothesis parse
+(e.g. data/snli_1.0rc3_dev.txt), or on synthetic SNLI pairs if none is given.
+
+Usage:
+    python benchmarks/bracket_parsing.py --data data/snli_1.0rc3_dev.txt --output results.json
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.afs_safe_logger import Logger
+from util.synthetic_data import writeSyntheticSNLI
+from util.utils import bracketLeaves, bracketTransitions, leaves, sick_reader
+
+logger = Logger()
+
+WORD_RE = re.compile(r"([^ \(\)]+)", re.UNICODE)
+
+
+def legacyStr2tree(s):
+    """str2tree as it was before the bracket tokenizer"""
+    s = WORD_RE.sub(r'"\1",', s)
+    s = s.replace(")", "),").strip(",")
+    s = s.strip(",")
+    return eval(s)
+
+
+def legacyReader(srcFilename):
+    """sick_reader as it was before, without printing every line"""
+    for example in csv.reader(file(srcFilename), delimiter="\t"):
+        label, t1, t2 = example[:3]
+        if not label.startswith('%') and not label=="gold_label":
+            yield (label, legacyStr2tree(t1), legacyStr2tree(t2))
+
+
+def writeSyntheticParses(path, numPairs, vocabSize):
+    """
+    Write synthetic SNLI pairs as a tab-separated file of gold label and
+    binary parses of premise and hypothesis.
+    """
+    tempDir = tempfile.mkdtemp()
+    try:
+        jsonPath = os.path.join(tempDir, "snli.jsonl")
+        writeSyntheticSNLI(jsonPath, os.path.join(tempDir, "stats.json"), numPairs, vocabSize)
+        with open(jsonPath, "r") as f, open(path, "w") as out:
+            out.write("gold_label\tsentence1_binary_parse\tsentence2_binary_parse\n")
+            for line in f:
+                example = json.loads(line)
+                out.write("\t".join([example["gold_label"], example["sentence1_binary_parse"],
+                                     example["sentence2_binary_parse"]]) + "\n")
+    finally:
+        shutil.rmtree(tempDir)
+
+
+def timeReader(name, fn):
+    """
+    Time reading all examples with given function.
+    :return: Dict of timing statistics and the tokens read
+    """
+    start = time.time()
+    tokens = fn()
+    elapsed = time.time() - start
+    logger.Log("{0}: {1:.3f}s, {2:.0f} examples/s".format(name, elapsed, len(tokens) / elapsed))
+    return {"seconds": elapsed, "examplesPerSec": len(tokens) / elapsed}, tokens
+
+
+def runBenchmarks(dataPath):
+    legacyStats, legacyTokens = timeReader("legacy trees", lambda: [
+        (label, leaves(t1), leaves(t2)) for label, t1, t2 in legacyReader(dataPath)])
+    treeStats, treeTokens = timeReader("trees", lambda: [
+        (label, leaves(t1), leaves(t2)) for label, t1, t2 in sick_reader(dataPath)])
+    leafStats, leafTokens = timeReader("leaves", lambda: list(
+        sick_reader(dataPath, parse=bracketLeaves)))
+    transitionStats, transitionTokens = timeReader("transitions", lambda: [
+        (label, t1[0], t2[0]) for label, t1, t2 in sick_reader(dataPath, parse=bracketTransitions)])
+
+    return {"numExamples": len(legacyTokens),
+            "legacyTrees": legacyStats,
+            "trees": treeStats,
+            "leaves": leafStats,
+            "transitions": transitionStats,
+            "speedupLeaves": legacyStats["seconds"] / leafStats["seconds"],
+            "outputsMatch": legacyTokens == treeTokens == leafTokens == transitionTokens}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark of bracketed parse readers")
+    parser.add_argument("--data", type=str, default=None,
+                        help="tab-separated parse file; synthetic pairs if not given")
+    parser.add_argument("--numPairs", type=int, default=100000,
+                        help="number of synthetic pairs")
+    parser.add_argument("--vocabSize", type=int, default=20000,
+                        help="size of synthetic vocabulary")
+    parser.add_argument("--output", type=str, default=None,
+                        help="path to JSON file where results are written")
+    args = parser.parse_args()
+
+    dataPath = args.data
+    if dataPath is None:
+        fd, dataPath = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        writeSyntheticParses(dataPath, args.numPairs, args.vocabSize)
+
+    try:
+        results = runBenchmarks(dataPath)
+    finally:
+        if args.data is None:
+            os.remove(dataPath)
+
+    logger.Log("Results: {0}".format(json.dumps(results, indent=2, sort_keys=True)))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
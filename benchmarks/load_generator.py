@@ -0,0 +1,142 @@
+""" Load generator for the prediction server.
+
+Sends premise/hypothesis pairs from an SNLI-format file (or synthetic
+sentences) from many concurrent clients, then reports client-side latency
+percentiles and throughput along with the server's /stats.
+
+Usage:
+    python benchmarks/load_generator.py --port 8000 --concurrency 16 --numRequests 2000
+    python benchmarks/load_generator.py --unixSocket /tmp/predict.sock --data snli_1.0_dev.jsonl
+"""
+import argparse
+import httplib
+import json
+import numpy as np
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.prediction_server import UnixHTTPConnection
+from util.synthetic_data import syntheticWord
+
+
+def loadPairs(dataPath, numPairs, vocabSize, seed=0):
+    """
+    Return list of (premise, hypothesis) sentence pairs read from an SNLI-format
+    file, or synthetic ones if no file is given.
+    """
+    if dataPath is not None:
+        pairs = []
+        with open(dataPath, "r") as f:
+            for line in f:
+                example = json.loads(line)
+                pairs.append((example["sentence1"], example["sentence2"]))
+        return pairs
+
+    rng = np.random.RandomState(seed)
+    def sentence():
+        return " ".join(syntheticWord(idx) for idx in
+                        rng.randint(0, vocabSize, rng.randint(3, 15)))
+    return [(sentence(), sentence()) for _ in xrange(numPairs)]
+
+
+def makeConnection(args):
+    if args.unixSocket is not None:
+        return UnixHTTPConnection(args.unixSocket, timeout=args.timeout)
+    return httplib.HTTPConnection(args.host, args.port, timeout=args.timeout)
+
+
+def request(connection, method, path, body=None):
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    connection.request(method, path, body, headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def runClient(args, pairs, requestIdx, latencies, errors, lock):
+    """
+    Send requests over one persistent connection until all requests are taken.
+    """
+    connection = makeConnection(args)
+    while True:
+        with lock:
+            idx = requestIdx[0]
+            requestIdx[0] += 1
+        if idx >= args.numRequests:
+            break
+
+        premise, hypothesis = pairs[idx % len(pairs)]
+        body = json.dumps({"premise": premise, "hypothesis": hypothesis})
+        start = time.time()
+        try:
+            status, _ = request(connection, "POST", "/predict", body)
+            if status != 200:
+                raise RuntimeError("Status {0}".format(status))
+            with lock:
+                latencies.append(time.time() - start)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            connection.close()
+            connection = makeConnection(args)
+    connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load generator for prediction server")
+    parser.add_argument("--host", type=str, default="localhost",
+                        help="host server listens on")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="port server listens on")
+    parser.add_argument("--unixSocket", type=str, default=None,
+                        help="path of Unix socket server listens on")
+    parser.add_argument("--data", type=str, default=None,
+                        help="SNLI-format file of pairs to send; synthetic pairs if not given")
+    parser.add_argument("--vocabSize", type=int, default=1000,
+                        help="vocabulary size of synthetic pairs")
+    parser.add_argument("--numRequests", type=int, default=1000,
+                        help="total number of requests to send")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="number of concurrent clients")
+    parser.add_argument("--timeout", type=float, default=30.,
+                        help="socket timeout in seconds")
+    parser.add_argument("--output", type=str, default=None,
+                        help="path to JSON file where results are written")
+    args = parser.parse_args()
+
+    pairs = loadPairs(args.data, args.numRequests, args.vocabSize)
+    latencies, errors = [], []
+    requestIdx = [0]
+    lock = threading.Lock()
+
+    start = time.time()
+    clients = [threading.Thread(target=runClient,
+                                args=(args, pairs, requestIdx, latencies, errors, lock))
+               for _ in xrange(args.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - start
+
+    latenciesMs = np.array(latencies) * 1000.
+    results = {"requests": len(latencies), "errors": len(errors),
+               "concurrency": args.concurrency, "elapsedSec": elapsed,
+               "requestsPerSec": len(latencies) / elapsed}
+    for percentile in [50, 90, 99]:
+        results["p{0}LatencyMs".format(percentile)] = \
+            float(np.percentile(latenciesMs, percentile)) if len(latencies) else None
+
+    connection = makeConnection(args)
+    _, results["server"] = request(connection, "GET", "/stats")
+    connection.close()
+
+    print json.dumps(results, indent=2, sort_keys=True)
+    if errors:
+        print "First error: {0}".format(errors[0])
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,256 @@
+""" Microbenchmarks for the embedding table, batch assembly, LSTM layer,
+attention, RMSprop updates and accuracy computation on synthetic inputs.
+
+Usage:
+    python benchmarks/microbenchmarks.py run --output results.json
+    python benchmarks/microbenchmarks.py compare baseline.json results.json
+"""
+import argparse
+import json
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import theano
+import theano.tensor as T
+
+from model.embeddings import EmbeddingTable
+from model.layers import LSTMLayer
+from model.lstmp2h import LSTMP2H
+from util.afs_safe_logger import Logger
+from util.batch_assembler import BatchAssembler
+from util.synthetic_data import writeSyntheticEmbeddings
+from util.utils import HeKaimingInitializer, convertDataToTrainingBatch
+
+logger = Logger()
+
+
+def timeIt(fn, repeats=5, warmup=1):
+    """
+    Time calls of given function.
+    :param fn: Function taking no arguments
+    :param repeats: Number of timed calls
+    :param warmup: Number of untimed calls made first
+    :return: Dict of timing statistics in seconds
+    """
+    for _ in xrange(warmup):
+        fn()
+
+    times = []
+    for _ in xrange(repeats):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+
+    return {"mean": float(np.mean(times)), "median": float(np.median(times)),
+            "min": float(np.min(times)), "max": float(np.max(times)),
+            "repeats": repeats}
+
+
+def randomIdxMat(table, seqLen, batchSize):
+    """
+    Return an idx matrix of dim (seqLen, batchSize, 1) of random word idx.
+    """
+    return np.random.randint(0, table.sizeVocab - 2,
+                             size=(seqLen, batchSize, 1)).astype(np.float32)
+
+
+def benchEmbeddings(table, batchSize, seqLen, repeats):
+    results = {}
+    idxMat = randomIdxMat(table, seqLen, batchSize)
+    results["embeddingIdxMatToTensor"] = timeIt(
+        lambda: table.convertIdxMatToIdxTensor(idxMat), repeats)
+
+    # Gathering a whole training batch, into new arrays and into reused buffers
+    labels = np.random.randint(0, 3, batchSize).astype(np.int32)
+    minibatch = range(batchSize)
+    results["trainingBatch"] = timeIt(
+        lambda: convertDataToTrainingBatch(idxMat, seqLen, idxMat, seqLen, "right", table,
+                                           labels, minibatch), repeats)
+    assembler = BatchAssembler(table, batchSize, seqLen, seqLen)
+    results["trainingBatchAssembler"] = timeIt(
+        lambda: assembler.assemble(idxMat, idxMat, labels, minibatch, "right"), repeats)
+
+    sentences = [["w%d" % np.random.randint(table.sizeVocab - 2) for _ in xrange(seqLen)]
+                 for _ in xrange(batchSize)]
+    results["embeddingSentToIdx"] = timeIt(
+        lambda: [table.convertSentListToIdxMatrix(sent) for sent in sentences], repeats)
+
+    return results
+
+
+def benchLSTMLayer(dimEmbedding, dimInput, dimHidden, batchSize, seqLen, repeats):
+    results = {}
+    dropoutMode = theano.shared(np.float32(0.))
+    layer = LSTMLayer(dimInput, dimHidden, dimEmbedding, "benchLayer", dropoutMode,
+                      HeKaimingInitializer())
+    inputMat = T.ftensor3(name="inputMat")
+    inputVal = np.random.randn(seqLen, batchSize, dimEmbedding).astype(np.float32)
+
+    layer.forwardRun(inputMat, seqLen)
+    forwardFn = theano.function([inputMat], layer.finalOutputVal, name="benchForward")
+    results["lstmForward"] = timeIt(lambda: forwardFn(inputVal), repeats)
+
+    params = [layer.params[name] for name in layer.LSTMcellParams]
+    grads = T.grad(layer.finalOutputVal.sum(), wrt=params)
+    backwardFn = theano.function([inputMat], grads, name="benchForwardBackward")
+    results["lstmForwardBackward"] = timeIt(lambda: backwardFn(inputVal), repeats)
+
+    premiseOutputs = T.ftensor3(name="premiseOutputs")
+    hypothesisOutputs = T.ftensor3(name="hypothesisOutputs")
+    finalOutput = T.fmatrix(name="finalOutput")
+    premiseVal = np.random.randn(seqLen, batchSize, dimHidden).astype(np.float32)
+    hypothesisVal = np.random.randn(seqLen, batchSize, dimHidden).astype(np.float32)
+    finalVal = hypothesisVal[-1]
+
+    layer.initWordwiseAttnParams()
+    hstar = layer.applySentenceAttention(premiseOutputs, finalOutput, seqLen)
+    sentAttnFn = theano.function([premiseOutputs, finalOutput], hstar,
+                                 name="benchSentenceAttention")
+    results["sentenceAttention"] = timeIt(lambda: sentAttnFn(premiseVal, finalVal), repeats)
+
+    hstar = layer.applyWordwiseAttention(premiseOutputs, hypothesisOutputs, finalOutput,
+                                         batchSize, seqLen, seqLen)
+    wordAttnFn = theano.function([premiseOutputs, hypothesisOutputs, finalOutput], hstar,
+                                 name="benchWordwiseAttention")
+    results["wordwiseAttention"] = timeIt(
+        lambda: wordAttnFn(premiseVal, hypothesisVal, finalVal), repeats)
+
+    return results
+
+
+def benchNetwork(embedPath, dimInput, dimHidden, batchSize, seqLen, repeats):
+    results = {}
+    network = LSTMP2H(embedPath, None, None, None, None, None, None, None,
+                      HeKaimingInitializer(), dimHidden=dimHidden, dimInput=dimInput,
+                      numTimestepsPremise=seqLen, numTimestepsHypothesis=seqLen)
+    table = network.embeddingTable
+
+    inputPremise = T.ftensor3(name="inputPremise")
+    inputHypothesis = T.ftensor3(name="inputHypothesis")
+    yTarget = T.ivector(name="yTarget")
+    learnRate = T.scalar(name="learnRate", dtype='float32')
+    fGradSharedPremise, fGradSharedHypothesis, fUpdatePremise, fUpdateHypothesis, \
+        _, _, _ = network.trainFunc(inputPremise, inputHypothesis, yTarget, learnRate,
+                                    3., 0., 1., False, False, batchSize)
+    predictFunc = network.predictFunc(inputPremise, inputHypothesis, 1.)
+
+    premiseIdxMat = randomIdxMat(table, seqLen, batchSize)
+    hypothesisIdxMat = randomIdxMat(table, seqLen, batchSize)
+    premiseTensor = table.convertIdxMatToIdxTensor(premiseIdxMat)
+    hypothesisTensor = table.convertIdxMatToIdxTensor(hypothesisIdxMat)
+    labels = np.random.randint(0, 3, size=batchSize).astype(np.int32)
+
+    fGradSharedPremise(premiseTensor, hypothesisTensor, labels)
+    fGradSharedHypothesis(premiseTensor, hypothesisTensor, labels)
+    results["rmspropGrads"] = timeIt(
+        lambda: (fGradSharedPremise(premiseTensor, hypothesisTensor, labels),
+                 fGradSharedHypothesis(premiseTensor, hypothesisTensor, labels)), repeats)
+    results["rmspropUpdate"] = timeIt(
+        lambda: (fUpdatePremise(0.001), fUpdateHypothesis(0.001)), repeats)
+
+    results["computeAccuracy"] = timeIt(
+        lambda: network.computeAccuracy(premiseIdxMat, hypothesisIdxMat, labels,
+                                        predictFunc), repeats)
+
+    return results
+
+
+def run(args):
+    embedPath = os.path.join(tempfile.mkdtemp(), "embeddings.txt")
+    writeSyntheticEmbeddings(embedPath, args.vocabSize, args.dimEmbedding)
+    table = EmbeddingTable(embedPath)
+
+    results = {}
+    def addResults(caseResults, **config):
+        configString = ",".join("{0}={1}".format(k, config[k]) for k in sorted(config))
+        for name, timing in caseResults.iteritems():
+            results[name + "|" + configString] = timing
+            logger.Log("{0} [{1}]: {2:.6f}s".format(name, configString, timing["mean"]))
+
+    for batchSize in args.batchSizes:
+        for seqLen in args.seqLens:
+            addResults(benchEmbeddings(table, batchSize, seqLen, args.repeats),
+                       batch=batchSize, seqLen=seqLen)
+            for dimHidden in args.dimHiddens:
+                addResults(benchLSTMLayer(args.dimEmbedding, args.dimInput, dimHidden,
+                                          batchSize, seqLen, args.repeats),
+                           batch=batchSize, seqLen=seqLen, dimHidden=dimHidden)
+                addResults(benchNetwork(embedPath, args.dimInput, dimHidden, batchSize,
+                                        seqLen, args.repeats),
+                           batch=batchSize, seqLen=seqLen, dimHidden=dimHidden)
+
+    output = {"config": {"vocabSize": args.vocabSize, "dimEmbedding": args.dimEmbedding,
+                         "dimInput": args.dimInput, "floatX": theano.config.floatX,
+                         "device": theano.config.device},
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    logger.Log("Results written to {0}".format(args.output))
+
+
+def compare(args):
+    """
+    Compare mean timings against a baseline and flag cases that got slower
+    by more than the given threshold. Exits with status 1 on any regression.
+    """
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)["results"]
+    with open(args.current, "r") as f:
+        current = json.load(f)["results"]
+
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        ratio = current[name]["mean"] / max(baseline[name]["mean"], 1e-12)
+        flag = ""
+        if ratio > 1. + args.threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print "{0:<70} {1:>10.6f} {2:>10.6f} {3:>6.2f}x {4}".format(
+            name, baseline[name]["mean"], current[name]["mean"], ratio, flag)
+
+    for name in sorted(set(baseline) ^ set(current)):
+        print "{0:<70} only in {1}".format(name, "baseline" if name in baseline else "current")
+
+    print "{0} regressions out of {1} cases".format(len(regressions),
+                                                    len(set(baseline) & set(current)))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="microbenchmarks for model components")
+    subparsers = parser.add_subparsers()
+
+    runParser = subparsers.add_parser("run", help="run benchmarks")
+    runParser.add_argument("--output", type=str, default="benchmarkResults.json",
+                           help="path to JSON file where results are written")
+    runParser.add_argument("--batchSizes", type=int, nargs="+", default=[1, 32, 128],
+                           help="batch sizes to benchmark")
+    runParser.add_argument("--dimHiddens", type=int, nargs="+", default=[64, 256],
+                           help="hidden layer dimensions to benchmark")
+    runParser.add_argument("--seqLens", type=int, nargs="+", default=[10, 25],
+                           help="sequence lengths to benchmark")
+    runParser.add_argument("--dimInput", type=int, default=100,
+                           help="dimension of input to LSTM cell")
+    runParser.add_argument("--dimEmbedding", type=int, default=50,
+                           help="dimension of synthetic word embeddings")
+    runParser.add_argument("--vocabSize", type=int, default=10000,
+                           help="number of words in synthetic embedding table")
+    runParser.add_argument("--repeats", type=int, default=5,
+                           help="number of timed calls per case")
+    runParser.set_defaults(func=run)
+
+    compareParser = subparsers.add_parser("compare", help="compare results to a baseline")
+    compareParser.add_argument("baseline", type=str, help="baseline results JSON")
+    compareParser.add_argument("current", type=str, help="current results JSON")
+    compareParser.add_argument("--threshold", type=float, default=0.1,
+                               help="relative slowdown above which a case is flagged")
+    compareParser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,241 @@
+""" End-to-end training throughput and scaling benchmark.
+
+Runs LSTMP2H.train (and the Lasagne sum_embeddings.main baseline) for a
+fixed number of steps on synthetic data over a sweep of batch sizes, hidden
+dimensions, unroll steps, attention modes and thread counts. Each run happens
+in its own process so thread settings and peak RSS are isolated.
+
+Usage:
+    python benchmarks/throughput.py --outDir throughput --steps 20 --batchSizes 32 128
+"""
+import argparse
+import cPickle
+import glob
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+
+rootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(rootDir)
+
+from util.synthetic_data import writeSyntheticEmbeddings, writeSyntheticSNLI
+
+ATTENTION_MODES = ["none", "sentence", "wordwise"]
+
+
+def prepareData(dataDir, numPairs, vocabSize, dimEmbedding):
+    """
+    Write synthetic embeddings and train/dev splits with at least 'numPairs'
+    labeled pairs to 'dataDir' unless they already exist there.
+    :return: Dict of paths to data files
+    """
+    paths = {"embedData": os.path.join(dataDir, "glove.synthetic.{0}d.txt".format(dimEmbedding))}
+    if not os.path.exists(dataDir):
+        os.makedirs(dataDir)
+    if not os.path.exists(paths["embedData"]):
+        writeSyntheticEmbeddings(paths["embedData"], vocabSize, dimEmbedding)
+
+    for split in ["train", "dev"]:
+        paths[split + "Data"] = os.path.join(dataDir, "snli_1.0_{0}.jsonl".format(split))
+        paths[split + "DataStats"] = os.path.join(dataDir, "{0}_dataStats.json".format(split))
+        if not os.path.exists(paths[split + "Data"]):
+            writeSyntheticSNLI(paths[split + "Data"], paths[split + "DataStats"], numPairs,
+                               vocabSize, noLabelRate=0.)
+    return paths
+
+
+def runWorker(configPath):
+    """
+    Train a single configuration in the current process and write its
+    metrics to 'result.json' in the current directory.
+    """
+    with open(configPath, "r") as f:
+        config = json.load(f)
+    paths = config["paths"]
+    numExamples = config["steps"] * config["batchSize"]
+
+    if config["model"] == "lstmp2h":
+        from model.lstmp2h import LSTMP2H
+        from util.utils import HeKaimingInitializer
+
+        network = LSTMP2H(paths["embedData"], paths["trainData"], paths["trainDataStats"],
+                          paths["devData"], paths["devDataStats"], None, None, "train.log",
+                          HeKaimingInitializer(), dimHidden=config["dimHidden"],
+                          dimInput=config["dimInput"],
+                          numTimestepsPremise=config["unrollSteps"],
+                          numTimestepsHypothesis=config["unrollSteps"])
+        network.train(numEpochs=1, batchSize=config["batchSize"], learnRateVal=0.001,
+                      numExamplesToTrain=numExamples, dropoutRate=1.0,
+                      sentenceAttention=config["attention"] == "sentence",
+                      wordwiseAttention=config["attention"] == "wordwise")
+
+        # Stats pickles accuracies, costs and metrics at the end of training
+        with open(glob.glob("*.pickle")[0], "r") as f:
+            cPickle.load(f)
+            cPickle.load(f)
+            metrics = cPickle.load(f)
+    else:
+        from model import sum_embeddings
+
+        stats = sum_embeddings.main("sum_embeddings", paths["embedData"], paths["trainData"],
+                                    paths["trainDataStats"], paths["devData"],
+                                    paths["devDataStats"], "", config["batchSize"], 1,
+                                    config["unrollSteps"], 0.001, num_dense=2,
+                                    dense_dim=config["dimHidden"], penalty="l2", reg_coeff=0.0,
+                                    max_steps=config["steps"])
+        metrics = stats.metrics
+
+    def lastValue(name):
+        return metrics[name][-1][1] if metrics.get(name) else None
+
+    devEvalTimes = [value for _, value in metrics.get("devEvalTime", [])]
+    # Runs in which no batch was trained have no (or a 0) examples/sec
+    result = {"examplesPerSec": lastValue("trainExamplesPerSec") or None,
+              "timeToFirstBatch": lastValue("timeToFirstBatch"),
+              "devEvalTime": sum(devEvalTimes) / len(devEvalTimes) if devEvalTimes else None,
+              # ru_maxrss is in kilobytes on Linux
+              "peakRSSMB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.}
+    with open("result.json", "w") as f:
+        json.dump(result, f)
+
+
+def runConfig(config, outDir):
+    """
+    Run a configuration in a separate process with the requested number of threads.
+    :return: Dict of metrics, or None if the run failed
+    """
+    name = "{model}_attn-{attention}_batch{batchSize}_hidden{dimHidden}_" \
+           "unroll{unrollSteps}_threads{threads}".format(**config)
+    runDir = os.path.join(outDir, "runs", name)
+    if not os.path.exists(runDir):
+        os.makedirs(runDir)
+    configPath = os.path.join(runDir, "config.json")
+    with open(configPath, "w") as f:
+        json.dump(config, f)
+
+    env = dict(os.environ)
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        env[var] = str(config["threads"])
+
+    print "Running {0}".format(name)
+    with open(os.path.join(runDir, "output.log"), "w") as log:
+        returnCode = subprocess.call([sys.executable, os.path.abspath(__file__),
+                                      "--worker", configPath], cwd=runDir, env=env,
+                                     stdout=log, stderr=subprocess.STDOUT)
+    if returnCode != 0:
+        print "Run {0} failed; see {1}".format(name, os.path.join(runDir, "output.log"))
+        return None
+
+    with open(os.path.join(runDir, "result.json"), "r") as f:
+        return json.load(f)
+
+
+def plotResults(results, outDir):
+    """
+    Plot examples/sec and peak RSS against batch size, one figure per model
+    and attention mode and one line per remaining configuration.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    groups = sorted(set((r["model"], r["attention"]) for r in results))
+    for model, attention in groups:
+        for metric, yLabel in [("examplesPerSec", "Examples/sec"), ("peakRSSMB", "Peak RSS (MB)")]:
+            lines = {}
+            for r in results:
+                if (r["model"], r["attention"]) != (model, attention) or r[metric] is None:
+                    continue
+                label = "hidden={dimHidden} unroll={unrollSteps} threads={threads}".format(**r)
+                lines.setdefault(label, []).append((r["batchSize"], r[metric]))
+
+            for label, points in sorted(lines.iteritems()):
+                points.sort()
+                plt.plot([p[0] for p in points], [p[1] for p in points], marker="o", label=label)
+            plt.xscale("log", basex=2)
+            plt.xlabel("Batch size")
+            plt.ylabel(yLabel)
+            plt.title("{0} (attention: {1})".format(model, attention))
+            plt.legend(loc="best", fontsize="small")
+            plt.savefig(os.path.join(outDir, "{0}_{1}_{2}.png".format(model, attention, metric)))
+            plt.clf()
+
+
+def formatValue(value, fmt):
+    return fmt.format(value) if value is not None else "-"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="end-to-end training throughput benchmark")
+    parser.add_argument("--worker", type=str, default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--outDir", type=str, default="throughput",
+                        help="directory where runs, results table and plots are written")
+    parser.add_argument("--dataDir", type=str, default=None,
+                        help="directory with synthetic data; generated in outDir if not given")
+    parser.add_argument("--models", type=str, nargs="+", default=["lstmp2h"],
+                        choices=["lstmp2h", "sumEmbeddings"], help="models to benchmark")
+    parser.add_argument("--steps", type=int, default=20,
+                        help="number of training steps per run")
+    parser.add_argument("--batchSizes", type=int, nargs="+", default=[32, 128],
+                        help="batch sizes to sweep")
+    parser.add_argument("--dimHiddens", type=int, nargs="+", default=[128],
+                        help="hidden dimensions to sweep")
+    parser.add_argument("--unrollSteps", type=int, nargs="+", default=[20],
+                        help="unroll steps to sweep")
+    parser.add_argument("--attention", type=str, nargs="+", default=["none"],
+                        choices=ATTENTION_MODES, help="attention modes to sweep")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1],
+                        help="thread counts to sweep")
+    parser.add_argument("--dimInput", type=int, default=100,
+                        help="dimension of input to LSTM cell")
+    parser.add_argument("--dimEmbedding", type=int, default=50,
+                        help="dimension of synthetic embeddings")
+    parser.add_argument("--vocabSize", type=int, default=20000,
+                        help="size of synthetic vocabulary")
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        runWorker(args.worker)
+        sys.exit(0)
+
+    outDir = os.path.abspath(args.outDir)
+    dataDir = os.path.abspath(args.dataDir) if args.dataDir else os.path.join(outDir, "data")
+    paths = prepareData(dataDir, args.steps * max(args.batchSizes), args.vocabSize,
+                        args.dimEmbedding)
+
+    results = []
+    for model, attention, batchSize, dimHidden, unrollSteps, threads in itertools.product(
+            args.models, args.attention, args.batchSizes, args.dimHiddens, args.unrollSteps,
+            args.threads):
+        # Attention only applies to the LSTM model
+        if model == "sumEmbeddings" and attention != "none":
+            continue
+        config = {"model": model, "attention": attention, "batchSize": batchSize,
+                  "dimHidden": dimHidden, "unrollSteps": unrollSteps, "threads": threads,
+                  "dimInput": args.dimInput, "steps": args.steps, "paths": paths}
+        metrics = runConfig(config, outDir)
+        if metrics is not None:
+            config.update(metrics)
+            del config["paths"]
+            results.append(config)
+
+    with open(os.path.join(outDir, "results.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    header = "{0:<14} {1:<9} {2:>6} {3:>7} {4:>7} {5:>8} {6:>12} {7:>12} {8:>10} {9:>10}".format(
+        "model", "attention", "batch", "hidden", "unroll", "threads", "examples/s",
+        "firstBatch", "devEval", "peakRSS")
+    print header
+    print "-" * len(header)
+    for r in results:
+        print "{0:<14} {1:<9} {2:>6} {3:>7} {4:>7} {5:>8} {6:>12} {7:>12} {8:>10} {9:>10}".format(
+            r["model"], r["attention"], r["batchSize"], r["dimHidden"], r["unrollSteps"],
+            r["threads"], formatValue(r["examplesPerSec"], "{0:.1f}"),
+            formatValue(r["timeToFirstBatch"], "{0:.2f}s"),
+            formatValue(r["devEvalTime"], "{0:.2f}s"), formatValue(r["peakRSSMB"], "{0:.0f}MB"))
+
+    plotResults(results, outDir)
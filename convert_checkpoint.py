@@ -0,0 +1,37 @@
+""" Converts model files written before the checkpoint format of
+util/checkpoint (np.savez files of Network.saveModel, or files of
+utils.saveModel) to checkpoints, optionally storing params as float16.
+
+Usage:
+    python convert_checkpoint.py savedmodels/basicLSTM.npz savedmodels/basicLSTM.ckpt --float16
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from util.checkpoint import convertCheckpoint, loadCheckpoint, readHeader
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert model files to checkpoint format")
+    parser.add_argument("input", type=str, help="legacy model file or checkpoint")
+    parser.add_argument("output", type=str, help="path where checkpoint is written")
+    parser.add_argument("--float16", action="store_true",
+                        help="store floating point params as float16")
+    parser.add_argument("--config", type=str, default=None,
+                        help="JSON dict of model config to store in header, e.g. "
+                             "'{\"dimHidden\": 64, \"numTimestepsPremise\": 20}'")
+    args = parser.parse_args()
+
+    config = json.loads(args.config) if args.config else None
+    convertCheckpoint(args.input, args.output, config, args.float16)
+
+    header, _ = readHeader(args.output)
+    params, optimizerState, _ = loadCheckpoint(args.output)
+    print "Wrote {0}: {1} params, {2} optimizer state arrays, {3} bytes (was {4})".format(
+        args.output, len(params), len(optimizerState), os.path.getsize(args.output),
+        os.path.getsize(args.input))
+    print "Config: {0}".format(header["config"])
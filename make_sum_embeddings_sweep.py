@@ -28,8 +28,6 @@ FIXED_PARAMETERS = {
     "trainDataStats": "/afs/cs.stanford.edu/u/meric/scr/meric/LSTM-NLI/data/train_dataStats.json",
     "valData":    "/scr/nlp/data/snli_1.0/snli_1.0_dev.jsonl",
     "valDataStats": "/afs/cs.stanford.edu/u/meric/scr/meric/LSTM-NLI/data/dev_dataStats.json",
-    "testData": "/scr/nlp/data/snli_1.0/snli_1.0_test.jsonl",
-    "testDataStats": "/afs/cs.stanford.edu/u/meric/scr/meric/LSTM-NLI/data/test_dataStats.json",
     "embedData": "/scr/nlp/data/glove_vecs/glove.6B.50d.txt",
     #"unrollSteps": "20",
     #"clipping_max_value":  "3.0",
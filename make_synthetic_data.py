@@ -0,0 +1,68 @@
+""" Writes a synthetic GloVe-format embedding file and SNLI-format train/dev/test
+JSONL files with matching '*_dataStats.json' files, so that loaders, trainers
+and benchmarks can be run offline at any scale.
+"""
+import argparse
+import os
+
+from util.synthetic_data import writeSyntheticEmbeddings, writeSyntheticSNLI
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generate synthetic GloVe and SNLI data")
+    parser.add_argument("--outDir", type=str, default="synthetic_data",
+                        help="directory to write data files to")
+    parser.add_argument("--vocabSize", type=int, default=20000,
+                        help="number of words in vocabulary")
+    parser.add_argument("--dimEmbedding", type=int, default=50,
+                        help="dimension of embedding vectors")
+    parser.add_argument("--numTrain", type=int, default=10000,
+                        help="number of pairs in train split")
+    parser.add_argument("--numDev", type=int, default=1000,
+                        help="number of pairs in dev split")
+    parser.add_argument("--numTest", type=int, default=1000,
+                        help="number of pairs in test split")
+    parser.add_argument("--hypothesesPerPremise", type=int, default=3,
+                        help="number of hypotheses paired with each premise")
+    parser.add_argument("--meanLenPremise", type=float, default=14.,
+                        help="mean premise length in tokens")
+    parser.add_argument("--meanLenHypothesis", type=float, default=8.,
+                        help="mean hypothesis length in tokens")
+    parser.add_argument("--minLen", type=int, default=2,
+                        help="minimum sentence length")
+    parser.add_argument("--maxLen", type=int, default=80,
+                        help="maximum sentence length")
+    parser.add_argument("--lengthDistribution", type=str, default="lognormal",
+                        choices=["lognormal", "poisson", "uniform"],
+                        help="distribution sentence lengths are drawn from")
+    parser.add_argument("--oovRate", type=float, default=0.01,
+                        help="fraction of tokens without an embedding")
+    parser.add_argument("--noLabelRate", type=float, default=0.01,
+                        help="fraction of pairs with gold label '-'")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.outDir):
+        os.makedirs(args.outDir)
+
+    embedPath = os.path.join(args.outDir, "glove.synthetic.{0}d.txt".format(args.dimEmbedding))
+    writeSyntheticEmbeddings(embedPath, args.vocabSize, args.dimEmbedding, seed=args.seed)
+    print "Wrote embeddings to {0}".format(embedPath)
+
+    for splitIdx, (split, numPairs) in enumerate([("train", args.numTrain), ("dev", args.numDev),
+                                                  ("test", args.numTest)]):
+        dataPath = os.path.join(args.outDir, "snli_1.0_{0}.jsonl".format(split))
+        statsPath = os.path.join(args.outDir, "{0}_dataStats.json".format(split))
+        stats = writeSyntheticSNLI(dataPath, statsPath, numPairs, args.vocabSize,
+                                   hypothesesPerPremise=args.hypothesesPerPremise,
+                                   meanLenPremise=args.meanLenPremise,
+                                   meanLenHypothesis=args.meanLenHypothesis,
+                                   minLen=args.minLen, maxLen=args.maxLen,
+                                   distribution=args.lengthDistribution,
+                                   oovRate=args.oovRate, noLabelRate=args.noLabelRate,
+                                   seed=args.seed + splitIdx + 1)
+        # Histograms are too long to print
+        print "Wrote {0} pairs to {1}: {2}".format(numPairs, dataPath, {
+            name: value for name, value in stats.iteritems()
+            if not name.startswith("lengthHistogram")})
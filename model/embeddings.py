@@ -1,6 +1,8 @@
+import hashlib
 import json
 import numpy as np
 
+from util.dataset import isDataset, loadDataset, padIdxMatrix
 from util.load_snli_data import loadExampleSentences
 
 
@@ -157,11 +159,12 @@ class EmbeddingTable(object):
         matShape = idxMat.shape
         idxTensor = np.zeros((matShape[0], matShape[1], self.dimEmbeddings),
                              dtype=np.float32)
-        for tokenIdx in xrange(matShape[0]):
-            for sampleIdx in xrange(matShape[1]):
-                embeddingIdx = idxMat[tokenIdx, sampleIdx, 0]
-                idxTensor[tokenIdx, sampleIdx, :] = self.getEmbeddingfromIdx\
-                                                            (embeddingIdx)
+        # Idx are stored as floats with 'nan' padding; padding and idx outside
+        # the table get the zero vector
+        idx = idxMat[:, :, 0]
+        with np.errstate(invalid="ignore"):
+            inTable = (idx >= -len(self.embeddings)) & (idx < len(self.embeddings))
+        idxTensor[inTable] = self.embeddings[idx[inTable].astype(np.int64)]
         return idxTensor
 
 
@@ -178,16 +181,20 @@ class EmbeddingTable(object):
         return embeddingList
 
 
-    def convertDataToIdxMatrices(self, dataJSONFile, dataStats, pad='right'):
+    def convertDataToIdxMatrices(self, dataJSONFile, dataStats, pad='right', limit=None):
         """
         Converts data file to matrix of dim (# maxlength, # numSamples, 1)
         where the last dimension stores the idx of the word embedding.
-        :param dataJSONFile: File to data with sentences
+        :param dataJSONFile: File to data with sentences, or dataset file of util/dataset
         :param dataStats:
         :param pad: Whether to pad with zeros at beginning (left) or end (right)
+        :param limit: Number of examples to read from start of file; all if None
         :return:
         """
-        sentences = loadExampleSentences(dataJSONFile)
+        if isDataset(dataJSONFile):
+            return self._datasetToIdxMatrices(dataJSONFile, dataStats, pad, limit)
+
+        sentences = loadExampleSentences(dataJSONFile, limit)
 
         with open(dataStats, "r") as statsFile:
             statsJSON = json.load(statsFile)
@@ -206,8 +213,8 @@ class EmbeddingTable(object):
         hypothesisIdxMatrix.fill(np.nan)
 
         for idx, (premiseSent, hypothesisSent) in enumerate(sentences):
-            premiseIdxMat = np.array(self.convertSentListToIdxMatrix(premiseSent))[:, 0]
-            hypothesisIdxMat = np.array(self.convertSentListToIdxMatrix(hypothesisSent))[:, 0]
+            premiseIdxMat = np.array(self.convertSentListToIdxMatrix(premiseSent))
+            hypothesisIdxMat = np.array(self.convertSentListToIdxMatrix(hypothesisSent))
 
             if pad == 'right':
                 # Pad with zeros at end
@@ -221,6 +228,28 @@ class EmbeddingTable(object):
         return premiseIdxMatrix, hypothesisIdxMatrix
 
 
+    def _datasetToIdxMatrices(self, datasetFile, dataStats, pad, limit=None):
+        """
+        Build the idx matrices of convertDataToIdxMatrices from a preprocessed
+        dataset file, whose idx must refer to this table.
+        """
+        arrays, config = loadDataset(datasetFile, self, limit)
+        if dataStats is not None:
+            with open(dataStats, "r") as statsFile:
+                config = json.load(statsFile)
+
+        idxMatrices = []
+        for name in ["premise", "hypothesis"]:
+            maxSentLength = config["maxSentLen" + name[0].upper() + name[1:]]
+            idxMat, mask = padIdxMatrix(arrays[name + "Idx"], arrays[name + "Lengths"],
+                                        maxSentLength, pad, 0)
+            idxMat = idxMat.astype(np.float32)
+            idxMat[mask == 0] = np.nan
+            idxMatrices.append(np.ascontiguousarray(idxMat.T)[:, :, np.newaxis])
+
+        return tuple(idxMatrices)
+
+
     def convertDataToEmbeddingTensors(self, dataJSONFile, dataStats):
         """
         Reads in JSON file with SNLI sentences and convert to embedding tensor. Note
@@ -278,3 +307,17 @@ class EmbeddingTable(object):
 
         return sentences
 
+
+def vocabFingerprint(embeddingTable):
+    """
+    Return a hash of the words of an embedding table in idx order, so a model
+    can check it is used with the table it was trained with.
+    :param embeddingTable: EmbeddingTable or QuantizedEmbeddingTable
+    """
+    md5 = hashlib.md5()
+    for idx in xrange(len(embeddingTable.embeddings)):
+        word = embeddingTable.indexToWord.get(idx)
+        if isinstance(word, unicode):
+            word = word.encode("utf-8")
+        md5.update((word or "") + "\n")
+    return md5.hexdigest()
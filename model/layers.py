@@ -12,10 +12,36 @@ from util.utils import HeKaimingInitializer, GaussianDefaultInitializer, compute
 SEED = 100
 np.random.seed(SEED)
 rng = RandomStreams(SEED)
+normal = GaussianDefaultInitializer()
 
 logger = Logger(log_path="/Users/mihaileric/Documents/Research/LSTM-NLI/log/"
                          "experimentLog.txt")
 
+
+def getRngState(layers):
+    """
+    Return state of the dropout random streams of the given layers, in order
+    of creation within each layer.
+    :param layers: Layers of one network
+    """
+    return [stream.get_value() for layer in layers for stream in layer.rngStreams]
+
+
+def setRngState(layers, rngState):
+    """
+    Restore dropout random streams of the given layers to state returned by
+    getRngState. Graph of the layers must have been built the same way, so
+    streams are created in same order; other networks built in the same
+    process don't matter.
+    """
+    streams = [stream for layer in layers for stream in layer.rngStreams]
+    if len(rngState) != len(streams):
+        raise ValueError("Saved state has {0} random streams but graph has {1}".format(
+                         len(rngState), len(streams)))
+    for stream, value in zip(streams, rngState):
+        stream.set_value(value)
+
+
 # TODO: Refactor so that initialization of params is provided as an option
 
 class LSTMLayer(object):
@@ -36,6 +62,8 @@ class LSTMLayer(object):
         self.dimHidden = dimHiddenState
         self.dimEmbedding = dimEmbedding
         self.dropoutMode = dropoutMode
+        # State variables of dropout random streams created by this layer
+        self.rngStreams = []
 
         # Represents number of categories used for classification
         self.numLabels = numCategories
@@ -258,6 +286,8 @@ class LSTMLayer(object):
         Given predictions returned through softmax projection, compute
         cross entropy cost
         :param yPred: Output from LSTM with softmax applied
+        :param yTarget: int32 vector of label idx (sparse cross entropy), or
+                        one-hot matrix of labels
         :return: Loss for given predictions and targets
         """
         yPred = T.nnet.softmax(catOutput)
@@ -268,10 +298,12 @@ class LSTMLayer(object):
         """
         Computes accuracy for target and predicted values
         :param yPred:
-        :param yTarget:
+        :param yTarget: int32 vector of label idx, or one-hot matrix of labels
         :return:
         """
-        return T.mean(T.eq(T.argmax(yPred, axis=-1), T.argmax(yTarget, axis=-1)))
+        if yTarget.ndim == 2:
+            yTarget = T.argmax(yTarget, axis=-1)
+        return T.mean(T.eq(T.argmax(yPred, axis=-1), yTarget))
 
 
     # TODO: Make this into static method in utility module
@@ -284,8 +316,10 @@ class LSTMLayer(object):
         """
         # Explicit cast to float32 so that we don't accidentally get float64 tensor variables
         dropoutRate = theano.shared(np.array(dropoutRate).astype(np.float32))
-        transformed = T.switch(mode,
-            (tensor * rng.binomial(tensor.shape, p=dropoutRate, n=1, dtype=theano.config.floatX)),
+        numStreams = len(rng.state_updates)
+        mask = rng.binomial(tensor.shape, p=dropoutRate, n=1, dtype=theano.config.floatX)
+        self.rngStreams += [update[0] for update in rng.state_updates[numStreams:]]
+        transformed = T.switch(mode, tensor * mask,
             tensor * dropoutRate) # TODO: Make sure this refers to keep rate
         
         #print "tensor dtype: ", tensor.dtype
@@ -494,11 +528,15 @@ class LSTMLayer(object):
 
     def costFunc(self, inputPremise, inputHypothesis, yTarget, layer, L2regularization,
                  dropoutRate, premiseOutputs, batchSize, sentenceAttention=False, wordwiseAttention=False,
-                 numTimestepsHypothesis=1, numTimestepsPremise=1):
+                 numTimestepsHypothesis=1, numTimestepsPremise=1, inputs=None, givens=None):
         """
         Compute end-to-end cost function for a collection of input data.
         :param layer: whether we are doing a forward computation in the
                         premise or hypothesis layer
+        :param inputs: Symbolic inputs of compiled cost function; defaults to
+                       premise, hypothesis and targets
+        :param givens: Substitutions for symbolic variables of compiled function,
+                       e.g. to gather inputs from shared variables
         :return: Symbolic expression for cost function as well as theano function
                  for computing cost expression.
         """
@@ -529,24 +567,31 @@ class LSTMLayer(object):
         # Get params specific to cell and add L2 regularization to cost
         LSTMparams = [self.params[cParam] for cParam in self.LSTMcellParams]
         cost = cost + computeParamNorms(LSTMparams, L2regularization)
-        return cost, theano.function([inputPremise, inputHypothesis, yTarget],
-                                     cost, name='LSTM_cost_function', on_unused_input="warn")
+        if inputs is None:
+            inputs = [inputPremise, inputHypothesis, yTarget]
+        return cost, theano.function(inputs, cost, name='LSTM_cost_function',
+                                     givens=givens, on_unused_input="warn")
 
 
     # TODO: replace this with implementation in 'trainingUtils'
-    def computeGrads(self, inputPremise, inputHypothesis, yTarget, cost, gradMax):
+    def computeGrads(self, inputPremise, inputHypothesis, yTarget, cost, gradMax, inputs=None,
+                     givens=None):
         """
         Computes gradients for cost function with respect to all parameters.
         :param costFunc:
         :param gradMax: maximum gradient magnitude to use for clipping
+        :param inputs: Symbolic inputs of compiled gradient function; defaults to
+                       premise, hypothesis and targets
+        :param givens: Substitutions for symbolic variables of compiled function
         :return:
         """
         grads = T.grad(cost, wrt=self.params.values())
         # Clip grads to specific range to avoid parameter explosion
         gradsClipped = [T.clip(g, -gradMax, gradMax) for g in grads]
 
-        gradsFn = theano.function([inputPremise, inputHypothesis, yTarget],
-                                   gradsClipped, name='gradsFn')
+        if inputs is None:
+            inputs = [inputPremise, inputHypothesis, yTarget]
+        gradsFn = theano.function(inputs, gradsClipped, givens=givens, name='gradsFn')
         return grads, gradsFn
 
 
@@ -562,11 +607,15 @@ class LSTMLayer(object):
 
 
     # TODO: replace this with implementation in 'trainingUtils'
-    def rmsprop(self, grads, learnRate, inputPremise, inputHypothesis, yTarget, cost):
+    def rmsprop(self, grads, learnRate, inputPremise, inputHypothesis, yTarget, cost,
+                inputs=None, givens=None):
         """
         Return RMSprop updates for parameters of model.
         :param grads:
         :param learnRate:
+        :param inputs: Symbolic inputs of compiled gradient function; defaults to
+                       premise, hypothesis and targets
+        :param givens: Substitutions for symbolic variables of compiled function
         :return:
         """
         zippedGrads = []
@@ -577,28 +626,33 @@ class LSTMLayer(object):
 
             # Super hacky... to get the broadcasting to be compatible
             if paramPrefix[0:4] == "bias":
-                zippedGrads.append(theano.shared(p.get_value() * np.asarray(0.),
+                zippedGrads.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_grad" %k, broadcastable=(True, False)))
-                runningGrads2.append(theano.shared(p.get_value() * np.asarray(0.),
+                runningGrads2.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_rgrad2" %k, broadcastable=(True, False)))
-                updir.append(theano.shared(p.get_value() * np.asarray(0.),
+                updir.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_updir" %k, broadcastable=(True, False)))
             else:
-                zippedGrads.append(theano.shared(p.get_value() * np.asarray(0.),
+                zippedGrads.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_grad" %k))
-                runningGrads2.append(theano.shared(p.get_value() * np.asarray(0.),
+                runningGrads2.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_rgrad2" %k))
-                updir.append(theano.shared(p.get_value() * np.asarray(0.),
+                updir.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_updir" %k))
 
 
+        # Keep track of optimizer shared variables so they can be inspected/saved
+        self.optimizerState = zippedGrads + runningGrads2 + updir
+
         zgUpdate = [(zg, g) for zg, g in zip(zippedGrads, grads)]
         rg2Update = [(rg2, 0.95 * rg2 + 0.05 * (g ** 2))
              for rg2, g in zip(runningGrads2, grads)]
 
         # Computes cost but does not update params
-        fGradShared = theano.function([inputPremise, inputHypothesis, yTarget], cost,
-                                    updates=zgUpdate + rg2Update,
+        if inputs is None:
+            inputs = [inputPremise, inputHypothesis, yTarget]
+        fGradShared = theano.function(inputs, cost,
+                                    updates=zgUpdate + rg2Update, givens=givens,
                                     name='rmspropFGradShared')
 
         updirNew = [(ud, zg / T.sqrt(rg2 + 1e-4))
@@ -1,3 +1,4 @@
+import cPickle
 import layers
 import numpy as np
 import os
@@ -10,16 +11,22 @@ import time
 from model.embeddings import EmbeddingTable
 from model.layers import LSTMLayer
 from model.network import Network
+from model.quantization import dequantizeParams
+from model.shared_dataset import SharedDataset
 from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
 from util.afs_safe_logger import Logger
+from util.checkpoint import loadCheckpoint, loadTrainingState
+from util.batch_assembler import BatchAssembler
+from util.checkpoint_writer import AsyncCheckpointWriter
+from util.load_snli_data import decodeLabels
+from util.memory import MemoryProfiler
 from util.stats import Stats
-from util.utils import convertLabelsToMat, convertMatsToLabel, getMinibatchesIdx, \
-                        convertDataToTrainingBatch
+from util.utils import convertMatsToLabel, getMinibatchesIdx, dedupPremises
 
 # Set random seed for deterministic runs
 SEED = 100
 np.random.seed(SEED)
-currDir = os.path.dirname(os.path.dirname(__file__))
+currDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 class LSTMP2H(Network):
@@ -28,9 +35,10 @@ class LSTMP2H(Network):
     """
     def __init__(self, embedData, trainData, trainDataStats, valData, valDataStats,
                  testData, testDataStats, logPath, initializer, dimHidden=2,
-                 dimInput=2, numTimestepsPremise=1, numTimestepsHypothesis=1):
+                 dimInput=2, numTimestepsPremise=1, numTimestepsHypothesis=1, limit=None):
         """
         :param numTimesteps: Number of timesteps to unroll network for.
+        :param limit: Number of examples to read from start of each data file; all if None
         :param dataPath: Path to file with precomputed word embeddings
         :param batchSize: Number of samples to use in each iteration of
                          training
@@ -38,7 +46,7 @@ class LSTMP2H(Network):
         """
         super(LSTMP2H, self).__init__(embedData, logPath, trainData, trainDataStats, valData,
                                       valDataStats, testData, testDataStats,
-                                      numTimestepsPremise, numTimestepsHypothesis)
+                                      numTimestepsPremise, numTimestepsHypothesis, limit)
         self.configs = locals()
 
         self.initializer = initializer
@@ -48,42 +56,100 @@ class LSTMP2H(Network):
 
         # shared variable to keep track of whether to apply dropout in training/testing
         # 0. = testing; 1. = training
-        self.dropoutMode = theano.shared(0.0)
+        self.dropoutMode = theano.shared(np.float32(0.))
 
         self.buildModel()
 
 
-    # TODO: Check that this actually works-- I'm skeptical
     def loadModel(self, modelFileName):
         """
         Loads the given model and sets the parameters of the network to the
-        loaded parameter values
-        :param modelFileName:
+        loaded parameter values. Optimizer state is restored too if the model
+        has it and training functions have already been built, and so is the
+        UNK vector of the embedding table.
+        :param modelFileName: Checkpoint or legacy '.npz' file
         """
-        with open(modelFileName, 'r') as f:
-            params = np.load(f)
-            premiseParams = {}
-            for paramName, paramVal in params.iteritems():
-                paramPrefix, layerName = paramName.split("_")
-
-                # Set hypothesis params
-                try:
-                    self.hiddenLayerHypothesis.params[paramName].set_value(paramVal)
-                except:
-                    if paramPrefix[0:4] == "bias": # Hacky
-                        self.hiddenLayerHypothesis.params[paramName] = \
-                            theano.shared(paramVal, broadcastable=(True, False))
-                    else:
-                        self.hiddenLayerHypothesis.params[paramName] = \
-                            theano.shared(paramVal)
-
-                # Find params of premise layer
-                if layerName == "premiseLayer":
-                    premiseParams[paramName] = paramVal
-
-            # Set premise params
-            for paramName, paramVal in premiseParams.iteritems():
-                self.hiddenLayerPremise.params[paramName].set_value(paramVal)
+        params, optimizerState, config = loadCheckpoint(modelFileName)
+        params = dequantizeParams(params, config)
+        layers = {layer.layerName: layer for layer in self.layers}
+        for paramName, paramVal in params.iteritems():
+            paramPrefix, layerName = paramName.split("_")
+            layer = layers[layerName]
+            paramVal = np.array(paramVal)
+
+            if paramName in layer.params:
+                layer.params[paramName].set_value(paramVal)
+            elif paramPrefix[0:4] == "bias": # Hacky
+                layer.params[paramName] = theano.shared(paramVal, name=paramName,
+                                                        broadcastable=(True, False))
+            else:
+                # e.g. attention params if attention hasn't been initialized yet
+                layer.params[paramName] = theano.shared(paramVal, name=paramName)
+
+        for layer in self.layers:
+            for state in getattr(layer, "optimizerState", []):
+                if state.name in optimizerState:
+                    state.set_value(np.array(optimizerState[state.name]))
+
+        # UNK vector drawn when the table was built depends on what else used
+        # the global numpy RNG before, e.g. other networks built in this process
+        if "unkEmbedding" in config and self.embeddingTable.embeddings is not None:
+            self.embeddingTable.embeddings[-2] = config["unkEmbedding"]
+
+
+    def saveTrainingCheckpoint(self, modelFileName, cursor, stats, writer=None):
+        """
+        Saves everything needed to resume training bit-exactly: params,
+        optimizer state, position in the data, numpy and dropout RNG state and
+        stats history. File is written under a temporary name and then renamed,
+        so a job killed mid-write leaves the previous checkpoint intact.
+        :param cursor: Dict of epoch, batch within epoch and example counters
+        :param stats: Stats of current run
+        :param writer: AsyncCheckpointWriter to write checkpoint in background
+        """
+        trainingState = {"cursor_" + key: np.array(value) for key, value in cursor.iteritems()}
+
+        _, keys, pos, hasGauss, cachedGaussian = np.random.get_state()
+        trainingState.update({"numpyRngKeys": keys, "numpyRngPos": np.array(pos),
+                              "numpyRngHasGauss": np.array(hasGauss),
+                              "numpyRngCachedGaussian": np.array(cachedGaussian)})
+        for idx, state in enumerate(layers.getRngState(self.layers)):
+            trainingState["dropoutRngState_{0:03d}".format(idx)] = state
+        trainingState["stats"] = np.frombuffer(cPickle.dumps(stats.getState(), 2),
+                                               dtype=np.uint8)
+
+        # Params and optimizer state are copied out of shared variables, so
+        # training can continue while writer saves them
+        self.extractParams()
+        if writer is not None:
+            self.saveModel(modelFileName, trainingState=trainingState, writer=writer)
+        else:
+            self.saveModel(modelFileName + ".tmp", trainingState=trainingState)
+            os.rename(modelFileName + ".tmp", modelFileName)
+
+
+    def loadTrainingCheckpoint(self, modelFileName, stats):
+        """
+        Restores a checkpoint saved by saveTrainingCheckpoint. Training functions
+        must already be built so optimizer state and dropout RNG exist.
+        :param stats: Stats of current run, set to saved history
+        :return: Cursor dict saved with checkpoint
+        """
+        self.loadModel(modelFileName)
+        trainingState = loadTrainingState(modelFileName)
+
+        cursor = {key[len("cursor_"):]: value.item() for key, value in trainingState.iteritems()
+                  if key.startswith("cursor_")}
+        np.random.set_state(("MT19937", trainingState["numpyRngKeys"],
+                             int(trainingState["numpyRngPos"]),
+                             int(trainingState["numpyRngHasGauss"]),
+                             float(trainingState["numpyRngCachedGaussian"])))
+        layers.setRngState(self.layers, [value for key, value in
+                                         sorted(trainingState.iteritems())
+                                         if key.startswith("dropoutRngState_")])
+        stats.setState(cPickle.loads(trainingState["stats"].tostring()))
+
+        return cursor
 
 
     def buildModel(self):
@@ -109,14 +175,20 @@ class LSTMP2H(Network):
 
     def trainFunc(self, inputPremise, inputHypothesis, yTarget, learnRate, gradMax,
                   L2regularization, dropoutRate, sentenceAttention, wordwiseAttention,
-                  batchSize, optimizer="rmsprop"):
+                  batchSize, optimizer="rmsprop", premiseIdx=None, inputs=None, givens=None):
         """
         Defines theano training function for layer, including forward runs and backpropagation.
         Takes as input the necessary symbolic variables.
+        :param premiseIdx: Symbolic int vector giving for each example the position
+                           of its premise in inputPremise, if premises are deduplicated
+        :param inputs: Symbolic inputs of compiled functions, if premise, hypothesis
+                       and targets are substituted by givens
+        :param givens: Substitutions for symbolic variables of compiled functions
         """
+        sharedInputs = inputs is not None
+        if not sharedInputs:
+            inputs = [inputPremise, inputHypothesis, yTarget]
 
-        # TODO: First extract relevant inputPremise/inputHypothesis
-        # Given vector of minibatch indices --> extract from shared premise/hypothesis matrices
         if sentenceAttention:
             self.hiddenLayerHypothesis.initSentAttnParams()
 
@@ -126,27 +198,42 @@ class LSTMP2H(Network):
         self.hiddenLayerPremise.forwardRun(inputPremise, timeSteps=self.numTimestepsPremise) # Set numtimesteps here
         premiseOutputVal = self.hiddenLayerPremise.finalOutputVal
         premiseOutputCellState = self.hiddenLayerPremise.finalCellState
+        premiseOutputs = self.hiddenLayerPremise.allOutputs
+
+        if premiseIdx is not None:
+            # Broadcast states of each unique premise to all of its hypotheses. The
+            # gradient of the gather sums contributions of hypotheses sharing a premise
+            premiseOutputVal = premiseOutputVal[premiseIdx]
+            premiseOutputCellState = premiseOutputCellState[premiseIdx]
+            premiseOutputs = premiseOutputs[:, premiseIdx]
+            if not sharedInputs:
+                inputs.append(premiseIdx)
 
         self.hiddenLayerHypothesis.setInitialLayerParams(premiseOutputVal, premiseOutputCellState)
         cost, costFn = self.hiddenLayerHypothesis.costFunc(inputPremise,
                                     inputHypothesis, yTarget, "hypothesis",
-                                    L2regularization, dropoutRate, self.hiddenLayerPremise.allOutputs, batchSize,
+                                    L2regularization, dropoutRate, premiseOutputs, batchSize,
                                     sentenceAttention=sentenceAttention,
                                     wordwiseAttention=wordwiseAttention,
                                     numTimestepsHypothesis=self.numTimestepsHypothesis,
-                                    numTimestepsPremise=self.numTimestepsPremise)
+                                    numTimestepsPremise=self.numTimestepsPremise,
+                                    inputs=inputs, givens=givens)
 
         gradsHypothesis, gradsHypothesisFn = self.hiddenLayerHypothesis.computeGrads(inputPremise,
-                                                inputHypothesis, yTarget, cost, gradMax)
+                                                inputHypothesis, yTarget, cost, gradMax,
+                                                inputs=inputs, givens=givens)
 
         gradsPremise, gradsPremiseFn = self.hiddenLayerPremise.computeGrads(inputPremise,
-                                                inputHypothesis, yTarget, cost, gradMax)
+                                                inputHypothesis, yTarget, cost, gradMax,
+                                                inputs=inputs, givens=givens)
 
         fGradSharedHypothesis, fUpdateHypothesis = self.hiddenLayerHypothesis.rmsprop(
-            gradsHypothesis, learnRate, inputPremise, inputHypothesis, yTarget, cost)
+            gradsHypothesis, learnRate, inputPremise, inputHypothesis, yTarget, cost,
+            inputs=inputs, givens=givens)
 
         fGradSharedPremise, fUpdatePremise = self.hiddenLayerPremise.rmsprop(
-            gradsPremise, learnRate, inputPremise, inputHypothesis, yTarget, cost)
+            gradsPremise, learnRate, inputPremise, inputHypothesis, yTarget, cost,
+            inputs=inputs, givens=givens)
 
 
         return (fGradSharedPremise, fGradSharedHypothesis, fUpdatePremise,
@@ -155,58 +242,105 @@ class LSTMP2H(Network):
 
     def train(self, numEpochs=1, batchSize=5, learnRateVal=0.1, numExamplesToTrain=-1, gradMax=3.,
                 L2regularization=0.0, dropoutRate=0.0, sentenceAttention=False,
-                wordwiseAttention=False):
+                wordwiseAttention=False, memoryProfile=False, premiseDedup=False,
+                checkpointFreq=0, checkpointPath=None, resume=False, keepCheckpoints=1,
+                checkpointScratchDir=None, sharedData=False, sharedDataMaxBytes=None):
         """
         Takes care of training model, including propagation of errors and updating of
         parameters.
+        :param memoryProfile: Whether to log memory snapshots after loading data,
+                              compiling, the first step and dev set evaluation
+        :param premiseDedup: Whether to run premise layer once per unique premise
+                             in each minibatch
+        :param checkpointFreq: Number of minibatches between training checkpoints;
+                               0 disables checkpointing
+        :param checkpointPath: Path of training checkpoint; derived from config
+                               if not given
+        :param resume: Whether to continue from training checkpoint if it exists
+        :param keepCheckpoints: Number of most recent training checkpoints kept
+        :param checkpointScratchDir: Local directory training checkpoints are
+                                     written to before being moved to checkpointPath
+        :param sharedData: Whether to hold data in shared variables and feed compiled
+                           functions only minibatch idx
+        :param sharedDataMaxBytes: Max bytes of data held in shared variables at a
+                                   time; larger data is held in windows. Unbounded if None
         """
         expName = "Epochs_{0}_LRate_{1}_L2Reg_{2}_dropout_{3}_sentAttn_{4}_" \
                        "wordAttn_{5}".format(str(numEpochs), str(learnRateVal),
                                              str(L2regularization), str(dropoutRate),
                                              str(sentenceAttention), str(wordwiseAttention))
         self.configs.update(locals())
-        trainPremiseIdxMat, trainHypothesisIdxMat = self.embeddingTable.convertDataToIdxMatrices(
-                                  self.trainData, self.trainDataStats)
-        trainGoldLabel = convertLabelsToMat(self.trainData)
-
-        valPremiseIdxMat, valHypothesisIdxMat = self.embeddingTable.convertDataToIdxMatrices(
-                                self.valData, self.valDataStats)
-        valGoldLabel = convertLabelsToMat(self.valData)
+        trainStart = time.time()
 
-        # If you want to train on less than full dataset
+        # If you want to train on less than full dataset, only read as many
+        # examples as are used
+        valSplit = self.valSplit
         if numExamplesToTrain > 0:
-            valPremiseIdxMat = valPremiseIdxMat[:, range(numExamplesToTrain), :]
-            valHypothesisIdxMat = valHypothesisIdxMat[:, range(numExamplesToTrain), :]
-            valGoldLabel = valGoldLabel[range(numExamplesToTrain)]
-
+            valSplit = self.valSplit.head(numExamplesToTrain)
+        valPremiseIdxMat, valHypothesisIdxMat = valSplit.idxMatrices()
+        valGoldLabel = valSplit.labels()
+
+        memoryProfiler = MemoryProfiler(self.logger) if memoryProfile else None
+        # Eval snapshot is taken at the first dev evaluation
+        evalSnapshotTaken = False
+        sharedDataset = None
+        def datasets():
+            arrays = {"trainData": self.trainSplit.loadedArrays(),
+                      "valData": valSplit.loadedArrays()}
+            if sharedDataset:
+                arrays["sharedData"] = [var.get_value(borrow=True)
+                                        for var in sharedDataset.sharedVariables()]
+            return arrays
+        if memoryProfiler:
+            memoryProfiler.snapshot("load", self.memoryComponents(datasets()))
 
         #Whether zero-padded on left or right
         pad = "right"
 
-        # Get full premise/hypothesis tensors
-        # batchPremiseTensor, batchHypothesisTensor, batchLabels = \
-        #             convertDataToTrainingBatch(valPremiseIdxMat, self.numTimestepsPremise, valHypothesisIdxMat,
-        #                                        self.numTimestepsHypothesis, "right", self.embeddingTable,
-        #                                        valGoldLabel, range(len(valGoldLabel)))
-        #sharedValPremise = theano.shared(batchPremiseTensor)
-        #sharedValHypothesis = theano.shared(batchHypothesisTensor)
-        #sharedValLabels = theano.shared(batchLabels)
-
-
         inputPremise = T.ftensor3(name="inputPremise")
         inputHypothesis = T.ftensor3(name="inputHypothesis")
-        yTarget = T.fmatrix(name="yTarget")
+        yTarget = T.ivector(name="yTarget")
         learnRate = T.scalar(name="learnRate", dtype='float32')
-
+        premiseIdx = T.ivector(name="premiseIdx") if premiseDedup else None
+
+        # With shared data, functions take idx of examples within the current
+        # window and gather premise/hypothesis tensors and labels themselves
+        inputs = givens = predictInputs = predictGivens = None
+        if sharedData:
+            sharedDataset = SharedDataset(self.embeddingTable, valPremiseIdxMat,
+                                          valHypothesisIdxMat, valGoldLabel,
+                                          self.numTimestepsPremise, self.numTimestepsHypothesis,
+                                          pad, batchSize, sharedDataMaxBytes)
+            self.logger.Log("Holding data in shared variables as {0} windows of {1} "
+                            "examples".format(sharedDataset.numWindows, sharedDataset.windowSize))
+            batchIdx = T.ivector(name="batchIdx")
+            premiseBatchIdx = T.ivector(name="premiseBatchIdx") if premiseDedup else None
+            inputs = [batchIdx] + ([premiseBatchIdx, premiseIdx] if premiseDedup else [])
+            givens = sharedDataset.givens(batchIdx, inputPremise, inputHypothesis, yTarget,
+                                          premiseBatchIdx)
+            predictInputs = [batchIdx]
+            predictGivens = sharedDataset.givens(batchIdx, inputPremise, inputHypothesis)
 
         fGradSharedHypothesis, fGradSharedPremise, fUpdatePremise, \
             fUpdateHypothesis, costFn, _, _ = self.trainFunc(inputPremise,
                                             inputHypothesis, yTarget, learnRate, gradMax,
                                             L2regularization, dropoutRate, sentenceAttention,
-                                            wordwiseAttention, batchSize)
+                                            wordwiseAttention, batchSize, premiseIdx=premiseIdx,
+                                            inputs=inputs, givens=givens)
 
         totalExamples = 0
-        stats = Stats(self.logger, expName)
+        totalUniquePremises = 0
+        stats = Stats(expName, self.logger)
+        # Time spent in training steps, excluding dev set evaluation
+        trainTime = 0.
+
+        configString = "batch={0},epoch={1},learnRate={2},dimHidden={3},dimInput={4}".format(str(batchSize),
+                                            str(numEpochs), str(learnRateVal),
+                                            str(self.dimHidden), str(self.dimInput))
+        if not os.path.exists(currDir + "/savedmodels"):
+            os.makedirs(currDir + "/savedmodels")
+        if checkpointPath is None:
+            checkpointPath = currDir + "/savedmodels/trainState_"+configString+".ckpt"
 
         # Training
         self.logger.Log("Model configs: {0}".format(self.configs))
@@ -215,18 +349,64 @@ class LSTMP2H(Network):
             numEpochs, batchSize, learnRateVal, L2regularization, dropoutRate))
 
 
-        predictFunc = self.predictFunc(inputPremise, inputHypothesis, dropoutRate)
-
-        for epoch in xrange(numEpochs):
+        predictFunc = self.predictFunc(inputPremise, inputHypothesis, dropoutRate,
+                                       predictInputs, predictGivens)
+        def devAccuracy():
+            if sharedDataset:
+                return self.computeSharedAccuracy(sharedDataset, predictFunc)
+            return self.computeAccuracy(valPremiseIdxMat, valHypothesisIdxMat, valGoldLabel,
+                                        predictFunc)
+        if memoryProfiler:
+            memoryProfiler.snapshot("compile", self.memoryComponents(datasets()))
+
+        numTrainExamples = numExamplesToTrain if numExamplesToTrain > 0 else len(self.trainSplit)
+        batchesPerEpoch = len(getMinibatchesIdx(numTrainExamples, batchSize))
+
+        # Restore after all functions are built so optimizer state and
+        # dropout random streams exist
+        cursor = {"epoch": 0, "batch": 0, "numExamples": 0}
+        if resume and os.path.exists(checkpointPath):
+            cursor = self.loadTrainingCheckpoint(checkpointPath, stats)
+            totalExamples = cursor["totalExamples"]
+            totalUniquePremises = cursor["totalUniquePremises"]
+            trainTime = cursor["trainTime"]
+            if cursor["epoch"] * batchesPerEpoch + cursor["batch"] >= numEpochs * batchesPerEpoch:
+                self.logger.Log("Checkpoint {0} is of a run that finished all {1} epochs; "
+                                "nothing to resume".format(checkpointPath, numEpochs))
+                self.trainSplit.free()
+                valSplit.free()
+                return
+            self.logger.Log("Resuming from {0} at epoch {1}, batch {2}".format(
+                            checkpointPath, cursor["epoch"], cursor["batch"]))
+            if sharedDataset:
+                # Pick up UNK vector restored with the checkpoint
+                sharedDataset.embeddings.set_value(self.embeddingTable.embeddings, borrow=True)
+
+        numBatches = 0
+        # Batches are gathered into a ring of reused buffers
+        batchAssembler = None
+        if not sharedDataset:
+            batchAssembler = BatchAssembler(self.embeddingTable, batchSize,
+                                            self.numTimestepsPremise, self.numTimestepsHypothesis)
+        checkpointWriter = None
+        if checkpointFreq > 0:
+            checkpointWriter = AsyncCheckpointWriter(checkpointScratchDir, keepCheckpoints)
+        # Time training loop spent snapshotting checkpoints
+        checkpointTime = 0.
+
+        for epoch in xrange(cursor["epoch"], numEpochs):
             self.logger.Log("Epoch number: %d" %(epoch))
 
-            if numExamplesToTrain > 0:
-                minibatches = getMinibatchesIdx(numExamplesToTrain, batchSize)
-            else:
-                minibatches = getMinibatchesIdx(len(trainGoldLabel), batchSize)
+            minibatches = getMinibatchesIdx(numTrainExamples, batchSize)
 
             numExamples = 0
-            for _, minibatch in minibatches:
+            if epoch == cursor["epoch"]:
+                # Skip minibatches trained on before checkpoint
+                minibatches = minibatches[cursor["batch"]:]
+                numExamples = cursor["numExamples"]
+
+            for batchNum, minibatch in minibatches:
+                stepStart = time.time()
                 self.dropoutMode.set_value(1.0)
                 numExamples += len(minibatch)
                 totalExamples += len(minibatch)
@@ -234,43 +414,95 @@ class LSTMP2H(Network):
                 self.logger.Log("Processed {0} examples in current epoch".
                                 format(str(numExamples)))
 
-                batchPremiseTensor, batchHypothesisTensor, batchLabels = \
-                    convertDataToTrainingBatch(valPremiseIdxMat, self.numTimestepsPremise, valHypothesisIdxMat,
-                                               self.numTimestepsHypothesis, pad, self.embeddingTable,
-                                               valGoldLabel, minibatch)
-
-                gradHypothesisOut = fGradSharedHypothesis(batchPremiseTensor,
-                                       batchHypothesisTensor, batchLabels)
-                gradPremiseOut = fGradSharedPremise(batchPremiseTensor,
-                                       batchHypothesisTensor, batchLabels)
+                if premiseDedup:
+                    uniqueMinibatch, batchPremiseIdx = dedupPremises(valPremiseIdxMat,
+                                            self.numTimestepsPremise, pad, minibatch)
+                    totalUniquePremises += len(uniqueMinibatch)
+                else:
+                    uniqueMinibatch = None
+
+                if sharedDataset and premiseDedup:
+                    batchInputs = sharedDataset.localIdx(minibatch, uniqueMinibatch) + \
+                                  [batchPremiseIdx]
+                elif sharedDataset:
+                    batchInputs = sharedDataset.localIdx(minibatch)
+                else:
+                    batchPremiseTensor, batchHypothesisTensor, batchLabels = \
+                        batchAssembler.assemble(valPremiseIdxMat, valHypothesisIdxMat,
+                                                valGoldLabel, minibatch, pad,
+                                                premiseMinibatch=uniqueMinibatch)
+                    batchInputs = [batchPremiseTensor, batchHypothesisTensor, batchLabels]
+                    if premiseDedup:
+                        batchInputs.append(batchPremiseIdx)
+
+                gradHypothesisOut = fGradSharedHypothesis(*batchInputs)
+                gradPremiseOut = fGradSharedPremise(*batchInputs)
                 fUpdatePremise(learnRateVal)
                 fUpdateHypothesis(learnRateVal)
 
-                predictLabels = self.predict(batchPremiseTensor, batchHypothesisTensor, predictFunc)
+                if sharedDataset:
+                    predictLabels = decodeLabels(predictFunc(batchInputs[0]))
+                elif premiseDedup:
+                    # Prediction function takes a premise per example
+                    predictLabels = self.predict(batchPremiseTensor[:, batchPremiseIdx],
+                                                 batchHypothesisTensor, predictFunc)
+                else:
+                    predictLabels = self.predict(batchPremiseTensor, batchHypothesisTensor,
+                                                 predictFunc)
                 #self.logger.Log("Labels in epoch {0}: {1}".format(epoch, str(predictLabels)))
 
 
-                cost = costFn(batchPremiseTensor, batchHypothesisTensor, batchLabels)
+                cost = costFn(*batchInputs)
                 stats.recordCost(totalExamples, cost)
 
+                trainTime += time.time() - stepStart
+                if totalExamples == len(minibatch):
+                    stats.recordMetric(totalExamples, "timeToFirstBatch", time.time() - trainStart)
+                    if memoryProfiler:
+                        memoryProfiler.snapshot("firstStep", self.memoryComponents(datasets()))
+
                 # Note: Big time sink happens here
                 if totalExamples%(100) == 0:
                     # TODO: Don't compute accuracy of dev set
                     self.dropoutMode.set_value(0.0)
-                    devAccuracy = self.computeAccuracy(valPremiseIdxMat,
-                                                       valHypothesisIdxMat, valGoldLabel, predictFunc)
-                    stats.recordAcc(totalExamples, devAccuracy, "dev")
-
-
+                    evalStart = time.time()
+                    accuracy = devAccuracy()
+                    stats.recordMetric(totalExamples, "devEvalTime", time.time() - evalStart)
+                    stats.recordAcc(totalExamples, accuracy, "dev")
+                    if memoryProfiler and not evalSnapshotTaken:
+                        memoryProfiler.snapshot("eval", self.memoryComponents(datasets()))
+                        evalSnapshotTaken = True
+
+                numBatches += 1
+                if checkpointFreq > 0 and numBatches % checkpointFreq == 0:
+                    checkpointStart = time.time()
+                    self.saveTrainingCheckpoint(checkpointPath,
+                        {"epoch": epoch, "batch": batchNum + 1, "numExamples": numExamples,
+                         "totalExamples": totalExamples,
+                         "totalUniquePremises": totalUniquePremises,
+                         "trainTime": trainTime}, stats, checkpointWriter)
+                    checkpointTime += time.time() - checkpointStart
+                    self.logger.Log("Queued training checkpoint for {0}".format(checkpointPath))
+
+
+        stats.recordMetric(totalExamples, "trainExamplesPerSec",
+                           totalExamples / trainTime if trainTime > 0 else 0.)
+        for name, value in (sharedDataset or batchAssembler).stats().iteritems():
+            stats.recordMetric(totalExamples, name, value)
+        if checkpointWriter:
+            checkpointWriter.close()
+            for name, value in checkpointWriter.stats().iteritems():
+                stats.recordMetric(totalExamples, name, value)
+            stats.recordMetric(totalExamples, "checkpointBlockingSec", checkpointTime)
+        if premiseDedup and totalExamples > 0:
+            stats.recordMetric(totalExamples, "uniquePremiseFraction",
+                               totalUniquePremises / float(totalExamples))
         stats.recordFinalTrainingTime(totalExamples)
 
         # Save model to disk
         self.logger.Log("Saving model...")
         self.extractParams()
-        configString = "batch={0},epoch={1},learnRate={2},dimHidden={3},dimInput={4}".format(str(batchSize),
-                                            str(numEpochs), str(learnRateVal),
-                                            str(self.dimHidden), str(self.dimInput))
-        self.saveModel(currDir + "/savedmodels/basicLSTM_"+configString+".npz")
+        self.saveModel(currDir + "/savedmodels/basicLSTM_"+configString+".ckpt")
         self.logger.Log("Model saved!")
 
         # Set dropout to 0. again for testing
@@ -282,16 +514,27 @@ class LSTMP2H(Network):
         # self.logger.Log("Final training accuracy: {0}".format(trainAccuracy))
 
         # Val Accuracy
-        valAccuracy = self.computeAccuracy(valPremiseIdxMat,
-                                    valHypothesisIdxMat, valGoldLabel, predictFunc)
+        evalStart = time.time()
+        valAccuracy = devAccuracy()
+        stats.recordMetric(totalExamples, "devEvalTime", time.time() - evalStart)
+        if memoryProfiler:
+            memoryProfiler.snapshot("finalEval", self.memoryComponents(datasets()))
+            memoryProfiler.recordMetrics(stats, totalExamples)
         # TODO: change -1 for training acc to actual value when I enable train computation
         stats.recordFinalStats(totalExamples, -1, valAccuracy)
 
+        # Data is read again if train is called again
+        self.trainSplit.free()
+        valSplit.free()
+
 
-    def predictFunc(self, symPremise, symHypothesis, dropoutRate):
+    def predictFunc(self, symPremise, symHypothesis, dropoutRate, inputs=None, givens=None):
         """
         Produces a theano prediction function for outputting the label of a given input.
         Takes as input a symbolic premise and a symbolic hypothesis.
+        :param inputs: Symbolic inputs of function, if premise and hypothesis
+                       are substituted by givens
+        :param givens: Substitutions for symbolic variables of function
         :return: Theano function for generating probability distribution over labels.
         """
         self.hiddenLayerPremise.forwardRun(symPremise, timeSteps=self.numTimestepsPremise)
@@ -311,4 +554,6 @@ class LSTMP2H(Network):
 
         labelIdx = softMaxOut.argmax(axis=1)
 
-        return theano.function([symPremise, symHypothesis], labelIdx, name="predictLabelsFunction")
+        if inputs is None:
+            inputs = [symPremise, symHypothesis]
+        return theano.function(inputs, labelIdx, givens=givens, name="predictLabelsFunction")
@@ -4,9 +4,13 @@ import theano
 # Hacky way to ensure that theano can find NVCC compiler
 os.environ["PATH"] += ":/usr/local/cuda/bin"
 
-from model.embeddings import EmbeddingTable
+from model.embeddings import EmbeddingTable, vocabFingerprint
 from util.afs_safe_logger import Logger
-from util.utils import convertDataToTrainingBatch, getMinibatchesIdx
+from util.batch_assembler import BatchAssembler
+from util.checkpoint import saveCheckpoint, serializableConfig
+from util.load_snli_data import decodeLabels
+from util.memory import arrayBytes, sharedBytes
+from util.utils import convertLabelsToIdx, getMinibatchesIdx
 
 # Set random seed for deterministic runs
 SEED = 100
@@ -15,12 +19,88 @@ np.random.seed(SEED)
 currDir = os.path.dirname(os.path.dirname(__file__))
 
 
+class DataSplit(object):
+    """
+    Split of data (e.g. train or dev) that is only read when its idx
+    matrices or labels are first used, and kept until freed.
+    """
+    def __init__(self, embeddingTable, dataPath, dataStats, limit=None, pad="right"):
+        """
+        :param dataPath: JSONL data file, or dataset file of util/dataset
+        :param limit: Number of examples to read from start of file; all if None
+        :param pad: Whether idx matrices are padded on the left or right
+        """
+        self.embeddingTable = embeddingTable
+        self.dataPath = dataPath
+        self.dataStats = dataStats
+        self.limit = limit
+        self.pad = pad
+
+        self.premiseIdxMat = None
+        self.hypothesisIdxMat = None
+        self.goldLabels = None
+
+
+    def head(self, numExamples):
+        """
+        Return split of the first numExamples examples, read on its own so
+        the rest of the file isn't parsed.
+        """
+        limit = numExamples if self.limit is None else min(numExamples, self.limit)
+        return DataSplit(self.embeddingTable, self.dataPath, self.dataStats, limit, self.pad)
+
+
+    def idxMatrices(self):
+        """
+        :return: Premise and hypothesis idx matrices of dim (maxSentLength, numSamples, 1)
+        """
+        if self.premiseIdxMat is None:
+            self.premiseIdxMat, self.hypothesisIdxMat = \
+                self.embeddingTable.convertDataToIdxMatrices(self.dataPath, self.dataStats,
+                                                             self.pad, self.limit)
+        return self.premiseIdxMat, self.hypothesisIdxMat
+
+
+    def labels(self):
+        """
+        :return: int32 vector of label idx
+        """
+        if self.goldLabels is None:
+            self.goldLabels = convertLabelsToIdx(self.dataPath, self.limit)
+        return self.goldLabels
+
+
+    def __len__(self):
+        return len(self.labels())
+
+
+    def loadedArrays(self):
+        """
+        Return arrays read so far, e.g. to attribute memory to them.
+        """
+        return [array for array in [self.premiseIdxMat, self.hypothesisIdxMat, self.goldLabels]
+                if array is not None]
+
+
+    def free(self):
+        """
+        Drop arrays read so far; they are read again if used afterwards.
+        """
+        self.premiseIdxMat = None
+        self.hypothesisIdxMat = None
+        self.goldLabels = None
+
+
 class Network(object):
     """
     Generic network class from which other specific model architectures will inherit.
     """
     def __init__(self, embedData, logPath, trainData, trainDataStats, valData, valDataStats,
-                 testData, testDataStats, numTimestepsPremise, numTimestepsHypothesis):
+                 testData, testDataStats, numTimestepsPremise, numTimestepsHypothesis,
+                 limit=None):
+        """
+        :param limit: Number of examples to read from start of each data file; all if None
+        """
 
         self.logger = Logger(log_path=logPath)
         # All layers in model
@@ -40,6 +120,11 @@ class Network(object):
         # Dimension of word embeddings at input
         self.dimEmbedding = self.embeddingTable.dimEmbeddings
 
+        # Splits are read when first used
+        self.trainSplit = DataSplit(self.embeddingTable, trainData, trainDataStats, limit)
+        self.valSplit = DataSplit(self.embeddingTable, valData, valDataStats, limit)
+        self.testSplit = DataSplit(self.embeddingTable, testData, testDataStats, limit)
+
         self.numericalParams = {} # Will store the numerical values of the
                         # theano variables that represent the params of the
                         # model; stored as dict of (name, value) pairs
@@ -74,12 +159,28 @@ class Network(object):
         # TODO: Test that params are properly extracted
 
 
-    def saveModel(self, modelFileName):
+    def saveModel(self, modelFileName, float16=False, trainingState=None, writer=None):
         """
-        Saves the parameters of the model to disk.
+        Saves the parameters of the model, its config and optimizer state to
+        disk in the checkpoint format of util/checkpoint.
+        :param float16: Whether to store params as float16
+        :param trainingState: Dict of arrays needed to resume training
+        :param writer: AsyncCheckpointWriter to write checkpoint in background
+                       instead of blocking until it is written
         """
-        with open(modelFileName, 'w') as f:
-            np.savez(f, **self.numericalParams)
+        optimizerState = {state.name: state.get_value() for layer in self.layers
+                          for state in getattr(layer, "optimizerState", [])}
+        config = serializableConfig(getattr(self, "configs", {}))
+        if self.embeddingTable.embeddings is not None:
+            # UNK vector is drawn at random when the table is built, so save
+            # it for inference to use the same one
+            config["unkEmbedding"] = self.embeddingTable.embeddings[-2].tolist()
+            config["vocabFingerprint"] = vocabFingerprint(self.embeddingTable)
+        args = (self.numericalParams, config, optimizerState or None, float16, trainingState)
+        if writer is None:
+            saveCheckpoint(modelFileName, *args)
+        else:
+            writer.write(modelFileName, *args)
 
 
     def loadModel(self, modelFileName):
@@ -91,16 +192,29 @@ class Network(object):
         raise NotImplementedError
 
 
+    def memoryComponents(self, datasets):
+        """
+        Attribute memory to datasets, embeddings, params and optimizer state.
+        :param datasets: Dict of dataset name to list of arrays of that dataset
+        :return: Dict of component name to bytes
+        """
+        components = {name: arrayBytes(arrays) for name, arrays in datasets.iteritems()}
+        if self.embeddingTable.embeddings is not None:
+            components["embeddings"] = self.embeddingTable.embeddings.nbytes
+        components["params"] = sharedBytes(param for layer in self.layers
+                                           for param in layer.params.values())
+        components["optimizerState"] = sharedBytes(state for layer in self.layers
+                                        for state in getattr(layer, "optimizerState", []))
+        return components
+
+
     def convertIdxToLabel(self, labelIdx):
         """
         Converts an idx to a label from our classification categories.
         :param idx:
         :return: List of all label categories
         """
-        categories = ["entailment", "contradiction", "neutral"]
-        labelCategories = []
-        for idx in labelIdx:
-            labelCategories.append(categories[idx])
+        labelCategories = decodeLabels(labelIdx)
 
         self.logger.Log("Labels of examples: {0}".format(labelCategories))
 
@@ -111,6 +225,7 @@ class Network(object):
                         predictFunc):
         """
         Computes the accuracy for the given network on a certain dataset.
+        :param dataTarget: int32 vector of label idx
         """
         numExamples = len(dataTarget)
         correctPredictions = 0.
@@ -118,21 +233,36 @@ class Network(object):
         # Arbitrary batch size set
         minibatches = getMinibatchesIdx(len(dataTarget), 1)
         pad = "right"
+        batchAssembler = BatchAssembler(self.embeddingTable, 1, self.numTimestepsPremise,
+                                        self.numTimestepsHypothesis)
 
         for _, minibatch in minibatches:
             batchPremiseTensor, batchHypothesisTensor, batchLabels = \
-                    convertDataToTrainingBatch(dataPremiseMat, self.numTimestepsPremise, dataHypothesisMat,
-                                               self.numTimestepsHypothesis, pad, self.embeddingTable,
-                                               dataTarget, minibatch)
+                    batchAssembler.assemble(dataPremiseMat, dataHypothesisMat, dataTarget,
+                                            minibatch, pad)
             prediction = predictFunc(batchPremiseTensor, batchHypothesisTensor)
-            batchGoldIdx = [ex.argmax(axis=0) for ex in batchLabels]
-
-            correctPredictions += (np.array(prediction) ==
-                                   np.array(batchGoldIdx)).sum()
+            correctPredictions += (np.array(prediction) == batchLabels).sum()
 
         return correctPredictions/numExamples
 
 
+    def computeSharedAccuracy(self, sharedDataset, predictFunc):
+        """
+        Computes the accuracy for the given network on a dataset held in shared variables.
+        :param sharedDataset: SharedDataset of data
+        :param predictFunc: Prediction function taking idx of examples within
+                            current window of sharedDataset
+        """
+        correctPredictions = 0.
+        minibatches = getMinibatchesIdx(sharedDataset.numExamples, sharedDataset.batchSize)
+        for _, minibatch in minibatches:
+            batchIdx, = sharedDataset.localIdx(minibatch)
+            prediction = predictFunc(batchIdx)
+            correctPredictions += (np.array(prediction) == sharedDataset.labels[minibatch]).sum()
+
+        return correctPredictions/sharedDataset.numExamples
+
+
     def trainFunc(self):
         raise NotImplementedError
 
@@ -151,12 +281,6 @@ class Network(object):
         :param premiseSent:
         :param hypothesisSent:
         :param predictFunc:
-        :return: Label category from among "entailment", "contradiction", "neutral"
+        :return: Label category from among "entailment", "neutral", "contradiction"
         """
-        categories = ["entailment", "contradiction", "neutral"]
-        labelIdx = predictFunc(premiseSent, hypothesisSent)
-        labelCategories = []
-        for idx in labelIdx:
-            labelCategories.append(categories[idx])
-
-        return labelCategories
\ No newline at end of file
+        return decodeLabels(predictFunc(premiseSent, hypothesisSent))
\ No newline at end of file
@@ -0,0 +1,325 @@
+""" Pure NumPy inference for LSTMP2H models saved with Network.saveModel.
+
+Doesn't import theano, so a saved model can be loaded and used for
+prediction without building the network or compiling any graphs.
+"""
+import numpy as np
+import time
+
+from model.embeddings import EmbeddingTable, vocabFingerprint
+from model.quantization import QuantizedEmbeddingTable, dequantizeParams
+from util.checkpoint import isCheckpoint, loadCheckpoint
+from util.load_snli_data import LABELS
+
+# Seed the model modules set before building the embedding table in training
+SEED = 100
+
+# Order in which gate params are stacked
+GATES = ["i", "f", "c", "o"]
+
+
+def loadEmbeddingTable(embedData, modelConfig=None):
+    """
+    Build the EmbeddingTable for a model, with the UNK vector saved with the
+    model. For models saved without it, the vector is drawn the way training
+    does, from the numpy RNG seeded with SEED, leaving the global RNG as it was.
+    :param embedData: Embeddings text file, or table written by saveQuantizedEmbeddings
+    :param modelConfig: Config saved with the model, e.g. NumpyLSTMP2H.config
+    """
+    modelConfig = modelConfig or {}
+    if isCheckpoint(embedData):
+        # UNK row was quantized together with the rest of the table
+        table = QuantizedEmbeddingTable(embedData)
+    elif "unkEmbedding" in modelConfig:
+        table = EmbeddingTable(embedData)
+        table.embeddings[-2] = modelConfig["unkEmbedding"]
+    else:
+        rngState = np.random.get_state()
+        np.random.seed(SEED)
+        table = EmbeddingTable(embedData)
+        np.random.set_state(rngState)
+
+    if "vocabFingerprint" in modelConfig and \
+            vocabFingerprint(table) != modelConfig["vocabFingerprint"]:
+        raise ValueError("Embeddings {0} aren't the ones model was trained with".format(
+                         embedData))
+    return table
+
+
+def parseUnrollSteps(unrollSteps):
+    """
+    Parse an unroll steps override given as 'N' for both layers or 'P,H'
+    for premise and hypothesis layer separately.
+    :return: Premise and hypothesis steps; None for both if unrollSteps is None
+    """
+    if unrollSteps is None:
+        return None, None
+    steps = [int(s) for s in str(unrollSteps).split(",")]
+    if len(steps) == 1:
+        return steps[0], steps[0]
+    if len(steps) != 2:
+        raise ValueError("Unroll steps must be 'N' or 'P,H': {0}".format(unrollSteps))
+    return steps[0], steps[1]
+
+
+def sigmoid(x):
+    # Written in terms of tanh so large negative inputs don't overflow exp
+    return 0.5 * (np.tanh(0.5 * x) + 1.)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class NumpyLSTMLayer(object):
+    """
+    Forward pass of an LSTMLayer from its numerical params.
+    """
+    def __init__(self, params, layerName):
+        """
+        :param params: Dict of param name to value, as saved by Network.saveModel
+        :param layerName: Name of layer ('premiseLayer', 'hypothesisLayer')
+        """
+        self.layerName = layerName
+        self.dimHidden = params["weightsHi_" + layerName].shape[0]
+
+        # Stack gate params so all four gates are computed with one GEMM,
+        # giving weights of dim (dimInput, 4 * dimHidden)
+        weightsX = np.concatenate([params["weightsX{0}_{1}".format(g, layerName)]
+                                   for g in GATES]).T
+        self.weightsH = np.ascontiguousarray(np.concatenate(
+            [params["weightsH{0}_{1}".format(g, layerName)] for g in GATES]).T)
+        biases = np.concatenate([params["bias{0}_{1}".format(g.upper(), layerName)]
+                                 for g in GATES], axis=1)
+
+        # Fold projection from embedding to input dim into the gate weights:
+        # (x W_in^T + b_in) W_x + b = x (W_in^T W_x) + (b_in W_x + b)
+        weightsToInput = params["weightsToInput_" + layerName]
+        biasToInput = params["biasToInput_" + layerName]
+        self.weightsEmbed = np.ascontiguousarray(np.dot(weightsToInput.T, weightsX))
+        self.biasEmbed = np.dot(biasToInput, weightsX) + biases
+
+
+    def forwardRun(self, inputTensor, outputInit=None, cellStateInit=None):
+        """
+        Run layer over all timesteps of input.
+        :param inputTensor: Tensor of dim (numTimesteps, numSamples, dimEmbedding)
+        :param outputInit: Initial hidden state of dim (numSamples, dimHidden); zeros if None
+        :param cellStateInit: Initial cell state of dim (numSamples, dimHidden); zeros if None
+        :return: Hidden states for all timesteps, final hidden state and final cell state
+        """
+        numTimesteps, numSamples, dimEmbedding = inputTensor.shape
+        dimHidden = self.dimHidden
+        if outputInit is None:
+            outputInit = np.zeros((numSamples, dimHidden), dtype=np.float32)
+        if cellStateInit is None:
+            cellStateInit = np.zeros((numSamples, dimHidden), dtype=np.float32)
+
+        # Input contributions to gates for all timesteps in a single GEMM
+        inputGates = (np.dot(inputTensor.reshape(numTimesteps * numSamples, dimEmbedding),
+                             self.weightsEmbed) + self.biasEmbed)
+        inputGates = inputGates.reshape(numTimesteps, numSamples, 4 * dimHidden)
+
+        allOutputs = np.empty((numTimesteps, numSamples, dimHidden), dtype=np.float32)
+        hiddenState, cellState = outputInit, cellStateInit
+        for t in xrange(numTimesteps):
+            gates = inputGates[t] + np.dot(hiddenState, self.weightsH)
+            inputGate = sigmoid(gates[:, :dimHidden])
+            forgetGate = sigmoid(gates[:, dimHidden:2*dimHidden])
+            candidateVals = np.tanh(gates[:, 2*dimHidden:3*dimHidden])
+            output = sigmoid(gates[:, 3*dimHidden:])
+
+            cellState = forgetGate * cellState + inputGate * candidateVals
+            hiddenState = output * np.tanh(cellState)
+            allOutputs[t] = hiddenState
+
+        return allOutputs, hiddenState, cellState
+
+
+class NumpyLSTMP2H(object):
+    """
+    Premise LSTM to hypothesis LSTM network for inference only, loaded from
+    a model saved with Network.saveModel.
+    """
+    def __init__(self, modelFileName, dropoutRate=None, sentenceAttention=None,
+                 numTimestepsPremise=None, numTimestepsHypothesis=None):
+        """
+        Settings not given are taken from the config saved with the model, so
+        predictions match those of the trained network.
+        :param modelFileName: Path to checkpoint (or legacy '.npz') file of saved
+                              params, possibly quantized with model.quantization
+        :param dropoutRate: Dropout rate model was trained with; outputs are
+                            scaled by it at test time like in LSTMLayer.applyDropout.
+                            1.0 if not given or saved
+        :param sentenceAttention: Whether model was trained with sentence attention;
+                                  False if not given or saved
+        :param numTimestepsPremise: Number of steps to unroll premise layer for when
+                                    converting sentences. If neither given nor saved,
+                                    longest sentence in batch, which makes predictions
+                                    depend on the other sentences of the batch
+        :param numTimestepsHypothesis: Same for hypothesis layer
+        """
+        loadStart = time.time()
+        params, _, config = loadCheckpoint(modelFileName)
+        params = dequantizeParams(params, config)
+        # Config saved with the model, e.g. for loadEmbeddingTable
+        self.config = config
+
+        def setting(name, value, default):
+            if value is None:
+                value = config.get(name)
+            return default if value is None else value
+        dropoutRate = setting("dropoutRate", dropoutRate, 1.0)
+        sentenceAttention = setting("sentenceAttention", sentenceAttention, False)
+        numTimestepsPremise = setting("numTimestepsPremise", numTimestepsPremise, None)
+        numTimestepsHypothesis = setting("numTimestepsHypothesis", numTimestepsHypothesis, None)
+
+        self.premiseLayer = NumpyLSTMLayer(params, "premiseLayer")
+        self.hypothesisLayer = NumpyLSTMLayer(params, "hypothesisLayer")
+        self.dimHidden = self.hypothesisLayer.dimHidden
+        self.weightsCat = params["weightsCat_hypothesisLayer"]
+        self.biasCat = params["biasCat_hypothesisLayer"]
+
+        self.sentenceAttention = sentenceAttention
+        if sentenceAttention:
+            self.weightsWy = params["weightsWy_hypothesisLayer"]
+            self.weightsWh = params["weightsWh_hypothesisLayer"]
+            self.weightsWx = params["weightsWx_hypothesisLayer"]
+            self.weightsWp = params["weightsWp_hypothesisLayer"]
+            self.weightsAlpha = params["weightsAlphasoftmax_hypothesisLayer"]
+
+        self.dropoutRate = np.float32(dropoutRate)
+        self.numTimestepsPremise = numTimestepsPremise
+        self.numTimestepsHypothesis = numTimestepsHypothesis
+        self.loadTime = time.time() - loadStart
+
+
+    def applySentenceAttention(self, premiseOutputs, finalHypothesisOutput):
+        """
+        Attend over all premise outputs with the final hypothesis output, as
+        in LSTMLayer.applySentenceAttention.
+        :param premiseOutputs: Tensor of dim (numTimesteps, numSamples, dimHidden)
+        :param finalHypothesisOutput: Matrix of dim (numSamples, dimHidden)
+        """
+        numTimesteps, numSamples, dimHidden = premiseOutputs.shape
+        # Reshape (not transpose) to match the theano graph
+        Y = premiseOutputs.reshape(numSamples, numTimesteps, dimHidden)
+        WyY = np.dot(Y.reshape(-1, dimHidden), self.weightsWy).reshape(Y.shape)
+        transformedHn = np.dot(finalHypothesisOutput, self.weightsWh.T)
+
+        M = np.tanh(WyY + transformedHn[:, np.newaxis, :])
+        alpha = softmax(np.dot(M.reshape(-1, dimHidden), self.weightsAlpha)
+                        .reshape(numSamples, numTimesteps))
+        r = np.matmul(alpha[:, np.newaxis, :], Y)[:, 0, :]
+
+        return np.tanh(np.dot(finalHypothesisOutput, self.weightsWx) +
+                       np.dot(r, self.weightsWp))
+
+
+    def encodePremise(self, premiseTensor):
+        """
+        Run premise layer.
+        :param premiseTensor: Tensor of dim (numTimestepsPremise, numSamples, dimEmbedding)
+        :return: Premise outputs for all timesteps, final hidden state and final cell state
+        """
+        return self.premiseLayer.forwardRun(premiseTensor)
+
+
+    def predictProbsFromPremise(self, premiseOutputs, premiseOutput, premiseCellState,
+                                hypothesisTensor):
+        """
+        Compute probability distribution over labels given already encoded premises.
+        :param premiseOutputs: Premise outputs for all timesteps; only used for attention
+        :param premiseOutput: Final hidden state of premise layer
+        :param premiseCellState: Final cell state of premise layer
+        :param hypothesisTensor: Tensor of dim (numTimestepsHypothesis, numSamples, dimEmbedding)
+        :return: Matrix of dim (numSamples, numLabels), columns in order of LABELS
+        """
+        _, hypothesisOutput, _ = self.hypothesisLayer.forwardRun(
+            hypothesisTensor, premiseOutput, premiseCellState)
+
+        if self.sentenceAttention:
+            hypothesisOutput = self.applySentenceAttention(premiseOutputs, hypothesisOutput)
+
+        hypothesisOutput = hypothesisOutput * self.dropoutRate
+        return softmax(np.dot(hypothesisOutput, self.weightsCat) + self.biasCat)
+
+
+    def predictProbs(self, premiseTensor, hypothesisTensor):
+        """
+        Compute probability distribution over labels.
+        :param premiseTensor: Tensor of dim (numTimestepsPremise, numSamples, dimEmbedding)
+        :param hypothesisTensor: Tensor of dim (numTimestepsHypothesis, numSamples, dimEmbedding)
+        :return: Matrix of dim (numSamples, numLabels), columns in order of LABELS
+        """
+        premiseOutputs, premiseOutput, premiseCellState = self.encodePremise(premiseTensor)
+        return self.predictProbsFromPremise(premiseOutputs, premiseOutput, premiseCellState,
+                                            hypothesisTensor)
+
+
+    def predict(self, premiseTensor, hypothesisTensor):
+        """
+        Return idx of most probable label for each sample.
+        """
+        return self.predictProbs(premiseTensor, hypothesisTensor).argmax(axis=1)
+
+
+    def sentencesToIdx(self, sentences, embeddingTable, numTimesteps=None):
+        """
+        Convert tokenized sentences to lists of embedding idx, truncated to numTimesteps.
+        :param sentences: List of lists of tokens
+        :param embeddingTable: EmbeddingTable model was trained with
+        """
+        # Second to last row of embedding table is the UNK vector
+        unkIdx = len(embeddingTable.embeddings) - 2
+        return [[embeddingTable.wordToIndex.get(word.lower(), unkIdx)
+                 for word in sent[:numTimesteps]] for sent in sentences]
+
+
+    def idxToTensor(self, sentencesIdx, embeddingTable, numTimesteps=None):
+        """
+        Convert lists of embedding idx to an embedding tensor, right padded
+        with zero embeddings.
+        :param sentencesIdx: List of lists of embedding idx
+        :param embeddingTable: EmbeddingTable model was trained with
+        :param numTimesteps: Number of timesteps; longest sentence if None
+        :return: Tensor of dim (numTimesteps, numSamples, dimEmbedding)
+        """
+        if numTimesteps is None:
+            numTimesteps = max(len(sentIdx) for sentIdx in sentencesIdx)
+
+        # Last row of embedding table is the zero vector
+        idxMat = np.empty((numTimesteps, len(sentencesIdx)), dtype=np.int32)
+        idxMat.fill(len(embeddingTable.embeddings) - 1)
+        for sampleIdx, sentIdx in enumerate(sentencesIdx):
+            idxMat[:len(sentIdx), sampleIdx] = sentIdx
+
+        return embeddingTable.embeddings[idxMat]
+
+
+    def sentencesToTensor(self, sentences, embeddingTable, numTimesteps=None):
+        """
+        Convert tokenized sentences to an embedding tensor, right padded with
+        zero embeddings and truncated to numTimesteps.
+        :param sentences: List of lists of tokens
+        :param embeddingTable: EmbeddingTable model was trained with
+        :param numTimesteps: Number of timesteps; longest sentence if None
+        :return: Tensor of dim (numTimesteps, numSamples, dimEmbedding)
+        """
+        return self.idxToTensor(self.sentencesToIdx(sentences, embeddingTable, numTimesteps),
+                                embeddingTable, numTimesteps)
+
+
+    def predictSentences(self, premises, hypotheses, embeddingTable):
+        """
+        Return predicted label names for pairs of tokenized sentences.
+        :param premises: List of lists of premise tokens
+        :param hypotheses: List of lists of hypothesis tokens
+        :param embeddingTable: EmbeddingTable model was trained with
+        """
+        premiseTensor = self.sentencesToTensor(premises, embeddingTable,
+                                               self.numTimestepsPremise)
+        hypothesisTensor = self.sentencesToTensor(hypotheses, embeddingTable,
+                                                  self.numTimestepsHypothesis)
+        return [LABELS[idx] for idx in self.predict(premiseTensor, hypothesisTensor)]
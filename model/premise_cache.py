@@ -0,0 +1,176 @@
+""" Inference for workloads that score many hypotheses against the same
+premise. Each unique premise is run through the premise layer once and its
+states are kept in an LRU cache, so later queries only run the hypothesis
+layer.
+"""
+import numpy as np
+
+from collections import OrderedDict
+from model.numpy_lstmp2h import LABELS
+
+
+class PremiseCache(object):
+    """
+    LRU cache of encoded premises keyed by tuples of embedding idx. Each
+    entry holds the final hidden and cell state of the premise layer, and
+    the outputs for all timesteps if they are needed for attention.
+    """
+    def __init__(self, maxEntries=10000, maxBytes=None):
+        """
+        :param maxEntries: Max number of premises kept
+        :param maxBytes: Max number of bytes of arrays kept; unbounded if None
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.numBytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key):
+        """
+        Return entry for key and mark it as most recently used, or None if
+        it isn't cached.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries[key] = entry
+        return entry
+
+
+    def put(self, key, entry):
+        """
+        Add entry, a tuple of arrays, evicting least recently used entries
+        while over capacity.
+        """
+        if key in self.entries:
+            self.numBytes -= sum(a.nbytes for a in self.entries.pop(key) if a is not None)
+        self.entries[key] = entry
+        self.numBytes += sum(a.nbytes for a in entry if a is not None)
+
+        while len(self.entries) > 1 and (len(self.entries) > self.maxEntries or
+                (self.maxBytes is not None and self.numBytes > self.maxBytes)):
+            _, evicted = self.entries.popitem(last=False)
+            self.numBytes -= sum(a.nbytes for a in evicted if a is not None)
+            self.evictions += 1
+
+
+    def clear(self):
+        self.entries.clear()
+        self.numBytes = 0
+
+
+    def metrics(self):
+        """
+        Return dict of cache metrics.
+        """
+        lookups = self.hits + self.misses
+        return {"premiseCacheHits": self.hits,
+                "premiseCacheMisses": self.misses,
+                "premiseCacheHitRate": self.hits / float(lookups) if lookups else 0.,
+                "premiseCacheEvictions": self.evictions,
+                "premiseCacheEntries": len(self.entries),
+                "premiseCacheMB": self.numBytes / (1024. * 1024.)}
+
+
+    def recordMetrics(self, stats, numEx):
+        """
+        Record cache metrics in given Stats object.
+        """
+        for name, value in self.metrics().iteritems():
+            stats.recordMetric(numEx, name, value)
+
+
+class CachedPremisePredictor(object):
+    """
+    Wraps a NumpyLSTMP2H model so that premises are looked up in a
+    PremiseCache and only premises not seen before are encoded.
+    """
+    def __init__(self, model, embeddingTable, cache=None):
+        """
+        :param model: NumpyLSTMP2H model
+        :param embeddingTable: EmbeddingTable model was trained with
+        :param cache: PremiseCache to use; a default sized one if None
+        """
+        if model.sentenceAttention and model.numTimestepsPremise is None:
+            # Attention needs premise outputs of the same length for all samples
+            raise ValueError("Sentence attention requires a fixed numTimestepsPremise")
+
+        self.model = model
+        self.embeddingTable = embeddingTable
+        self.cache = cache if cache is not None else PremiseCache()
+
+
+    def _encodeMisses(self, keys):
+        """
+        Encode premises with given keys and add them to the cache. Premises
+        are batched by length, since padding steps aren't masked and would
+        change the state of shorter premises.
+        """
+        numTimesteps = self.model.numTimestepsPremise
+        byLength = {}
+        for key in keys:
+            byLength.setdefault(numTimesteps or len(key), []).append(key)
+
+        encoded = {}
+        for length, batchKeys in byLength.iteritems():
+            premiseTensor = self.model.idxToTensor([list(key) for key in batchKeys],
+                                                   self.embeddingTable, length)
+            premiseOutputs, premiseOutput, premiseCellState = \
+                self.model.encodePremise(premiseTensor)
+            for sampleIdx, key in enumerate(batchKeys):
+                outputs = None
+                if self.model.sentenceAttention:
+                    outputs = premiseOutputs[:, sampleIdx].copy()
+                entry = (premiseOutput[sampleIdx].copy(), premiseCellState[sampleIdx].copy(),
+                         outputs)
+                self.cache.put(key, entry)
+                encoded[key] = entry
+
+        return encoded
+
+
+    def predictProbs(self, premises, hypotheses):
+        """
+        Compute probability distribution over labels for pairs of tokenized sentences.
+        :param premises: List of lists of premise tokens
+        :param hypotheses: List of lists of hypothesis tokens
+        :return: Matrix of dim (numSamples, numLabels), columns in order of LABELS
+        """
+        keys = [tuple(sentIdx) for sentIdx in self.model.sentencesToIdx(
+                    premises, self.embeddingTable, self.model.numTimestepsPremise)]
+
+        entries = {}
+        for key in keys:
+            if key not in entries:
+                entries[key] = self.cache.get(key)
+        # Repeats of a premise within the batch are served from the first lookup
+        self.cache.hits += len(keys) - len(entries)
+        misses = [key for key, entry in entries.iteritems() if entry is None]
+        if misses:
+            entries.update(self._encodeMisses(misses))
+
+        premiseOutput = np.stack([entries[key][0] for key in keys])
+        premiseCellState = np.stack([entries[key][1] for key in keys])
+        premiseOutputs = None
+        if self.model.sentenceAttention:
+            premiseOutputs = np.stack([entries[key][2] for key in keys], axis=1)
+
+        hypothesisTensor = self.model.sentencesToTensor(hypotheses, self.embeddingTable,
+                                                        self.model.numTimestepsHypothesis)
+        return self.model.predictProbsFromPremise(premiseOutputs, premiseOutput,
+                                                  premiseCellState, hypothesisTensor)
+
+
+    def predictSentences(self, premises, hypotheses):
+        """
+        Return predicted label names for pairs of tokenized sentences.
+        """
+        return [LABELS[idx] for idx in self.predictProbs(premises, hypotheses).argmax(axis=1)]
@@ -0,0 +1,159 @@
+"""
+Post-training quantization of saved models and embedding tables.
+
+Two modes are supported:
+    float16  arrays are stored as float16
+    int8     each row of a matrix is stored as int8 together with a float32
+             scale, so row ~= values * scale with scale = max(|row|) / 127
+
+Quantized model params are dequantized when loaded, since the NumPy engine
+folds them into its own gate matrices anyway. Quantized embedding tables
+stay quantized in memory and rows are only dequantized when looked up,
+which is where most of the memory goes for large vocabularies.
+"""
+import collections
+import numpy as np
+
+from util.checkpoint import loadCheckpoint, saveCheckpoint
+
+MODES = ["float16", "int8"]
+
+# Suffix of names of arrays holding scales of int8 params
+SCALES_SUFFIX = "_scales"
+
+
+def quantizeRows(mat):
+    """
+    Quantize each row of a matrix to int8 with its own scale.
+    :return: int8 matrix of same shape and float32 scales of dim (numRows,)
+    """
+    absMax = np.abs(mat).max(axis=1)
+    # All-zero rows (e.g. the zero embedding) get scale 1 to avoid dividing by 0
+    scales = np.where(absMax > 0, absMax / 127., 1.).astype(np.float32)
+    values = np.round(mat / scales[:, np.newaxis]).clip(-127, 127).astype(np.int8)
+    return values, scales
+
+
+def dequantizeRows(values, scales):
+    return values.astype(np.float32) * scales[:, np.newaxis]
+
+
+def quantizeParams(params, mode):
+    """
+    Quantize matrices of a dict of params. Vectors and biases are small so
+    they are kept as they are.
+    :param mode: 'float16' or 'int8'
+    :return: OrderedDict of quantized params, and names of params quantized
+    """
+    quantized = collections.OrderedDict()
+    quantizedNames = []
+    for name, value in params.iteritems():
+        value = np.asarray(value)
+        if value.ndim != 2 or value.dtype.kind != "f" or name.startswith("bias"):
+            quantized[name] = value
+            continue
+
+        quantizedNames.append(name)
+        if mode == "int8":
+            quantized[name], quantized[name + SCALES_SUFFIX] = quantizeRows(value)
+        else:
+            quantized[name] = value.astype(np.float16)
+
+    return quantized, quantizedNames
+
+
+def dequantizeParams(params, config):
+    """
+    Undo quantizeParams given config saved with the checkpoint. Params of
+    checkpoints that aren't quantized are returned as they are.
+    """
+    if not config.get("quantization"):
+        return params
+
+    quantizedNames = set(config["quantizedParams"])
+    dequantized = collections.OrderedDict()
+    for name, value in params.iteritems():
+        if name.endswith(SCALES_SUFFIX) and name[:-len(SCALES_SUFFIX)] in quantizedNames:
+            continue
+        if name not in quantizedNames:
+            dequantized[name] = value
+        elif config["quantization"] == "int8":
+            dequantized[name] = dequantizeRows(value, params[name + SCALES_SUFFIX])
+        else:
+            dequantized[name] = value.astype(np.float32)
+
+    return dequantized
+
+
+def quantizeModel(inputPath, outputPath, mode):
+    """
+    Quantize params of a model checkpoint. Optimizer state isn't needed for
+    inference, so it is dropped.
+    """
+    params, _, config = loadCheckpoint(inputPath, mmap=False)
+    quantized, quantizedNames = quantizeParams(params, mode)
+    config.update({"quantization": mode, "quantizedParams": quantizedNames})
+    saveCheckpoint(outputPath, quantized, config)
+
+
+class QuantizedMatrix(object):
+    """
+    Matrix stored as float16 or per-row int8, dequantized to float32 when
+    rows are indexed, so it can stand in for an embedding matrix.
+    """
+    def __init__(self, values, scales=None):
+        """
+        :param values: float16 or int8 matrix
+        :param scales: Scale of each row if values are int8
+        """
+        self.values = values
+        self.scales = scales
+        self.shape = values.shape
+        self.nbytes = values.nbytes + (scales.nbytes if scales is not None else 0)
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def __getitem__(self, idx):
+        rows = self.values[idx].astype(np.float32)
+        if self.scales is not None:
+            rows *= self.scales[idx][..., np.newaxis]
+        return rows
+
+
+class QuantizedEmbeddingTable(object):
+    """
+    Embedding table loaded from a file written by saveQuantizedEmbeddings,
+    with the attributes of EmbeddingTable used for inference.
+    """
+    def __init__(self, dataPath):
+        arrays, _, config = loadCheckpoint(dataPath)
+        self.type = config["quantization"]
+        self.dataPath = dataPath
+
+        self.embeddings = QuantizedMatrix(arrays["embeddings"], arrays.get("embeddingScales"))
+        self.sizeVocab, self.dimEmbeddings = self.embeddings.shape
+        self.wordToIndex = {word: idx for idx, word in enumerate(config["words"])
+                            if word is not None}
+        self.indexToWord = {idx: word for word, idx in self.wordToIndex.iteritems()}
+        self.embeddingVocab = set(self.wordToIndex)
+
+
+def saveQuantizedEmbeddings(embeddingTable, path, mode):
+    """
+    Write embeddings of an EmbeddingTable (including its UNK and zero rows)
+    quantized, together with its vocabulary.
+    :param mode: 'float16' or 'int8'
+    """
+    # Words whose idx were overwritten by later duplicates in the embeddings
+    # file have no entry in indexToWord
+    words = [embeddingTable.indexToWord.get(idx)
+             for idx in xrange(len(embeddingTable.embeddings))]
+    arrays = collections.OrderedDict()
+    if mode == "int8":
+        arrays["embeddings"], arrays["embeddingScales"] = quantizeRows(embeddingTable.embeddings)
+    else:
+        arrays["embeddings"] = embeddingTable.embeddings.astype(np.float16)
+    saveCheckpoint(path, arrays, {"quantization": mode, "words": words})
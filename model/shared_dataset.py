@@ -0,0 +1,141 @@
+""" Data split held in Theano shared variables, so compiled functions take
+only a vector of minibatch idx and gather embeddings, word idx and labels on
+the device through `givens` instead of being fed host tensors every step.
+
+Word idx are kept as int32 matrices of dim (numTimesteps, numExamples), with
+padding mapped to the zero vector at the end of the embedding table, which
+is all the model needs of sentence lengths. If a split is larger than the
+memory budget, only a window of consecutive examples is held at a time and
+windows are swapped in as minibatches need them.
+"""
+import numpy as np
+import theano
+import theano.tensor as T
+
+
+class SharedDataset(object):
+    def __init__(self, embeddingTable, premiseIdxMat, hypothesisIdxMat, labels,
+                 timestepsPremise, timestepsHypothesis, pad, batchSize, maxBytes=None):
+        """
+        :param premiseIdxMat: Premise idx matrix of dim (maxSentLength, numSamples, 1),
+                              with 'nan' padding
+        :param labels: int32 vector of label idx
+        :param batchSize: Number of examples of minibatches; windows hold a multiple of it
+        :param maxBytes: Max number of bytes of idx and labels held in shared
+                         variables; whole split if None
+        """
+        self.labels = labels
+        self.numExamples = len(labels)
+        self.batchSize = batchSize
+        self.zeroIdx = len(embeddingTable.embeddings) - 1
+
+        if pad == "right":
+            self.premiseIdxMat = premiseIdxMat[0:timestepsPremise, :, 0]
+            self.hypothesisIdxMat = hypothesisIdxMat[0:timestepsHypothesis, :, 0]
+        else:
+            self.premiseIdxMat = premiseIdxMat[-timestepsPremise:, :, 0]
+            self.hypothesisIdxMat = hypothesisIdxMat[-timestepsHypothesis:, :, 0]
+
+        # int32 idx of both sides and the label of each example
+        bytesPerExample = 4 * (len(self.premiseIdxMat) + len(self.hypothesisIdxMat) + 1)
+        self.windowSize = max(self.numExamples, 1)
+        if maxBytes is not None and bytesPerExample * self.numExamples > maxBytes:
+            # Minibatches are consecutive runs of batchSize examples, so
+            # none of them straddles two windows
+            self.windowSize = max(1, maxBytes // (bytesPerExample * batchSize)) * batchSize
+        self.numWindows = -(-self.numExamples // self.windowSize)
+
+        # Embeddings are shared as is; on the CPU no copy is made
+        self.embeddings = theano.shared(embeddingTable.embeddings, name="sharedEmbeddings",
+                                        borrow=True)
+        self.sharedPremiseIdx = theano.shared(np.zeros((len(self.premiseIdxMat), 0), np.int32),
+                                              name="sharedPremiseIdx")
+        self.sharedHypothesisIdx = theano.shared(
+            np.zeros((len(self.hypothesisIdxMat), 0), np.int32), name="sharedHypothesisIdx")
+        self.sharedLabels = theano.shared(np.zeros(0, np.int32), name="sharedLabels")
+
+        self.windowStart = None
+        self.windowLoads = 0
+        self._loadWindow(0)
+
+
+    def _intIdx(self, idxMat, start, stop):
+        """
+        Return int32 idx of examples start to stop of idx matrix, with padding
+        and idx outside the table mapped to the zero vector.
+        """
+        floatIdx = idxMat[:, start:stop]
+        with np.errstate(invalid="ignore"):
+            inTable = (floatIdx >= -(self.zeroIdx + 1)) & (floatIdx <= self.zeroIdx)
+        return np.where(inTable, floatIdx, self.zeroIdx).astype(np.int32)
+
+
+    def _loadWindow(self, windowStart):
+        stop = min(windowStart + self.windowSize, self.numExamples)
+        self.sharedPremiseIdx.set_value(self._intIdx(self.premiseIdxMat, windowStart, stop),
+                                        borrow=True)
+        self.sharedHypothesisIdx.set_value(
+            self._intIdx(self.hypothesisIdxMat, windowStart, stop), borrow=True)
+        self.sharedLabels.set_value(np.asarray(self.labels[windowStart:stop], dtype=np.int32),
+                                    borrow=True)
+        self.windowStart = windowStart
+        self.windowLoads += 1
+
+
+    def givens(self, batchIdx, inputPremise, inputHypothesis, yTarget=None,
+               premiseBatchIdx=None):
+        """
+        Return givens substituting symbolic inputs of the model with the
+        examples of the current window at the given idx.
+        :param batchIdx: Symbolic int32 vector of idx of examples within window
+        :param premiseBatchIdx: Symbolic int32 vector of idx of premises, if
+                                different from batchIdx
+        """
+        if premiseBatchIdx is None:
+            premiseBatchIdx = batchIdx
+        givens = {inputPremise: self.embeddings[self.sharedPremiseIdx[:, premiseBatchIdx]],
+                  inputHypothesis: self.embeddings[self.sharedHypothesisIdx[:, batchIdx]]}
+        if yTarget is not None:
+            givens[yTarget] = self.sharedLabels[batchIdx]
+        return givens
+
+
+    def localIdx(self, *minibatches):
+        """
+        Make sure the window holding the given examples is loaded.
+        :param minibatches: Vectors of idx of examples in the split, all within
+                            one window
+        :return: Vectors of idx of the same examples within the window
+        """
+        for minibatch in minibatches:
+            if len(minibatch) and (np.min(minibatch) < 0 or
+                                   np.max(minibatch) >= self.numExamples):
+                raise IndexError("Minibatch idx out of range for {0} examples".format(
+                                 self.numExamples))
+        windowStart = min(np.min(minibatch) for minibatch in minibatches) \
+            // self.windowSize * self.windowSize
+        if max(np.max(minibatch) for minibatch in minibatches) >= windowStart + self.windowSize:
+            raise ValueError("Examples span more than one window of {0} examples".format(
+                             self.windowSize))
+        if windowStart != self.windowStart:
+            self._loadWindow(windowStart)
+
+        minibatches = [np.asarray(minibatch, dtype=np.int32) for minibatch in minibatches]
+        if windowStart > 0:
+            minibatches = [minibatch - np.int32(windowStart) for minibatch in minibatches]
+        return minibatches
+
+
+    def sharedVariables(self):
+        return [self.sharedPremiseIdx, self.sharedHypothesisIdx, self.sharedLabels]
+
+
+    def stats(self):
+        """
+        Return size of windows and number of times one was loaded.
+        """
+        return {"sharedDataWindowSize": self.windowSize,
+                "sharedDataNumWindows": self.numWindows,
+                "sharedDataWindowLoads": self.windowLoads,
+                "sharedDataBytes": sum(var.get_value(borrow=True).nbytes
+                                       for var in self.sharedVariables())}
@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 
+import collections
+import hashlib
+import json
 import numpy as np
+import os
 import sys
+import time
 import theano
 import theano.tensor as T
 
@@ -12,8 +17,10 @@ from lasagne.layers import EmbeddingLayer, InputLayer, DenseLayer, ConcatLayer,
 from lasagne.regularization import regularize_layer_params_weighted, l2, l1, regularize_network_params
 from model.embeddings import EmbeddingTable
 from theano import printing
+from util.checkpoint import loadCheckpoint, saveCheckpoint
 from util.stats import Stats
-from util.utils import getMinibatchesIdx, convertLabelsToMat, generate_data
+from util.load_snli_data import decodeLabels
+from util.utils import getMinibatchesIdx, convertLabelsToIdx, generate_data, padMask
 
 
 # Min/max sequence length
@@ -65,27 +72,98 @@ valLabels = "/Users/mihaileric/Documents/Research/LSTM-NLI/data/dev_labels.json"
 
 
 def form_mask_input(num_samples, seq_len, max_seq_len, pad_dir):
-    mask = np.zeros((num_samples, max_seq_len)).astype(np.float32)
-    if pad_dir == 'right':
-        mask[:, 0:seq_len] = 1.
-    elif pad_dir == 'left':
-        mask[:, -seq_len:] = 1.
+    """
+    Return mask of dim (num_samples, max_seq_len) for sentences of seq_len
+    tokens, where seq_len is a single length or the length of each sample.
+    """
+    return padMask(np.broadcast_to(seq_len, (num_samples,)), max_seq_len, pad_dir)
+
+
+def compute_sentence_sums(idx_mat, embeddings_mat, chunk_size=10000):
+    """
+    Sum embeddings of the words of each sentence, in chunks so the gathered
+    (chunk_size, seq_len, embed_dim) tensor stays small.
+    :param idx_mat: Matrix of embedding idx of dim (num_samples, seq_len); padding
+                    idx point to the zero embedding so they don't change the sum
+    :return: Matrix of summed embeddings of dim (num_samples, embed_dim)
+    """
+    sums = np.empty((idx_mat.shape[0], embeddings_mat.shape[1]), dtype=np.float32)
+    for start in xrange(0, idx_mat.shape[0], chunk_size):
+        sums[start:start + chunk_size] = embeddings_mat[idx_mat[start:start + chunk_size]].sum(axis=1)
 
-    return mask
+    return sums
 
 
-def convert_idx_to_label(idx_array):
-    labels = ["entailment", "neutral", "contradiction"]
-    predictions = []
-    for entry in idx_array:
-        predictions.append(labels[entry])
+def sums_cache_path(cache_dir, data_file, embed_data, seq_len, limit=None):
+    """
+    Return path of cached sentence sums, keyed on the data and embedding files
+    (including their size and modification time), sequence length and limit.
+    """
+    key = [(path, os.path.getsize(path), os.path.getmtime(path)) for path in [data_file, embed_data]]
+    key.append(seq_len)
+    if limit is not None:
+        key.append(limit)
+    return os.path.join(cache_dir, "sums_{0}.ckpt".format(hashlib.md5(json.dumps(key)).hexdigest()))
+
+
+def load_sentence_sums(data_file, data_stats, table, embed_data, seq_len, cache_dir=None,
+                       limit=None):
+    """
+    Return summed premise and hypothesis embeddings of every example, read
+    from cache_dir if they were computed before.
+    :param limit: Number of examples to read from start of data file; all if None
+    :return: Matrices of dim (num_samples, embed_dim) for premises and hypotheses
+    """
+    if cache_dir is not None:
+        cache_path = sums_cache_path(cache_dir, data_file, embed_data, seq_len, limit)
+        if os.path.exists(cache_path):
+            sums, _, _ = loadCheckpoint(cache_path)
+            return sums["premise_sums"], sums["hypothesis_sums"]
+
+    prem, hyp = generate_data(data_file, data_stats, "left", "right", table, seq_len=seq_len,
+                              limit=limit)
+    sums = collections.OrderedDict([("premise_sums", compute_sentence_sums(prem, table.embeddings)),
+                                    ("hypothesis_sums", compute_sentence_sums(hyp, table.embeddings))])
+
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        saveCheckpoint(cache_path + ".tmp", sums, {"dataFile": data_file, "embedData": embed_data,
+                                                   "seqLen": seq_len, "limit": limit})
+        os.rename(cache_path + ".tmp", cache_path)
+
+    return sums["premise_sums"], sums["hypothesis_sums"]
 
-    return predictions
+
+def evaluate_in_chunks(compute_eval, prem, hyp, labels, chunk_size):
+    """
+    Compute accuracy and mean cost over a dataset chunk by chunk, so only
+    chunk_size examples are fed through the network at once.
+    :param compute_eval: Function returning number of correct predictions and
+                         summed cost of a chunk
+    :return: Accuracy and mean cost
+    """
+    num_correct = 0
+    total_cost = 0.
+    for start in xrange(0, len(labels), chunk_size):
+        chunk_correct, chunk_cost = compute_eval(prem[start:start + chunk_size],
+                                                 hyp[start:start + chunk_size],
+                                                 labels[start:start + chunk_size])
+        num_correct += chunk_correct
+        total_cost += chunk_cost
+
+    return num_correct / float(len(labels)), total_cost / len(labels)
+
+
+def convert_idx_to_label(idx_array):
+    return decodeLabels(idx_array)
 
 
 def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_stats,
-         test_data, test_data_stats, log_path, batch_size, num_epochs,
-         unroll_steps, learn_rate, num_dense, dense_dim, penalty, reg_coeff):
+         log_path, batch_size, num_epochs, unroll_steps, learn_rate, num_dense, dense_dim,
+         penalty, reg_coeff, max_steps=-1, precompute_sums=False, sums_cache_dir=None,
+         eval_batch_size=1024, train_acc_samples=-1, limit=None, test_data=None,
+         test_data_stats=None):
     """
     Main run function for training model.
     :param exp_name:
@@ -94,8 +172,6 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
     :param train_data_stats:
     :param val_data:
     :param val_data_stats:
-    :param test_data:
-    :param test_data_stats:
     :param log_path:
     :param batch_size:
     :param num_epochs:
@@ -106,8 +182,21 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
     :param penalty: Penalty to use for regularization
     :param reg_weight: Regularization coeff to use for each layer of network; may
                        want to support different coefficient for different layers
+    :param max_steps: Stop training after this many minibatches; -1 to train for all epochs
+    :param precompute_sums: Whether to sum the (frozen) embeddings of each sentence
+                            once up front and train the dense layers on the sums,
+                            instead of gathering and summing embeddings every batch
+    :param sums_cache_dir: Directory where precomputed sums are cached across runs
+    :param eval_batch_size: Number of examples fed through network at once when
+                            computing accuracy and cost of a dataset
+    :param train_acc_samples: Number of train examples (a fixed random subset)
+                              train accuracy is computed on; -1 for all
+    :param limit: Number of examples to read from start of train and val data; all if None
+    :param test_data: Not read yet; the test split isn't evaluated
+    :param test_data_stats:
     :return:
     """
+    train_start = time.time()
     # Set random seed for deterministic results
     np.random.seed(0)
     num_ex_to_train = 30
@@ -119,10 +208,18 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
     embeddings_mat = table.embeddings
 
 
-    train_prem, train_hyp = generate_data(train_data, train_data_stats, "left", "right", table, seq_len=unroll_steps)
-    val_prem, val_hyp = generate_data(val_data, val_data_stats, "left", "right", table, seq_len=unroll_steps)
-    train_labels = convertLabelsToMat(train_data)
-    val_labels = convertLabelsToMat(val_data)
+    if precompute_sums:
+        train_prem, train_hyp = load_sentence_sums(train_data, train_data_stats, table, embed_data,
+                                                   unroll_steps, sums_cache_dir, limit)
+        val_prem, val_hyp = load_sentence_sums(val_data, val_data_stats, table, embed_data,
+                                               unroll_steps, sums_cache_dir, limit)
+    else:
+        train_prem, train_hyp = generate_data(train_data, train_data_stats, "left", "right", table,
+                                              seq_len=unroll_steps, limit=limit)
+        val_prem, val_hyp = generate_data(val_data, val_data_stats, "left", "right", table,
+                                          seq_len=unroll_steps, limit=limit)
+    train_labels = convertLabelsToIdx(train_data, limit)
+    val_labels = convertLabelsToIdx(val_data, limit)
 
     # To test for overfitting capabilities of model
     if num_ex_to_train > 0:
@@ -130,29 +227,38 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
         val_hyp = val_hyp[0:num_ex_to_train]
         val_labels = val_labels[0:num_ex_to_train]
 
-    # Theano expressions for premise/hypothesis inputs to network
-    x_p = T.imatrix()
-    x_h = T.imatrix()
-    target_values = T.fmatrix(name="target_output")
+    target_values = T.ivector(name="target_output")
 
+    if precompute_sums:
+        # Inputs are already summed sentence embeddings
+        x_p = T.fmatrix()
+        x_h = T.fmatrix()
+        l_in_prem = InputLayer((batch_size, dim_embeddings))
+        l_in_hyp = InputLayer((batch_size, dim_embeddings))
+        l_embed_prem_sum = l_in_prem
+        l_embed_hyp_sum = l_in_hyp
+    else:
+        # Theano expressions for premise/hypothesis inputs to network
+        x_p = T.imatrix()
+        x_h = T.imatrix()
 
-    # Embedding layer for premise
-    l_in_prem = InputLayer((batch_size, unroll_steps))
-    l_embed_prem = EmbeddingLayer(l_in_prem, input_size=vocab_size,
-                        output_size=dim_embeddings, W=embeddings_mat)
+        # Embedding layer for premise
+        l_in_prem = InputLayer((batch_size, unroll_steps))
+        l_embed_prem = EmbeddingLayer(l_in_prem, input_size=vocab_size,
+                            output_size=dim_embeddings, W=embeddings_mat)
 
-    # Embedding layer for hypothesis
-    l_in_hyp = InputLayer((batch_size, unroll_steps))
-    l_embed_hyp = EmbeddingLayer(l_in_hyp, input_size=vocab_size,
-                        output_size=dim_embeddings, W=embeddings_mat)
+        # Embedding layer for hypothesis
+        l_in_hyp = InputLayer((batch_size, unroll_steps))
+        l_embed_hyp = EmbeddingLayer(l_in_hyp, input_size=vocab_size,
+                            output_size=dim_embeddings, W=embeddings_mat)
 
 
-    # Ensure embedding matrix parameters are not trainable
-    l_embed_hyp.params[l_embed_hyp.W].remove('trainable')
-    l_embed_prem.params[l_embed_prem.W].remove('trainable')
+        # Ensure embedding matrix parameters are not trainable
+        l_embed_hyp.params[l_embed_hyp.W].remove('trainable')
+        l_embed_prem.params[l_embed_prem.W].remove('trainable')
 
-    l_embed_hyp_sum = SumEmbeddingLayer(l_embed_hyp)
-    l_embed_prem_sum = SumEmbeddingLayer(l_embed_prem)
+        l_embed_hyp_sum = SumEmbeddingLayer(l_embed_hyp)
+        l_embed_prem_sum = SumEmbeddingLayer(l_embed_prem)
 
     # Concatenate sentence embeddings for premise and hypothesis
     l_concat = ConcatLayer([l_embed_hyp_sum, l_embed_prem_sum])
@@ -181,13 +287,13 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
     layers = lasagne.layers.get_all_layers(l_output)
     layer_dict = {l: reg_coeff for l in layers}
     reg_cost = reg_coeff * regularize_layer_params_weighted(layer_dict, p_metric)
-    cost = T.mean(T.nnet.categorical_crossentropy(network_output, target_values).mean()) + reg_cost
-    compute_cost = theano.function([x_p, x_h, target_values], cost)
+    example_costs = T.nnet.categorical_crossentropy(network_output, target_values)
+    cost = T.mean(example_costs.mean()) + reg_cost
 
-    # Compute accuracy
-    accuracy = T.mean(T.eq(T.argmax(network_output, axis=-1), T.argmax(target_values, axis=-1)),
-                      dtype=theano.config.floatX)
-    compute_accuracy = theano.function([x_p, x_h, target_values], accuracy)
+    # Number of correct predictions and summed cost (without regularization)
+    # of a chunk, so accuracy and cost of a dataset can be accumulated over chunks
+    num_correct = T.sum(T.eq(T.argmax(network_output, axis=-1), target_values))
+    compute_eval = theano.function([x_p, x_h, target_values], [num_correct, example_costs.sum()])
 
     label_output = T.argmax(network_output, axis=-1)
     predict = theano.function([x_p, x_h], label_output)
@@ -202,13 +308,31 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
     stats = Stats(exp_name)
     acc_num = 10
 
+    # Fixed subset of train set to track train accuracy on; separate RNG so
+    # the global one (used for initialization) isn't affected
+    if 0 < train_acc_samples < train_prem.shape[0]:
+        train_acc_idx = np.sort(np.random.RandomState(0).choice(train_prem.shape[0],
+                                                                 train_acc_samples, replace=False))
+        train_acc_prem = train_prem[train_acc_idx]
+        train_acc_hyp = train_hyp[train_acc_idx]
+        train_acc_labels = train_labels[train_acc_idx]
+    else:
+        train_acc_prem, train_acc_hyp, train_acc_labels = train_prem, train_hyp, train_labels
+
     #minibatches = getMinibatchesIdx(val_prem.shape[0], batch_size)
     minibatches = getMinibatchesIdx(train_prem.shape[0], batch_size)
     print("Training ...")
     try:
         total_num_ex = 0
+        num_steps = 0
+        # Time spent in training steps, excluding accuracy computation
+        train_time = 0.
         for epoch in xrange(num_epochs):
             for _, minibatch in minibatches:
+                if num_steps == max_steps:
+                    break
+                step_start = time.time()
+                num_steps += 1
                 total_num_ex += len(minibatch)
                 stats.log("Processed {0} total examples in epoch {1}".format(str(total_num_ex),
                                                                           str(epoch)))
@@ -221,23 +345,37 @@ def main(exp_name, embed_data, train_data, train_data_stats, val_data, val_data_
                 hyp_batch = train_hyp[minibatch]
                 labels_batch = train_labels[minibatch]
 
-                train(prem_batch, hyp_batch, labels_batch)
-                cost_val = compute_cost(prem_batch, hyp_batch, labels_batch)
+                # Cost of batch as computed in the train step, before the update
+                cost_val = train(prem_batch, hyp_batch, labels_batch)
 
                 stats.recordCost(total_num_ex, cost_val)
+                train_time += time.time() - step_start
+                if num_steps == 1:
+                    stats.recordMetric(total_num_ex, "timeToFirstBatch", time.time() - train_start)
+
                 # Periodically compute and log train/dev accuracy
                 if total_num_ex%(acc_num*batch_size) == 0:
-                    train_acc = compute_accuracy(train_prem, train_hyp, train_labels)
-                    dev_acc = compute_accuracy(val_prem, val_hyp, val_labels)
+                    eval_start = time.time()
+                    train_acc, _ = evaluate_in_chunks(compute_eval, train_acc_prem, train_acc_hyp,
+                                                      train_acc_labels, eval_batch_size)
+                    dev_acc, dev_cost = evaluate_in_chunks(compute_eval, val_prem, val_hyp, val_labels,
+                                                           eval_batch_size)
+                    stats.recordMetric(total_num_ex, "devEvalTime", time.time() - eval_start)
+                    stats.recordMetric(total_num_ex, "devCost", dev_cost)
                     stats.recordAcc(total_num_ex, train_acc, dataset="train")
                     stats.recordAcc(total_num_ex, dev_acc, dataset="dev")
 
     except KeyboardInterrupt:
         pass
 
+    if train_time > 0:
+        stats.recordMetric(total_num_ex, "trainExamplesPerSec", total_num_ex / train_time)
+
+    return stats
+
 
 if __name__ == '__main__':
     embedData = "/Users/mihaileric/Documents/Research/LSTM-NLI/data/glove.6B.50d.txt.gz"
     exp_name = "/Users/mihaileric/Documents/Research/LSTM-NLI/log/sum_embeddings.log"
-    main(exp_name, embedData, trainData, trainDataStats, valData, valDataStats, "", "",
+    main(exp_name, embedData, trainData, trainDataStats, valData, valDataStats,
          "", N_BATCH, NUM_EPOCHS, 18, LEARNING_RATE, num_dense=2, dense_dim=200, penalty="l2", reg_coeff=0.05)
@@ -0,0 +1,47 @@
+""" Preprocesses an SNLI-format JSONL file into the binary dataset format of
+util/dataset, tokenizing and mapping sentences to embedding idx in parallel.
+
+The output can be passed wherever a JSONL data file is expected, e.g. as
+--trainData of P2H_LSTM_run.py, together with the same --embedData.
+
+Usage:
+    python preprocess_data.py data/snli_1.0_train.jsonl data/snli_1.0_train.dataset \
+        --embedData data/glove.840B.300d.txt --numWorkers 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model.embeddings import EmbeddingTable
+from util.afs_safe_logger import Logger
+from util.dataset import preprocessCorpus
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="preprocess SNLI data into a binary dataset")
+    parser.add_argument("input", type=str, help="SNLI-format JSONL file")
+    parser.add_argument("output", type=str, help="path where dataset is written")
+    parser.add_argument("--embedData", type=str, required=True,
+                        help="path to word embeddings that sentences are mapped to")
+    parser.add_argument("--numWorkers", type=int, default=None,
+                        help="number of worker processes; number of CPUs if not given")
+    parser.add_argument("--shardsPerWorker", type=int, default=4,
+                        help="number of byte ranges input is split into per worker")
+    parser.add_argument("--logPath", type=str, default=None,
+                        help="path to file where output is logged")
+    args = parser.parse_args()
+
+    logger = Logger(log_path=args.logPath)
+    embeddingTable = EmbeddingTable(args.embedData)
+
+    start = time.time()
+    config = preprocessCorpus(args.input, embeddingTable, args.output, args.numWorkers,
+                              args.shardsPerWorker)
+    elapsed = time.time() - start
+    logger.Log("Wrote {0} examples to {1} in {2:.1f}s ({3:.0f} examples/sec)".format(
+               config["numExamples"], args.output, elapsed, config["numExamples"] / elapsed))
+    logger.Log("Max sentence length: premise {0}, hypothesis {1}".format(
+               config["maxSentLenPremise"], config["maxSentLenHypothesis"]))
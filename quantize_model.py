@@ -0,0 +1,137 @@
+""" Quantizes a saved LSTMP2H model and its embeddings to float16 or per-row
+int8 for inference with the NumPy engine, and optionally reports the change
+in dev accuracy, speed and memory against the float32 model.
+
+Usage:
+    python quantize_model.py --model savedmodels/model.ckpt --embedData glove.txt --mode int8 \
+        --output model.int8.ckpt --embedOutput glove.int8.ckpt --evalData snli_1.0_dev.jsonl
+
+The outputs can be passed as --model and --embedData to serve_predictions.py
+and score_pairs.py.
+"""
+import argparse
+import json
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model.numpy_lstmp2h import LABELS, NumpyLSTMP2H, loadEmbeddingTable, parseUnrollSteps
+from model.quantization import MODES, quantizeModel, saveQuantizedEmbeddings
+from score_pairs import tokenize
+from util.afs_safe_logger import Logger
+from util.checkpoint import loadCheckpoint
+
+
+def modelBytes(model):
+    """
+    Bytes of params the NumPy engine keeps in memory.
+    """
+    arrays = [layer.weightsEmbed for layer in [model.premiseLayer, model.hypothesisLayer]] + \
+             [layer.biasEmbed for layer in [model.premiseLayer, model.hypothesisLayer]] + \
+             [layer.weightsH for layer in [model.premiseLayer, model.hypothesisLayer]] + \
+             [model.weightsCat, model.biasCat]
+    return sum(array.nbytes for array in arrays)
+
+
+def evaluate(model, embeddingTable, premises, hypotheses, batchSize):
+    """
+    Predict label probabilities of all pairs in batches.
+    :return: Matrix of probabilities, and pairs scored per second
+    """
+    start = time.time()
+    probs = []
+    for batchStart in xrange(0, len(premises), batchSize):
+        premiseTensor = model.sentencesToTensor(premises[batchStart:batchStart + batchSize],
+                                                embeddingTable, model.numTimestepsPremise)
+        hypothesisTensor = model.sentencesToTensor(
+            hypotheses[batchStart:batchStart + batchSize], embeddingTable,
+            model.numTimestepsHypothesis)
+        probs.append(model.predictProbs(premiseTensor, hypothesisTensor))
+
+    return np.concatenate(probs), len(premises) / (time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="quantize model and embeddings for inference")
+    parser.add_argument("--model", type=str, required=True,
+                        help="path to model checkpoint saved by LSTMP2H")
+    parser.add_argument("--embedData", type=str, required=True,
+                        help="path to word embeddings model was trained with")
+    parser.add_argument("--mode", type=str, choices=MODES, default="int8",
+                        help="quantization mode")
+    parser.add_argument("--output", type=str, required=True,
+                        help="path where quantized model is written")
+    parser.add_argument("--embedOutput", type=str, required=True,
+                        help="path where quantized embeddings are written")
+    parser.add_argument("--evalData", type=str, default=None,
+                        help="SNLI-format JSONL file to compare accuracy, speed and "
+                             "memory of quantized and float32 models on")
+    parser.add_argument("--batchSize", type=int, default=256,
+                        help="number of pairs scored per batch in evaluation")
+    parser.add_argument("--dropoutRate", type=float, default=None,
+                        help="override dropout rate saved with model")
+    parser.add_argument("--sentenceAttention", action="store_true", default=None,
+                        help="override whether model uses sentence attention")
+    parser.add_argument("--unrollSteps", type=str, default=None,
+                        help="override number of steps saved with model, as 'N' for both "
+                             "layers or 'P,H' for premise and hypothesis layer")
+    parser.add_argument("--reportPath", type=str, default=None,
+                        help="path to JSON file where evaluation report is written")
+    parser.add_argument("--logPath", type=str, default=None,
+                        help="path to file where output is logged")
+    args = parser.parse_args()
+
+    logger = Logger(log_path=args.logPath)
+    _, _, modelConfig = loadCheckpoint(args.model)
+    embeddingTable = loadEmbeddingTable(args.embedData, modelConfig)
+    quantizeModel(args.model, args.output, args.mode)
+    saveQuantizedEmbeddings(embeddingTable, args.embedOutput, args.mode)
+    logger.Log("Model: {0} -> {1} bytes".format(os.path.getsize(args.model),
+                                               os.path.getsize(args.output)))
+    logger.Log("Embeddings: {0} -> {1} bytes".format(embeddingTable.embeddings.nbytes,
+                                                    os.path.getsize(args.embedOutput)))
+
+    if args.evalData is None:
+        sys.exit(0)
+
+    premises, hypotheses, goldLabels = [], [], []
+    with open(args.evalData, "r") as f:
+        for line in f:
+            example = json.loads(line)
+            if example.get("gold_label") not in LABELS:
+                continue
+            premises.append(tokenize(example, "sentence1"))
+            hypotheses.append(tokenize(example, "sentence2"))
+            goldLabels.append(LABELS.index(example["gold_label"]))
+    goldLabels = np.array(goldLabels)
+
+    unrollSteps = parseUnrollSteps(args.unrollSteps)
+    report = {"mode": args.mode, "numExamples": len(goldLabels)}
+    allProbs = {}
+    for name, modelPath, embedPath in [("float32", args.model, args.embedData),
+                                       (args.mode, args.output, args.embedOutput)]:
+        model = NumpyLSTMP2H(modelPath, dropoutRate=args.dropoutRate,
+                             sentenceAttention=args.sentenceAttention,
+                             numTimestepsPremise=unrollSteps[0],
+                             numTimestepsHypothesis=unrollSteps[1])
+        table = loadEmbeddingTable(embedPath, model.config)
+        probs, pairsPerSec = evaluate(model, table, premises, hypotheses, args.batchSize)
+        allProbs[name] = probs
+        report[name] = {"accuracy": float((probs.argmax(axis=1) == goldLabels).mean()),
+                        "pairsPerSec": pairsPerSec,
+                        "modelFileBytes": os.path.getsize(modelPath),
+                        "modelBytes": modelBytes(model),
+                        "embeddingBytes": table.embeddings.nbytes}
+
+    report["accuracyDelta"] = report[args.mode]["accuracy"] - report["float32"]["accuracy"]
+    report["labelAgreement"] = float((allProbs["float32"].argmax(axis=1) ==
+                                      allProbs[args.mode].argmax(axis=1)).mean())
+    report["maxProbDiff"] = float(np.abs(allProbs["float32"] - allProbs[args.mode]).max())
+    logger.Log("Quantization report: {0}".format(json.dumps(report, indent=2, sort_keys=True)))
+
+    if args.reportPath is not None:
+        with open(args.reportPath, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
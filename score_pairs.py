@@ -0,0 +1,222 @@
+""" Scores premise/hypothesis pairs of an SNLI-format JSONL file (optionally
+gzipped) with a saved LSTMP2H model, streaming the input in chunks so memory
+use doesn't grow with the file size.
+
+Writes a JSONL file with the predicted label and label probabilities of each
+pair. Progress is checkpointed to '<output>.offsets' after every chunk, so an
+interrupted run can be continued with --resume.
+
+Usage:
+    python score_pairs.py --model model.ckpt --embedData glove.txt --input snli_1.0_test.jsonl.gz \
+        --output predictions.jsonl --numWorkers 4
+"""
+import argparse
+import collections
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model.numpy_lstmp2h import LABELS, NumpyLSTMP2H, loadEmbeddingTable, parseUnrollSteps
+from util.afs_safe_logger import Logger
+from util.load_snli_data import convert_binary_bracketing
+
+# Model and embeddings of current worker process
+workerModel = None
+workerEmbeddingTable = None
+
+
+def initWorker(modelPath, embedData, dropoutRate, sentenceAttention, unrollSteps):
+    """
+    :param unrollSteps: Premise and hypothesis steps, as from parseUnrollSteps
+    """
+    global workerModel, workerEmbeddingTable
+    workerModel = NumpyLSTMP2H(modelPath, dropoutRate=dropoutRate,
+                               sentenceAttention=sentenceAttention,
+                               numTimestepsPremise=unrollSteps[0],
+                               numTimestepsHypothesis=unrollSteps[1])
+    workerEmbeddingTable = loadEmbeddingTable(embedData, workerModel.config)
+
+
+def tokenize(example, field):
+    """
+    Tokenize a sentence of an SNLI example the way the data loaders do,
+    falling back to whitespace splitting if there is no binary parse.
+    """
+    if field + "_binary_parse" in example:
+        tokens, _ = convert_binary_bracketing(example[field + "_binary_parse"])
+        return tokens
+    return example[field].lower().split()
+
+
+def scoreChunk(lines):
+    """
+    Score a chunk of JSONL lines with the worker's model.
+    :return: Output JSONL text for chunk, number of pairs with a gold label
+             and number of those predicted correctly
+    """
+    examples = [json.loads(line) for line in lines if line.strip()]
+    if not examples:
+        return "", 0, 0
+
+    premises = [tokenize(example, "sentence1") for example in examples]
+    hypotheses = [tokenize(example, "sentence2") for example in examples]
+    premiseTensor = workerModel.sentencesToTensor(premises, workerEmbeddingTable,
+                                                  workerModel.numTimestepsPremise)
+    hypothesisTensor = workerModel.sentencesToTensor(hypotheses, workerEmbeddingTable,
+                                                     workerModel.numTimestepsHypothesis)
+    probs = workerModel.predictProbs(premiseTensor, hypothesisTensor)
+
+    output = []
+    numLabeled = numCorrect = 0
+    for example, p in zip(examples, probs):
+        label = LABELS[p.argmax()]
+        goldLabel = example.get("gold_label")
+        if goldLabel in LABELS:
+            numLabeled += 1
+            numCorrect += label == goldLabel
+        output.append(json.dumps({"pairID": example.get("pairID"), "label": label,
+                                  "probs": dict(zip(LABELS, [float(x) for x in p])),
+                                  "gold_label": goldLabel}))
+
+    return "\n".join(output) + "\n", numLabeled, numCorrect
+
+
+def readChunks(f, chunkSize, offset):
+    """
+    Yield chunks of lines of an open file together with the byte offset in
+    the (uncompressed) input just past each chunk.
+    """
+    while True:
+        lines = []
+        for _ in xrange(chunkSize):
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line)
+            offset += len(line)
+        if not lines:
+            return
+        yield lines, offset
+
+
+def writeOffsets(offsetsPath, progress):
+    """
+    Atomically replace offsets file with current progress.
+    """
+    with open(offsetsPath + ".tmp", "w") as f:
+        json.dump(progress, f)
+    os.rename(offsetsPath + ".tmp", offsetsPath)
+
+
+def openInput(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="stream-score a JSONL file of sentence pairs")
+    parser.add_argument("--model", type=str, required=True,
+                        help="path to model checkpoint saved by LSTMP2H, possibly quantized")
+    parser.add_argument("--embedData", type=str, required=True,
+                        help="path to word embeddings model was trained with, or "
+                             "quantized table written by quantize_model.py")
+    parser.add_argument("--input", type=str, required=True,
+                        help="SNLI-format JSONL file of pairs, may be gzipped")
+    parser.add_argument("--output", type=str, required=True,
+                        help="JSONL file where predictions are written")
+    parser.add_argument("--chunkSize", type=int, default=1024,
+                        help="number of pairs scored per batch")
+    parser.add_argument("--numWorkers", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--maxPendingChunks", type=int, default=None,
+                        help="max chunks in flight; 2 * numWorkers if not given")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from '<output>.offsets' of an interrupted run")
+    parser.add_argument("--dropoutRate", type=float, default=None,
+                        help="override dropout rate saved with model")
+    parser.add_argument("--sentenceAttention", action="store_true", default=None,
+                        help="override whether model uses sentence attention")
+    parser.add_argument("--unrollSteps", type=str, default=None,
+                        help="override number of steps saved with model, as 'N' for both "
+                             "layers or 'P,H' for premise and hypothesis layer")
+    parser.add_argument("--logPath", type=str, default=None,
+                        help="path to file where progress is logged")
+    args = parser.parse_args()
+
+    logger = Logger(log_path=args.logPath)
+    offsetsPath = args.output + ".offsets"
+    progress = {"inputOffset": 0, "outputSize": 0, "numScored": 0,
+                "numLabeled": 0, "numCorrect": 0}
+    if args.resume and os.path.exists(offsetsPath):
+        with open(offsetsPath, "r") as f:
+            progress = json.load(f)
+        logger.Log("Resuming after {0} pairs at input offset {1}".format(
+                   progress["numScored"], progress["inputOffset"]))
+
+    # Drop output written after the last checkpoint
+    output = open(args.output, "r+b" if progress["outputSize"] else "wb")
+    output.truncate(progress["outputSize"])
+    output.seek(progress["outputSize"])
+
+    initArgs = (args.model, args.embedData, args.dropoutRate, args.sentenceAttention,
+                parseUnrollSteps(args.unrollSteps))
+    pool = None
+    if args.numWorkers > 1:
+        pool = multiprocessing.Pool(args.numWorkers, initWorker, initArgs)
+    else:
+        initWorker(*initArgs)
+    maxPending = args.maxPendingChunks or 2 * args.numWorkers
+
+    start = time.time()
+    numScoredStart = progress["numScored"]
+    numChunks = [0]
+
+    def finishChunk(result, endOffset):
+        text, numLabeled, numCorrect = result
+        output.write(text)
+        output.flush()
+        progress["inputOffset"] = endOffset
+        progress["outputSize"] = output.tell()
+        progress["numScored"] += text.count("\n")
+        progress["numLabeled"] += numLabeled
+        progress["numCorrect"] += numCorrect
+        writeOffsets(offsetsPath, progress)
+
+        numChunks[0] += 1
+        if numChunks[0] % 100 == 0:
+            logger.Log("Scored {0} pairs ({1:.1f} pairs/sec)".format(progress["numScored"],
+                       (progress["numScored"] - numScoredStart) / (time.time() - start)))
+
+    with openInput(args.input) as f:
+        f.seek(progress["inputOffset"])
+        # Bound number of chunks in flight so memory stays constant; results
+        # are written in input order so offsets stay valid
+        pending = collections.deque()
+        for lines, endOffset in readChunks(f, args.chunkSize, progress["inputOffset"]):
+            if pool is None:
+                finishChunk(scoreChunk(lines), endOffset)
+            else:
+                pending.append((pool.apply_async(scoreChunk, (lines,)), endOffset))
+                while len(pending) >= maxPending:
+                    result, chunkOffset = pending.popleft()
+                    finishChunk(result.get(), chunkOffset)
+
+        while pending:
+            result, chunkOffset = pending.popleft()
+            finishChunk(result.get(), chunkOffset)
+
+    output.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    numNew = progress["numScored"] - numScoredStart
+    logger.Log("Scored {0} pairs in total, {1} in {2:.1f}s".format(
+               progress["numScored"], numNew, time.time() - start))
+    if progress["numLabeled"]:
+        logger.Log("Accuracy on {0} labeled pairs: {1:.4f}".format(
+                   progress["numLabeled"], progress["numCorrect"] / float(progress["numLabeled"])))
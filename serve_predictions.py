@@ -0,0 +1,96 @@
+""" Serves entailment predictions from a saved LSTMP2H model over HTTP,
+batching concurrent requests together.
+
+Usage:
+    python serve_predictions.py --model savedmodels/model.ckpt --embedData glove.txt --port 8000
+    curl -d '{"premise": "a man sleeps", "hypothesis": "a person rests"}' localhost:8000/predict
+    curl localhost:8000/stats
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model.numpy_lstmp2h import LABELS, NumpyLSTMP2H, loadEmbeddingTable, parseUnrollSteps
+from model.premise_cache import CachedPremisePredictor, PremiseCache
+from util.afs_safe_logger import Logger
+from util.prediction_server import MicroBatcher, makeServer
+
+
+def makePredictFn(model, embeddingTable, premiseCacheSize=0):
+    """
+    Return function mapping lists of tokenized premises and hypotheses to a
+    list of dicts with the predicted label and probability of each label.
+    """
+    if premiseCacheSize > 0:
+        predictor = CachedPremisePredictor(model, embeddingTable, PremiseCache(premiseCacheSize))
+        predictProbs = predictor.predictProbs
+    else:
+        def predictProbs(premises, hypotheses):
+            premiseTensor = model.sentencesToTensor(premises, embeddingTable,
+                                                    model.numTimestepsPremise)
+            hypothesisTensor = model.sentencesToTensor(hypotheses, embeddingTable,
+                                                       model.numTimestepsHypothesis)
+            return model.predictProbs(premiseTensor, hypothesisTensor)
+
+    def predictFn(premises, hypotheses):
+        probs = predictProbs(premises, hypotheses)
+        return [{"label": LABELS[p.argmax()],
+                 "probs": dict(zip(LABELS, [float(x) for x in p]))} for p in probs]
+
+    return predictFn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="micro-batching prediction server")
+    parser.add_argument("--model", type=str, required=True,
+                        help="path to model checkpoint saved by LSTMP2H, possibly quantized")
+    parser.add_argument("--embedData", type=str, required=True,
+                        help="path to word embeddings model was trained with, or "
+                             "quantized table written by quantize_model.py")
+    parser.add_argument("--host", type=str, default="localhost",
+                        help="host to listen on")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="port to listen on")
+    parser.add_argument("--unixSocket", type=str, default=None,
+                        help="path of Unix socket to listen on instead of host:port")
+    parser.add_argument("--maxBatchSize", type=int, default=32,
+                        help="max number of pairs scored in one batch")
+    parser.add_argument("--maxLatencyMs", type=float, default=5.,
+                        help="max time a request waits for its batch to fill")
+    parser.add_argument("--dropoutRate", type=float, default=None,
+                        help="override dropout rate saved with model")
+    parser.add_argument("--sentenceAttention", action="store_true", default=None,
+                        help="override whether model uses sentence attention")
+    parser.add_argument("--unrollSteps", type=str, default=None,
+                        help="override number of steps saved with model, as 'N' for both "
+                             "layers or 'P,H' for premise and hypothesis layer")
+    parser.add_argument("--premiseCacheSize", type=int, default=0,
+                        help="number of encoded premises to cache; 0 disables caching")
+    parser.add_argument("--logPath", type=str, default=None,
+                        help="path to file where server output is logged")
+    args = parser.parse_args()
+
+    logger = Logger(log_path=args.logPath)
+    unrollSteps = parseUnrollSteps(args.unrollSteps)
+    model = NumpyLSTMP2H(args.model, dropoutRate=args.dropoutRate,
+                         sentenceAttention=args.sentenceAttention,
+                         numTimestepsPremise=unrollSteps[0],
+                         numTimestepsHypothesis=unrollSteps[1])
+    embeddingTable = loadEmbeddingTable(args.embedData, model.config)
+    logger.Log("Loaded model in {0:.3f}s".format(model.loadTime))
+    logger.Log("Unroll steps {0}/{1}, dropout rate {2}, sentence attention {3}".format(
+               model.numTimestepsPremise, model.numTimestepsHypothesis, model.dropoutRate,
+               model.sentenceAttention))
+
+    batcher = MicroBatcher(makePredictFn(model, embeddingTable, args.premiseCacheSize),
+                           maxBatchSize=args.maxBatchSize,
+                           maxLatency=args.maxLatencyMs / 1000.)
+    server = makeServer(batcher, args.host, args.port, args.unixSocket)
+    logger.Log("Serving predictions on {0}".format(
+               args.unixSocket or "{0}:{1}".format(args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.Log("Final stats: {0}".format(batcher.stats()))
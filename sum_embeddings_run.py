@@ -25,10 +25,10 @@ if __name__ == "__main__":
                         help="path to validation data")
     parser.add_argument("--valDataStats", type=str,
                         help="path to stats about validation data")
-    parser.add_argument("--testData", type=str,
-                        help="path to test data")
-    parser.add_argument("--testDataStats", type=str,
-                        help="path to stats about test data")
+    parser.add_argument("--testData", type=str, default=None,
+                        help="path to test data (optional; not evaluated yet)")
+    parser.add_argument("--testDataStats", type=str, default=None,
+                        help="path to stats about test data (optional)")
     parser.add_argument("--logPath", type=str,
                         help="path to file where model outputs will be logged")
     parser.add_argument("--batchSize", type=int,
@@ -57,9 +57,26 @@ if __name__ == "__main__":
                         help="regularization penalty")
     parser.add_argument("--regCoeff", type=float,
                         help="coefficient of regularization")
+    parser.add_argument("--precomputeSums", action="store_true",
+                        help="sum frozen embeddings of each sentence once up front and "
+                             "train dense layers on the sums")
+    parser.add_argument("--sumsCacheDir", type=str, default=None,
+                        help="directory where precomputed sentence sums are cached")
+    parser.add_argument("--evalBatchSize", type=int, default=1024,
+                        help="number of examples evaluated at once when computing "
+                             "accuracy and cost")
+    parser.add_argument("--trainAccSamples", type=int, default=-1,
+                        help="number of train examples to compute train accuracy on; "
+                             "-1 for all")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="number of examples to read from start of each data file; "
+                             "all if not given")
     args = parser.parse_args()
 
     network = sum_embeddings.main(args.expName, args.embedData, args.trainData, args.trainDataStats,
-                      args.valData, args.valDataStats, args.testData,
-                      args.testDataStats, args.logPath, args.batchSize, args.numEpochs, args.unrollSteps, args.learnRate,
-                      args.numDense, args.denseDim, args.regPenalty, args.regCoeff)
+                      args.valData, args.valDataStats, args.logPath, args.batchSize, args.numEpochs,
+                      args.unrollSteps, args.learnRate, args.numDense, args.denseDim, args.regPenalty,
+                      args.regCoeff, precompute_sums=args.precomputeSums,
+                      sums_cache_dir=args.sumsCacheDir, eval_batch_size=args.evalBatchSize,
+                      train_acc_samples=args.trainAccSamples, limit=args.limit,
+                      test_data=args.testData, test_data_stats=args.testDataStats)
@@ -2,8 +2,11 @@
 of system.
 """
 
+import collections
+import json
 import numpy as np
 import os
+import re
 # Hacky way to ensure that theano can find NVCC compiler
 os.environ["PATH"] += ":/usr/local/cuda/bin"
 
@@ -12,11 +15,27 @@ import theano.tensor as T
 import time
 
 from model.embeddings import EmbeddingTable
-from model.layers import LSTMLayer
+from model.layers import LSTMLayer, getRngState, setRngState
 from model.lstmp2h import LSTMP2H
+from model.network import DataSplit
+from model.numpy_lstmp2h import NumpyLSTMP2H, loadEmbeddingTable
+from model.premise_cache import CachedPremisePredictor, PremiseCache
+from model.quantization import dequantizeRows, quantizeModel, quantizeRows
+from model.shared_dataset import SharedDataset
+from model.sum_embeddings import compute_sentence_sums
 from util.afs_safe_logger import Logger
+from util.batch_assembler import BatchAssembler
+from util.checkpoint import loadCheckpoint
+from util.checkpoint_writer import AsyncCheckpointWriter
+from util.dataset import loadDataset, preprocessCorpus
+from util.length_stats import lengthStats, parseUnrollSteps, unrollCost
+from util.load_snli_data import convert_binary_bracketing, decodeLabels, tokenizeSentence
+from util.prediction_server import MicroBatcher
 from util.stats import Stats
-from util.utils import convertLabelsToMat, computeParamNorms, HeKaimingInitializer, GaussianDefaultInitializer, generate_data
+from util.synthetic_data import writeSyntheticEmbeddings, writeSyntheticSNLI
+from util.utils import convertDataToTrainingBatch, convertLabelsToIdx, convertLabelsToMat, computeParamNorms, HeKaimingInitializer, GaussianDefaultInitializer, generate_data, \
+                       padIdxMatrix, bracketLeaves, bracketTransitions, leaves, sick_reader, str2tree, \
+                       REDUCE, SHIFT
 
 dataPath = "/Users/mihaileric/Documents/Research/LSTM-NLI/data/"
 # Set random seed for deterministic runs
@@ -358,7 +377,7 @@ def testAccuracyComputation():
                     valData=valData, valDataStats=valDataStats, valLabels=valLabels)
     valPremiseIdxMat, valHypothesisIdxMat = network.embeddingTable.convertDataToIdxMatrices(
                                 network.valData, network.valDataStats)
-    valGoldLabel = convertLabelsToMat(network.valLabels)
+    valGoldLabel = convertLabelsToIdx(network.valLabels)
 
     accuracy = network.computeAccuracy(valPremiseIdxMat,
                                        valHypothesisIdxMat, valGoldLabel)
@@ -484,6 +503,530 @@ def testStats():
     print stats.acc
 
 
+def testNumpyInferenceParity():
+    """
+    Check that NumPy inference on a saved model matches theano predictions.
+    """
+    network = LSTMP2H(None, None, None, None, None, None, None, None,
+                      HeKaimingInitializer(), dimHidden=8, dimInput=6,
+                      numTimestepsPremise=7, numTimestepsHypothesis=5)
+    network.hiddenLayerHypothesis.initSentAttnParams()
+    network.extractParams()
+    network.saveModel("numpyParityParams.ckpt")
+
+    symPremise = T.ftensor3("inputPremise")
+    symHypothesis = T.ftensor3("inputHypothesis")
+    predictFunc = network.predictFunc(symPremise, symHypothesis, 0.5)
+    probsFunc = theano.function([symPremise, symHypothesis], T.nnet.softmax(
+                                network.hiddenLayerHypothesis.projectToCategories()))
+    hstar = network.hiddenLayerHypothesis.applySentenceAttention(
+        network.hiddenLayerPremise.allOutputs,
+        network.hiddenLayerHypothesis.finalOutputVal / np.float32(0.5), 7)
+    attnFunc = theano.function([symPremise, symHypothesis], hstar)
+
+    premise = np.random.randn(7, 10, network.dimEmbedding).astype(np.float32)
+    hypothesis = np.random.randn(5, 10, network.dimEmbedding).astype(np.float32)
+
+    model = NumpyLSTMP2H("numpyParityParams.ckpt", dropoutRate=0.5)
+    print "Load time: ", model.loadTime
+    print "Labels match: ", (model.predict(premise, hypothesis) ==
+                             predictFunc(premise, hypothesis)).all()
+    print "Probs close: ", np.allclose(model.predictProbs(premise, hypothesis),
+                                       probsFunc(premise, hypothesis), atol=1e-5)
+
+    model = NumpyLSTMP2H("numpyParityParams.ckpt", dropoutRate=0.5, sentenceAttention=True)
+    premiseOutputs, premiseOut, premiseCell = model.premiseLayer.forwardRun(premise)
+    _, hypothesisOut, _ = model.hypothesisLayer.forwardRun(hypothesis, premiseOut,
+                                                           premiseCell)
+    print "Sentence attention close: ", np.allclose(
+        model.applySentenceAttention(premiseOutputs, hypothesisOut),
+        attnFunc(premise, hypothesis), atol=1e-5)
+
+    # Sentences go through the same truncation and padding as in training,
+    # with unroll steps and dropout rate taken from the saved config
+    writeSyntheticEmbeddings("numpyParityEmbeddings.txt", vocabSize=50, dimEmbedding=4)
+    network = LSTMP2H("numpyParityEmbeddings.txt", None, None, None, None, None, None, None,
+                      HeKaimingInitializer(), dimHidden=8, dimInput=6,
+                      numTimestepsPremise=7, numTimestepsHypothesis=5)
+    network.configs.update({"dropoutRate": 0.5, "sentenceAttention": False})
+    network.extractParams()
+    network.saveModel("numpySentenceParams.ckpt")
+    predictFunc = network.predictFunc(symPremise, symHypothesis, 0.5)
+    probsFunc = theano.function([symPremise, symHypothesis], T.nnet.softmax(
+                                network.hiddenLayerHypothesis.projectToCategories()))
+
+    table = network.embeddingTable
+    premises = [["w{0}".format(i) for i in np.random.randint(0, 50, length)]
+                for length in [3, 9, 7, 2]]
+    hypotheses = [["w{0}".format(i) for i in np.random.randint(0, 50, length)]
+                  for length in [4, 1, 8, 5]]
+    idxMats = []
+    for sentences, numTimesteps in [(premises, 7), (hypotheses, 5)]:
+        idxMat = np.empty((numTimesteps, len(sentences), 1), dtype=np.float32)
+        idxMat.fill(np.nan)
+        for sampleIdx, sent in enumerate(sentences):
+            sentIdx = table.convertSentListToIdxMatrix(sent)[:numTimesteps]
+            idxMat[:len(sentIdx), sampleIdx, 0] = sentIdx
+        idxMats.append(table.convertIdxMatToIdxTensor(idxMat))
+
+    model = NumpyLSTMP2H("numpySentenceParams.ckpt")
+    probs = model.predictProbs(model.sentencesToTensor(premises, table, model.numTimestepsPremise),
+                               model.sentencesToTensor(hypotheses, table,
+                                                       model.numTimestepsHypothesis))
+    print "Settings from config: ", (model.numTimestepsPremise, model.numTimestepsHypothesis,
+                                      model.dropoutRate, model.sentenceAttention)
+    print "Sentence labels match: ", model.predictSentences(premises, hypotheses, table) == \
+        decodeLabels(predictFunc(*idxMats))
+    print "Sentence probs close: ", np.allclose(probs, probsFunc(*idxMats), atol=1e-5)
+    alone = model.predictProbs(model.sentencesToTensor(premises[:1], table, 7),
+                               model.sentencesToTensor(hypotheses[:1], table, 5))
+    print "Independent of batch: ", np.allclose(alone[0], probs[0], atol=1e-6)
+
+    # UNK vector is loaded from the model without touching the global RNG
+    rngState = np.random.get_state()
+    loadedTable = loadEmbeddingTable("numpyParityEmbeddings.txt", model.config)
+    print "Loaded embeddings equal: ", np.array_equal(loadedTable.embeddings, table.embeddings)
+    print "Global RNG unchanged: ", np.array_equal(np.random.get_state()[1], rngState[1])
+    writeSyntheticEmbeddings("numpyOtherEmbeddings.txt", vocabSize=40, dimEmbedding=4)
+    try:
+        loadEmbeddingTable("numpyOtherEmbeddings.txt", model.config)
+        print "Other embeddings raised: ", False
+    except ValueError as e:
+        print "Other embeddings raised: ", e
+
+    # Quantized models keep the saved settings
+    quantizeModel("numpySentenceParams.ckpt", "numpySentenceParams.int8.ckpt", "int8")
+    quantizedModel = NumpyLSTMP2H("numpySentenceParams.int8.ckpt")
+    print "Quantized settings from config: ", (
+        quantizedModel.numTimestepsPremise, quantizedModel.numTimestepsHypothesis,
+        quantizedModel.dropoutRate, quantizedModel.sentenceAttention) == \
+        (model.numTimestepsPremise, model.numTimestepsHypothesis, model.dropoutRate,
+         model.sentenceAttention)
+
+
+def testPremiseCache():
+    """
+    Check that predictions with cached premise states match uncached ones.
+    """
+    writeSyntheticEmbeddings("premiseCacheEmbeddings.txt", 50, 10)
+    network = LSTMP2H("premiseCacheEmbeddings.txt", None, None, None, None, None, None,
+                      None, HeKaimingInitializer(), dimHidden=8, dimInput=6,
+                      numTimestepsPremise=6, numTimestepsHypothesis=4)
+    network.hiddenLayerHypothesis.initSentAttnParams()
+    network.extractParams()
+    network.saveModel("premiseCacheParams.ckpt")
+
+    premises = [["w1", "w2", "w3"], ["w4", "w5"], ["w6", "w7", "w8", "w9"]] * 4
+    hypotheses = [["w%d" % np.random.randint(50) for _ in range(3)] for _ in premises]
+    for sentenceAttention in [False, True]:
+        model = NumpyLSTMP2H("premiseCacheParams.ckpt", sentenceAttention=sentenceAttention,
+                             numTimestepsPremise=6, numTimestepsHypothesis=4)
+        predictor = CachedPremisePredictor(model, network.embeddingTable, PremiseCache(2))
+        probs = model.predictProbs(
+            model.sentencesToTensor(premises, network.embeddingTable, 6),
+            model.sentencesToTensor(hypotheses, network.embeddingTable, 4))
+        print "Cached probs close: ", np.allclose(predictor.predictProbs(premises, hypotheses),
+                                                  probs, atol=1e-6)
+        print "Cached probs close: ", np.allclose(predictor.predictProbs(premises, hypotheses),
+                                                  probs, atol=1e-6)
+        print "Cache metrics: ", predictor.cache.metrics()
+
+
+def testPremiseDedupGrads():
+    """
+    Check that gradients with deduplicated premises match those with a
+    premise per example.
+    """
+    network = LSTMP2H(None, None, None, None, None, None, None, None,
+                      HeKaimingInitializer(), dimHidden=8, dimInput=6,
+                      numTimestepsPremise=7, numTimestepsHypothesis=5)
+    inputPremise = T.ftensor3("inputPremise")
+    inputHypothesis = T.ftensor3("inputHypothesis")
+    yTarget = T.ivector("yTarget")
+    learnRate = T.scalar("learnRate", dtype="float32")
+    premiseIdx = T.ivector("premiseIdx")
+
+    _, _, _, _, _, gradsHypothesisFn, gradsPremiseFn = network.trainFunc(inputPremise,
+        inputHypothesis, yTarget, learnRate, 3., 0., 1., False, False, 6)
+    _, _, _, _, _, dedupGradsHypothesisFn, dedupGradsPremiseFn = network.trainFunc(
+        inputPremise, inputHypothesis, yTarget, learnRate, 3., 0., 1., False, False, 6,
+        premiseIdx=premiseIdx)
+
+    uniquePremises = np.random.randn(7, 2, network.dimEmbedding).astype(np.float32)
+    batchPremiseIdx = np.array([0, 0, 0, 1, 1, 1], dtype=np.int32)
+    hypothesis = np.random.randn(5, 6, network.dimEmbedding).astype(np.float32)
+    labels = np.array([0, 1, 2, 0, 1, 2], dtype=np.int32)
+
+    premise = uniquePremises[:, batchPremiseIdx]
+    for grads, dedupGrads in [(gradsPremiseFn(premise, hypothesis, labels),
+            dedupGradsPremiseFn(uniquePremises, hypothesis, labels, batchPremiseIdx)),
+            (gradsHypothesisFn(premise, hypothesis, labels),
+            dedupGradsHypothesisFn(uniquePremises, hypothesis, labels, batchPremiseIdx))]:
+        print "Grads close: ", all(np.allclose(g, d, atol=1e-5) for g, d in zip(grads, dedupGrads))
+
+
+def testMicroBatcher():
+    """
+    Check that concurrent requests are coalesced into batches.
+    """
+    batchSizes = []
+    def predictFn(premises, hypotheses):
+        batchSizes.append(len(premises))
+        return [len(p) + len(h) for p, h in zip(premises, hypotheses)]
+
+    batcher = MicroBatcher(predictFn, maxBatchSize=8, maxLatency=0.05)
+    print "Results: ", batcher.submitMany([(["a"] * i, ["b"]) for i in range(20)])
+    print "Batch sizes: ", batchSizes
+    print "Stats: ", batcher.stats()
+
+    # A predict function dropping results fails the whole batch
+    shortBatcher = MicroBatcher(lambda premises, hypotheses: [0] * (len(premises) - 1),
+                                maxBatchSize=8, maxLatency=0.05)
+    try:
+        shortBatcher.submitMany([(["a"], ["b"]), (["c"], ["d"])])
+        print "Short results raised: ", False
+    except ValueError as e:
+        print "Short results raised: ", e
+    print "Short stats: ", shortBatcher.stats()
+
+
+def testCheckpointRoundTrip():
+    """
+    Check that params and optimizer state survive saving to and loading from
+    a checkpoint, with and without float16 storage.
+    """
+    network = LSTMP2H(None, None, None, None, None, None, None, None,
+                      HeKaimingInitializer(), dimHidden=8, dimInput=6,
+                      numTimestepsPremise=7, numTimestepsHypothesis=5)
+    network.hiddenLayerHypothesis.initSentAttnParams()
+    network.extractParams()
+    for layer in network.layers:
+        layer.optimizerState = [theano.shared(np.random.randn(2, 3).astype(np.float32),
+                                              name="state_" + layer.layerName)]
+    network.saveModel("checkpointParams.ckpt")
+    network.saveModel("checkpointParams16.ckpt", float16=True)
+
+    params, optimizerState, config = loadCheckpoint("checkpointParams.ckpt")
+    print "Config: ", config
+    print "Params equal: ", all(np.array_equal(params[name], value)
+                                for name, value in network.numericalParams.iteritems())
+    print "Optimizer state equal: ", all(np.array_equal(optimizerState[state.name],
+                                                        state.get_value())
+                                         for layer in network.layers
+                                         for state in layer.optimizerState)
+    params16, _, _ = loadCheckpoint("checkpointParams16.ckpt")
+    print "Float16 max error: ", max(np.abs(params16[name] - value).max()
+                                     for name, value in network.numericalParams.iteritems())
+
+    network2 = LSTMP2H(None, None, None, None, None, None, None, None,
+                       HeKaimingInitializer(), dimHidden=8, dimInput=6,
+                       numTimestepsPremise=7, numTimestepsHypothesis=5)
+    for layer in network2.layers:
+        layer.optimizerState = [theano.shared(np.zeros((2, 3), dtype=np.float32),
+                                              name="state_" + layer.layerName)]
+    network2.loadModel("checkpointParams.ckpt")
+    network2.extractParams()
+    print "Loaded params equal: ", all(np.array_equal(network2.numericalParams[name], value)
+                                       for name, value in network.numericalParams.iteritems())
+    print "Loaded optimizer state equal: ", all(
+        np.array_equal(s1.get_value(), s2.get_value()) for l1, l2 in
+        zip(network.layers, network2.layers) for s1, s2 in zip(l1.optimizerState,
+                                                               l2.optimizerState))
+
+
+def testDropoutRngState():
+    """
+    Check that dropout random streams are saved and restored per network,
+    whatever other networks were built in the same process.
+    """
+    networks = []
+    for numDropouts in [2, 1]:
+        network = LSTMP2H(None, None, None, None, None, None, None, None,
+                          HeKaimingInitializer(), dimHidden=8, dimInput=6)
+        layer = network.hiddenLayerHypothesis
+        for _ in xrange(numDropouts):
+            layer.applyDropout(layer.b_f, network.dropoutMode, 0.5)
+        networks.append(network)
+
+    rngState = getRngState(networks[1].layers)
+    print "Streams of second network: ", len(rngState)
+    networks[1].hiddenLayerHypothesis.rngStreams[0].set_value(
+        networks[0].hiddenLayerHypothesis.rngStreams[0].get_value())
+    setRngState(networks[1].layers, rngState)
+    print "State restored: ", all(np.array_equal(s1, s2) for s1, s2 in
+                                  zip(getRngState(networks[1].layers), rngState))
+
+
+def testAsyncCheckpointWriter():
+    """
+    Check that background writes land atomically and only the last K are kept.
+    """
+    writer = AsyncCheckpointWriter(keepLast=2)
+    for step in range(3):
+        writer.write("asyncCheckpoint.ckpt", {"step": np.array(step)})
+    writer.close()
+    print "Latest step: ", loadCheckpoint("asyncCheckpoint.ckpt")[0]["step"]
+    print "Previous step: ", loadCheckpoint("asyncCheckpoint.ckpt.1")[0]["step"]
+    print "Oldest removed: ", not os.path.exists("asyncCheckpoint.ckpt.2")
+    print "Stats: ", writer.stats()
+
+    writer = AsyncCheckpointWriter(keepLast=3)
+    for step in range(4):
+        writer.write("asyncCheckpoint3.ckpt", {"step": np.array(step)})
+    writer.close()
+    print "Steps kept: ", [loadCheckpoint(path)[0]["step"].item() for path in
+                           ["asyncCheckpoint3.ckpt", "asyncCheckpoint3.ckpt.1",
+                            "asyncCheckpoint3.ckpt.2"]]
+
+
+def testQuantizeRows():
+    """
+    Check that per-row int8 quantization error is within half a step of each row.
+    """
+    mat = np.random.randn(20, 16).astype(np.float32)
+    mat[3] = 0.
+    values, scales = quantizeRows(mat)
+    error = np.abs(dequantizeRows(values, scales) - mat).max(axis=1)
+    print "Dtypes: ", values.dtype, scales.dtype
+    print "Error within half step: ", (error <= scales / 2. + 1e-6).all()
+    print "Zero row exact: ", (dequantizeRows(values, scales)[3] == 0.).all()
+
+
+def testComputeSentenceSums():
+    """
+    Check that chunked sentence sums match summing gathered embeddings.
+    """
+    embeddings = np.random.randn(50, 8).astype(np.float32)
+    embeddings[-1] = 0.
+    idxMat = np.random.randint(0, 50, (23, 6)).astype(np.int32)
+    print "Sums close: ", np.allclose(compute_sentence_sums(idxMat, embeddings, chunk_size=5),
+                                      embeddings[idxMat].sum(axis=1))
+
+
+def testPadIdxMatrix():
+    """
+    Check left/right padding and truncation of idx matrices, including empty
+    sentences and sentences longer than seqLen.
+    """
+    flatIdx = np.arange(1, 8)
+    for padDir in ["left", "right"]:
+        idxMat, mask = padIdxMatrix(flatIdx, [3, 0, 4], 4, padDir, 0)
+        print padDir, "idx: ", idxMat.tolist()
+        print padDir, "mask: ", mask.tolist()
+    idxMat, _ = padIdxMatrix(flatIdx, [3, 0, 4], 2, "left", 0)
+    print "Truncated keeps first tokens: ", idxMat.tolist() == [[1, 2], [0, 0], [4, 5]]
+
+
+def testBracketParsing():
+    """
+    Check bracket tokenizer against trees of labeled and binary bracketings,
+    and that the reader skips comments and header without printing.
+    """
+    binary = "( ( A dog ) ( is ( running ) ) )"
+    labeled = "(ROOT (S (NP (DT A) (NN \"dog\")) (VP (VBZ runs))))"
+    print "Binary tree: ", str2tree(binary) == (("A", "dog"), ("is", ("running",)))
+    for s in [binary, labeled]:
+        print "Leaves match: ", bracketLeaves(s) == leaves(str2tree(s))
+    print "Transitions: ", bracketTransitions(binary) == \
+        (["A", "dog", "is", "running"], [SHIFT, SHIFT, REDUCE, SHIFT, SHIFT, REDUCE, REDUCE, REDUCE])
+
+    path = "bracketParses.txt"
+    with open(path, "w") as f:
+        f.write("gold_label\tsentence1_binary_parse\tsentence2_binary_parse\n")
+        f.write("% comment\tx\ty\n")
+        f.write("neutral\t{0}\t( A cat )\n".format(binary))
+    print "Reader: ", list(sick_reader(path, parse=bracketLeaves)) == \
+        [("neutral", ["A", "dog", "is", "running"], ["A", "cat"])]
+    os.remove(path)
+
+    # Raw text served for prediction is tokenized like the parses
+    parse = "( ( The ( man 's ) ) ( ( does n't ) ( ( eat ( 3.5 pies ) ) . ) ) )"
+    print "Raw text tokens: ", tokenizeSentence("The man's doesn't eat 3.5 pies.") == \
+        convert_binary_bracketing(parse)[0]
+
+
+def testPreprocessCorpus():
+    """
+    Check that preprocessing gives the same dataset for any number of workers,
+    and the same idx matrices and labels as reading the JSONL file.
+    """
+    writeSyntheticEmbeddings("preprocessEmbeddings.txt", vocabSize=300, dimEmbedding=4)
+    writeSyntheticSNLI("preprocess.jsonl", "preprocessStats.json", numPairs=500, vocabSize=400)
+    # Capitalize some words, which are looked up lowercased
+    with open("preprocess.jsonl", "r") as f:
+        examples = [json.loads(line) for line in f]
+    with open("preprocess.jsonl", "w") as f:
+        for example in examples:
+            for field in ["sentence1_binary_parse", "sentence2_binary_parse"]:
+                example[field] = re.sub(r"\bw(\d)\b", r"W\1", example[field])
+            f.write(json.dumps(example) + "\n")
+    table = EmbeddingTable("preprocessEmbeddings.txt")
+    for numWorkers in [1, 3]:
+        preprocessCorpus("preprocess.jsonl", table, "preprocess{0}.dataset".format(numWorkers),
+                         numWorkers=numWorkers)
+    arrays1, _ = loadDataset("preprocess1.dataset")
+    arrays3, config = loadDataset("preprocess3.dataset", table)
+    print "Same for any workers: ", all(np.array_equal(arrays1[name], arrays3[name])
+                                        for name in arrays1)
+    print "Examples: ", config["numExamples"]
+
+    for pad in ["left", "right"]:
+        fromJSON = table.convertDataToIdxMatrices("preprocess.jsonl", "preprocessStats.json", pad)
+        fromDataset = table.convertDataToIdxMatrices("preprocess3.dataset", "preprocessStats.json", pad)
+        print pad, "idx mats match: ", all(a.shape == b.shape and np.allclose(a, b, equal_nan=True)
+                                           for a, b in zip(fromJSON, fromDataset))
+    print "Labels match: ", np.array_equal(convertLabelsToIdx("preprocess.jsonl"),
+                                           convertLabelsToIdx("preprocess3.dataset"))
+
+
+def testLengthStats():
+    """
+    Check percentiles of length histograms, auto unroll steps and the
+    padding and truncation they lead to.
+    """
+    stats = lengthStats([1] * 98 + [3, 40], "Premise")
+    stats.update(lengthStats([2, 2, 4, 4], "Hypothesis"))
+    print "Percentiles: ", stats["lengthPercentilesPremise"]
+    print "Auto steps: ", parseUnrollSteps("auto:p99", stats) == (3, 4)
+    print "Fixed steps: ", parseUnrollSteps("20", stats) == (20, 20)
+    cost = unrollCost(stats["lengthHistogramHypothesis"], 3, stepFlops=10)
+    print "Unroll cost: ", cost
+    print "Rates: ", cost["truncationRate"] == 0.5 and cost["paddingRate"] == 1. / 6 \
+        and cost["paddingFlopsPerEpoch"] == 20
+
+
+def testSyntheticSNLI():
+    """
+    Check that each premise of synthetic data gets its own captionID and all
+    its hypotheses, also across chunks of pairs written at once.
+    """
+    writeSyntheticSNLI("synthetic.jsonl", "syntheticStats.json", numPairs=10010,
+                       vocabSize=100, hypothesesPerPremise=3, meanLenPremise=3,
+                       meanLenHypothesis=2)
+    pairsByCaption = collections.defaultdict(list)
+    with open("synthetic.jsonl", "r") as f:
+        for line in f:
+            example = json.loads(line)
+            pairsByCaption[example["captionID"]].append(example["sentence1"])
+    print "Number of premises: ", len(pairsByCaption) == 3337
+    print "Hypotheses per premise: ", sorted(collections.Counter(
+        len(premises) for premises in pairsByCaption.itervalues()).items())
+    print "One premise per captionID: ", all(len(set(premises)) == 1
+                                             for premises in pairsByCaption.itervalues())
+
+
+def testDataSplitLimit():
+    """
+    Check that splits are only read when used, and that limiting a split
+    to its first examples matches slicing the full split, for JSONL and
+    dataset files.
+    """
+    writeSyntheticEmbeddings("splitEmbeddings.txt", vocabSize=300, dimEmbedding=4)
+    writeSyntheticSNLI("split.jsonl", "splitStats.json", numPairs=200, vocabSize=400)
+    table = EmbeddingTable("splitEmbeddings.txt")
+    preprocessCorpus("split.jsonl", table, "split.dataset", numWorkers=1)
+
+    for dataPath in ["split.jsonl", "split.dataset"]:
+        split = DataSplit(table, dataPath, "splitStats.json")
+        print "Not read before use: ", split.loadedArrays() == []
+        premise, hypothesis = split.idxMatrices()
+        head = split.head(30)
+        headPremise, headHypothesis = head.idxMatrices()
+        print dataPath, "head matches: ", \
+            np.allclose(headPremise, premise[:, :30], equal_nan=True) and \
+            np.allclose(headHypothesis, hypothesis[:, :30], equal_nan=True) and \
+            np.array_equal(head.labels(), split.labels()[:30])
+        split.free()
+        print "Freed: ", split.loadedArrays() == []
+
+
+def testBatchAssembler():
+    """
+    Check that batches gathered into reused buffers match those of
+    convertDataToTrainingBatch, and that buffers are only allocated up front.
+    """
+    writeSyntheticEmbeddings("assemblerEmbeddings.txt", vocabSize=50, dimEmbedding=4)
+    table = EmbeddingTable("assemblerEmbeddings.txt")
+    premiseIdxMat = np.random.randint(0, table.sizeVocab - 1, (9, 20, 1)).astype(np.float32)
+    hypothesisIdxMat = np.random.randint(0, table.sizeVocab - 1, (6, 20, 1)).astype(np.float32)
+    premiseIdxMat[7:, ::2] = np.nan
+    hypothesisIdxMat[:2, 1::3] = np.nan
+    # Idx outside the table get the zero vector
+    premiseIdxMat[0, 3] = table.sizeVocab + 10
+    labels = np.random.randint(0, 3, 20).astype(np.int32)
+
+    assembler = BatchAssembler(table, 5, 7, 4)
+    allMatch = True
+    for pad in ["right", "left"]:
+        for minibatch, premiseMinibatch in [([3, 1, 4, 1, 5], None), ([9, 2, 6], [9, 2]),
+                                            ([0, 19, 7, 8, 2], None)]:
+            expected = convertDataToTrainingBatch(premiseIdxMat, 7, hypothesisIdxMat, 4, pad,
+                                                  table, labels, minibatch, premiseMinibatch)
+            batch = assembler.assemble(premiseIdxMat, hypothesisIdxMat, labels, minibatch, pad,
+                                       premiseMinibatch)
+            allMatch = allMatch and all(np.array_equal(a, b) for a, b in zip(expected, batch))
+    print "Batches match: ", allMatch
+    print "Embeddings gathered: ", np.abs(batch[0]).sum() > 0
+    print "Stats: ", assembler.stats()
+
+    numAllocations = assembler.stats()["batchBufferAllocations"]
+    assembler.assemble(premiseIdxMat, hypothesisIdxMat, labels, range(8), "right")
+    print "Grows for larger batch: ", assembler.stats()["batchBufferAllocations"] > numAllocations
+
+    try:
+        assembler.assemble(premiseIdxMat, hypothesisIdxMat, labels, [2, 20], "right")
+        print "Out of range minibatch rejected: False"
+    except IndexError:
+        print "Out of range minibatch rejected: True"
+
+
+def testSharedDataset():
+    """
+    Check that batches gathered from shared variables through givens match
+    those of convertDataToTrainingBatch, with the whole split in one window
+    and in windows swapped in under a memory budget.
+    """
+    writeSyntheticEmbeddings("sharedEmbeddings.txt", vocabSize=50, dimEmbedding=4)
+    table = EmbeddingTable("sharedEmbeddings.txt")
+    premiseIdxMat = np.random.randint(0, table.sizeVocab - 1, (9, 20, 1)).astype(np.float32)
+    hypothesisIdxMat = np.random.randint(0, table.sizeVocab - 1, (6, 20, 1)).astype(np.float32)
+    premiseIdxMat[7:, ::2] = np.nan
+    hypothesisIdxMat[:2, 1::3] = np.nan
+    premiseIdxMat[0, 5] = table.sizeVocab + 10
+    labels = np.random.randint(0, 3, 20).astype(np.int32)
+
+    inputPremise = T.ftensor3(name="inputPremise")
+    inputHypothesis = T.ftensor3(name="inputHypothesis")
+    yTarget = T.ivector(name="yTarget")
+    batchIdx = T.ivector(name="batchIdx")
+    for maxBytes in [None, 300]:
+        allMatch = True
+        for pad in ["right", "left"]:
+            sharedDataset = SharedDataset(table, premiseIdxMat, hypothesisIdxMat, labels, 7, 4,
+                                          pad, 5, maxBytes)
+            gatherFn = theano.function([batchIdx], [inputPremise, inputHypothesis, yTarget],
+                givens=sharedDataset.givens(batchIdx, inputPremise, inputHypothesis, yTarget))
+            for minibatch in [[5, 6, 9], [17, 15, 19], [0, 4, 2, 1]]:
+                expected = convertDataToTrainingBatch(premiseIdxMat, 7, hypothesisIdxMat, 4, pad,
+                                                      table, labels, minibatch)
+                batch = gatherFn(*sharedDataset.localIdx(minibatch))
+                allMatch = allMatch and all(np.array_equal(a, b) for a, b in zip(expected, batch))
+        print "Max bytes {0}: batches match: {1}".format(maxBytes, allMatch)
+        print "Stats: ", sharedDataset.stats()
+
+    try:
+        sharedDataset.localIdx([3, 12])
+        print "Minibatch across windows rejected: False"
+    except ValueError:
+        print "Minibatch across windows rejected: True"
+
+    try:
+        sharedDataset.localIdx([18, 20])
+        print "Out of range minibatch rejected: False"
+    except IndexError:
+        print "Out of range minibatch rejected: True"
+
+
 def test_generate_data():
     table = EmbeddingTable(dataPath+"glove.6B.50d.txt.gz")
     devData = "/Users/mihaileric/Documents/Research/LSTM-NLI/data/snli_1.0_dev.jsonl"
@@ -521,4 +1064,21 @@ if __name__ == "__main__":
    #testSentenceAttention()
     #testWordwiseAttention()
     #testStats()
+    #testNumpyInferenceParity()
+    #testPremiseCache()
+    #testPremiseDedupGrads()
+    #testMicroBatcher()
+    #testCheckpointRoundTrip()
+    #testDropoutRngState()
+    #testAsyncCheckpointWriter()
+    #testQuantizeRows()
+    #testComputeSentenceSums()
+    #testPadIdxMatrix()
+    #testBracketParsing()
+    #testPreprocessCorpus()
+    #testLengthStats()
+    #testSyntheticSNLI()
+    #testDataSplitLimit()
+    #testBatchAssembler()
+    #testSharedDataset()
     test_generate_data()
\ No newline at end of file
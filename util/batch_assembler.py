@@ -0,0 +1,161 @@
+"""
+Assembles training batches into preallocated buffers.
+
+convertDataToTrainingBatch copies the idx of every batch out of the idx
+matrices and allocates new embedding tensors for it, which at large batch
+sizes churns hundreds of MB per second through the allocator. A
+BatchAssembler instead owns a small ring of buffers sized for the largest
+batch and gathers idx, embeddings and labels into them in place.
+
+Batches returned are views into the ring, so a batch stays valid until
+numBuffers more batches have been assembled. With two buffers one batch can
+be prefetched while the previous one is used.
+"""
+import numpy as np
+import threading
+
+
+def checkExampleIdx(batchIdx, numExamples):
+    """
+    Raise IndexError unless all idx of examples are in [0, numExamples).
+    Takes clip idx rather than raising, so they are checked up front.
+    """
+    if len(batchIdx) and (batchIdx.min() < 0 or batchIdx.max() >= numExamples):
+        raise IndexError("Minibatch idx out of range for {0} examples: {1}".format(
+                         numExamples, batchIdx[(batchIdx < 0) | (batchIdx >= numExamples)]))
+
+
+class BatchAssembler(object):
+    def __init__(self, embeddingTable, maxBatchSize, timestepsPremise, timestepsHypothesis,
+                 numBuffers=2):
+        """
+        :param embeddingTable: EmbeddingTable whose last row is the zero vector
+        :param maxBatchSize: Largest batch expected; buffers grow if a larger one comes
+        :param numBuffers: Number of batches that can be in use at once
+        """
+        self.embeddings = embeddingTable.embeddings
+        self.dimEmbeddings = self.embeddings.shape[1]
+        # Padding ('nan' in idx matrices) is gathered from the zero vector
+        self.zeroIdx = len(self.embeddings) - 1
+        self.timesteps = {"premise": timestepsPremise, "hypothesis": timestepsHypothesis}
+        self.numBuffers = numBuffers
+
+        self.lock = threading.Lock()
+        self.nextBuffer = 0
+        self.numAllocations = 0
+        self.allocatedBytes = 0
+        self.numBatches = 0
+        # Bytes of buffers filled in place that would otherwise be allocated
+        self.reusedBytes = 0
+        self._allocate(maxBatchSize)
+        self.initialAllocations = self.numAllocations
+
+
+    def _newArray(self, size, dtype):
+        array = np.empty(size, dtype=dtype)
+        self.numAllocations += 1
+        self.allocatedBytes += array.nbytes
+        return array
+
+
+    def _allocate(self, maxBatchSize):
+        """
+        Allocate ring of buffers for batches of up to maxBatchSize examples.
+        Buffers are flat so that the part used by a smaller batch is contiguous.
+        """
+        self.maxBatchSize = maxBatchSize
+        self.buffers = []
+        for _ in xrange(self.numBuffers):
+            buffers = {"labels": self._newArray(maxBatchSize, np.int32)}
+            for name, timesteps in self.timesteps.iteritems():
+                size = timesteps * maxBatchSize
+                buffers[name] = {"batchIdx": self._newArray(maxBatchSize, np.intp),
+                                 "floatIdx": self._newArray(size, np.float32),
+                                 "isPadding": self._newArray(size, np.bool_),
+                                 "outOfTable": self._newArray(size, np.bool_),
+                                 "idx": self._newArray(size, np.intp),
+                                 "tensor": self._newArray(size * self.dimEmbeddings, np.float32)}
+            self.buffers.append(buffers)
+
+
+    def _gather(self, buffers, idxMat, timesteps, pad, minibatch):
+        """
+        Gather embeddings of given examples of an idx matrix into buffers.
+        :return: Tensor of dim (timesteps, len(minibatch), dimEmbeddings)
+        """
+        if pad == 'right':
+            rows = idxMat[0:timesteps, :, 0]
+        else:
+            rows = idxMat[-timesteps:, :, 0]
+        numSteps, batchSize = rows.shape[0], len(minibatch)
+        size = numSteps * batchSize
+
+        batchIdx = buffers["batchIdx"][:batchSize]
+        batchIdx[:] = minibatch
+        checkExampleIdx(batchIdx, rows.shape[1])
+        floatIdx = buffers["floatIdx"][:size].reshape(numSteps, batchSize)
+        np.take(rows, batchIdx, axis=1, out=floatIdx, mode="clip")
+
+        # Padding and idx outside the table get the zero vector, as in
+        # EmbeddingTable.convertIdxMatToIdxTensor
+        isPadding = buffers["isPadding"][:size].reshape(numSteps, batchSize)
+        outOfTable = buffers["outOfTable"][:size].reshape(numSteps, batchSize)
+        with np.errstate(invalid="ignore"):
+            np.greater_equal(floatIdx, len(self.embeddings), out=isPadding)
+            np.less(floatIdx, -len(self.embeddings), out=outOfTable)
+        np.logical_or(isPadding, outOfTable, out=isPadding)
+        np.isnan(floatIdx, out=outOfTable)
+        np.logical_or(isPadding, outOfTable, out=isPadding)
+        np.copyto(floatIdx, self.zeroIdx, where=isPadding)
+        idx = buffers["idx"][:size].reshape(numSteps, batchSize)
+        np.copyto(idx, floatIdx, casting="unsafe")
+
+        # All idx are in [-len, len) now, where wrapping is python indexing
+        tensor = buffers["tensor"][:size * self.dimEmbeddings].reshape(
+            numSteps, batchSize, self.dimEmbeddings)
+        np.take(self.embeddings, idx, axis=0, out=tensor, mode="wrap")
+        self.reusedBytes += floatIdx.nbytes + idx.nbytes + tensor.nbytes
+        return tensor
+
+
+    def assemble(self, premiseIdxMat, hypothesisIdxMat, labels, minibatch, pad,
+                 premiseMinibatch=None):
+        """
+        Same as convertDataToTrainingBatch, but into the next buffer of the ring.
+        :param premiseMinibatch: Idx of premises to gather, if different from minibatch
+        :return: premise tensor, hypothesis tensor, and batch labels
+        """
+        if premiseMinibatch is None:
+            premiseMinibatch = minibatch
+
+        with self.lock:
+            if len(minibatch) > self.maxBatchSize or len(premiseMinibatch) > self.maxBatchSize:
+                self._allocate(max(len(minibatch), len(premiseMinibatch)))
+            buffers = self.buffers[self.nextBuffer]
+            self.nextBuffer = (self.nextBuffer + 1) % self.numBuffers
+            self.numBatches += 1
+
+        premiseTensor = self._gather(buffers["premise"], premiseIdxMat,
+                                     self.timesteps["premise"], pad, premiseMinibatch)
+        hypothesisTensor = self._gather(buffers["hypothesis"], hypothesisIdxMat,
+                                        self.timesteps["hypothesis"], pad, minibatch)
+        batchIdx = buffers["hypothesis"]["batchIdx"][:len(minibatch)]
+        checkExampleIdx(batchIdx, len(labels))
+        batchLabels = buffers["labels"][:len(minibatch)]
+        np.take(labels, batchIdx, out=batchLabels, mode="clip")
+
+        return premiseTensor, hypothesisTensor, batchLabels
+
+
+    def stats(self):
+        """
+        Return number of buffers allocated and batches assembled. Buffers are
+        only allocated up front and when a batch larger than all before comes,
+        so allocations per step stay at 0 otherwise.
+        """
+        numBatches = float(max(self.numBatches, 1))
+        return {"batchesAssembled": self.numBatches,
+                "batchBufferAllocations": self.numAllocations,
+                "batchBufferBytes": self.allocatedBytes,
+                "batchAllocationsPerStep": (self.numAllocations - self.initialAllocations) / numBatches,
+                "batchBytesReusedPerStep": self.reusedBytes / numBatches}
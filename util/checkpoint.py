@@ -0,0 +1,204 @@
+"""
+Versioned checkpoint format shared by all models.
+
+Layout of a checkpoint file:
+    8 bytes   magic 'LSTMNLI\\0'
+    4 bytes   format version (little-endian uint32)
+    8 bytes   header length (little-endian uint64)
+    header    JSON with model config and name, group, dtype, shape and
+              offset of every array
+    blobs     raw C-ordered array data, each starting at a multiple of
+              ALIGNMENT bytes from the start of the file
+
+Since blobs are aligned and uncompressed they can be memory-mapped, so
+loading doesn't copy or read arrays until they are used. Arrays can
+optionally be stored as float16 to halve the size of the file.
+
+Training checkpoints additionally hold a 'trainingState' group of arrays
+(data cursor, RNG state, pickled Stats history) used to resume training.
+
+Legacy '.npz' files from Network.saveModel and the 'count then arrays'
+files from utils.saveModel can still be loaded.
+"""
+import collections
+import json
+import numpy as np
+import struct
+
+MAGIC = b"LSTMNLI\0"
+VERSION = 1
+ALIGNMENT = 64
+
+# Magic bytes of files written by np.savez and np.save
+ZIP_MAGIC = b"PK"
+NPY_MAGIC = b"\x93NUMPY"
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def serializableConfig(configs):
+    """
+    Return the entries of a config dict that can be stored in the JSON header,
+    e.g. dropping 'self' and initializer functions from a dict of locals().
+    """
+    return {k: v for k, v in configs.iteritems()
+            if isinstance(v, (bool, int, long, float, basestring)) or v is None}
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def saveCheckpoint(path, params, config=None, optimizerState=None, float16=False,
+                   trainingState=None):
+    """
+    Write arrays and config to a checkpoint file.
+    :param params: Dict of param name to array; an OrderedDict keeps its order on load
+    :param config: Dict of JSON-serializable model config
+    :param optimizerState: Dict of optimizer state name to array
+    :param float16: Whether to store floating point params and optimizer state as float16
+    :param trainingState: Dict of arrays needed to resume training; never
+                          stored as float16
+    """
+    arrays = [("params", name, np.asarray(value)) for name, value in params.iteritems()]
+    if optimizerState is not None:
+        arrays += [("optimizerState", name, np.asarray(value))
+                   for name, value in optimizerState.iteritems()]
+    if trainingState is not None:
+        arrays += [("trainingState", name, np.asarray(value))
+                   for name, value in trainingState.iteritems()]
+
+    entries = []
+    blobs = []
+    offset = 0
+    for group, name, value in arrays:
+        storedValue = value
+        if float16 and value.dtype.kind == "f" and group != "trainingState":
+            storedValue = value.astype(np.float16)
+        storedValue = np.ascontiguousarray(storedValue)
+        entries.append({"name": name, "group": group, "dtype": value.dtype.str,
+                        "storedDtype": storedValue.dtype.str, "shape": list(value.shape),
+                        "offset": offset, "nbytes": storedValue.nbytes})
+        blobs.append(storedValue)
+        offset = _align(offset + storedValue.nbytes)
+
+    header = {"version": VERSION, "config": config or {}, "alignment": ALIGNMENT,
+              "arrays": entries}
+    headerBytes = json.dumps(header).encode("utf-8")
+    # Blob offsets in header are relative to start of data section
+    dataStart = _align(len(MAGIC) + 12 + len(headerBytes))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<IQ", VERSION, len(headerBytes)))
+        f.write(headerBytes)
+        for entry, blob in zip(entries, blobs):
+            f.write(b"\0" * (dataStart + entry["offset"] - f.tell()))
+            f.write(blob.data)
+
+
+def isCheckpoint(path):
+    """
+    Return whether file is a checkpoint rather than a legacy or other file.
+    """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def readHeader(path):
+    """
+    Return header of a checkpoint file and offset its data section starts at.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise CheckpointError("{0} is not a checkpoint file".format(path))
+        version, headerLength = struct.unpack("<IQ", f.read(12))
+        if version > VERSION:
+            raise CheckpointError("Checkpoint version {0} is newer than supported "
+                                  "version {1}".format(version, VERSION))
+        header = json.loads(f.read(headerLength).decode("utf-8"))
+
+    return header, _align(len(MAGIC) + 12 + headerLength)
+
+
+def _loadLegacy(path):
+    """
+    Load params from '.npz' files of Network.saveModel or 'count then arrays'
+    files of utils.saveModel.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(NPY_MAGIC))
+        f.seek(0)
+        if magic.startswith(ZIP_MAGIC):
+            with np.load(f) as npz:
+                return collections.OrderedDict((name, npz[name]) for name in sorted(npz.files))
+        elif magic == NPY_MAGIC:
+            numParams = int(np.load(f))
+            return collections.OrderedDict(("param{0}".format(idx), np.load(f))
+                                           for idx in xrange(numParams))
+
+    raise CheckpointError("Unknown format of {0}".format(path))
+
+
+def _loadGroups(path, mmap=True, castFloat16=True):
+    """
+    Load arrays of a checkpoint file, or a legacy params file.
+    :return: Dict of group name to OrderedDict of arrays, and config dict
+    """
+    groups = {"params": collections.OrderedDict(),
+              "optimizerState": collections.OrderedDict(),
+              "trainingState": collections.OrderedDict()}
+    if not isCheckpoint(path):
+        groups["params"] = _loadLegacy(path)
+        return groups, {}
+
+    header, dataStart = readHeader(path)
+    if mmap:
+        # Map whole file once; arrays are views into it
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        with open(path, "rb") as f:
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+
+    for entry in header["arrays"]:
+        storedDtype = np.dtype(entry["storedDtype"])
+        offset = dataStart + entry["offset"]
+        value = data[offset:offset + entry["nbytes"]].view(storedDtype).reshape(entry["shape"])
+
+        if castFloat16 and storedDtype != np.dtype(entry["dtype"]):
+            value = value.astype(entry["dtype"])
+        groups[entry["group"]][entry["name"]] = value
+
+    return groups, header["config"]
+
+
+def loadCheckpoint(path, mmap=True, castFloat16=True):
+    """
+    Load a checkpoint file, or a legacy params file.
+    :param mmap: Whether to memory-map arrays instead of reading them into memory
+    :param castFloat16: Whether to cast arrays stored as float16 back to their original dtype
+    :return: OrderedDicts of params and optimizer state, and config dict
+    """
+    groups, config = _loadGroups(path, mmap, castFloat16)
+    return groups["params"], groups["optimizerState"], config
+
+
+def loadTrainingState(path):
+    """
+    Load training state of a checkpoint written during training.
+    :return: OrderedDict of training state arrays (empty if there is none)
+    """
+    groups, _ = _loadGroups(path, mmap=False)
+    return groups["trainingState"]
+
+
+def convertCheckpoint(inputPath, outputPath, config=None, float16=False):
+    """
+    Convert a legacy params file (or checkpoint) to the current checkpoint format.
+    """
+    groups, storedConfig = _loadGroups(inputPath, mmap=False)
+    storedConfig.update(config or {})
+    saveCheckpoint(outputPath, groups["params"], storedConfig,
+                   groups["optimizerState"] or None, float16, groups["trainingState"] or None)
@@ -0,0 +1,141 @@
+"""
+Writes checkpoints in a background thread so training doesn't wait on a
+(possibly network) filesystem.
+
+The trainer hands over copies of all arrays, which the writer saves to a
+local scratch directory and then moves next to the final path and renames
+into place, so the final path always holds a complete checkpoint. Older
+checkpoints are rotated to '<path>.1', '<path>.2', ... and only the last
+keepLast are kept.
+"""
+import atexit
+import numpy as np
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+
+from checkpoint import saveCheckpoint
+
+
+class AsyncCheckpointWriter(object):
+    def __init__(self, scratchDir=None, keepLast=1, maxPending=1):
+        """
+        :param scratchDir: Local directory checkpoints are first written to;
+                           system temp directory if not given
+        :param keepLast: Number of most recent checkpoints kept per path
+        :param maxPending: Max checkpoints waiting to be written; write() blocks
+                           when this many are pending, bounding memory use
+        """
+        self.scratchDir = scratchDir or tempfile.gettempdir()
+        self.keepLast = keepLast
+
+        self.queue = Queue.Queue(maxPending)
+        self.statsLock = threading.Lock()
+        self.writeLatencies = []
+        self.error = None
+        self.closed = False
+
+        self.worker = threading.Thread(target=self._run, name="checkpointWriter")
+        self.worker.daemon = True
+        self.worker.start()
+        # Finish pending writes if the process exits without closing writer
+        atexit.register(self.close)
+
+
+    def write(self, path, params, config=None, optimizerState=None, float16=False,
+              trainingState=None):
+        """
+        Queue a checkpoint for writing; arguments are those of saveCheckpoint.
+        Arrays must not be modified afterwards, so pass copies (e.g. from
+        get_value() of shared variables).
+        """
+        self._raiseError()
+        self.queue.put((path, (dict(params), config, optimizerState, float16, trainingState),
+                        time.time()))
+
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            path, args, queueTime = item
+            try:
+                self._writeCheckpoint(path, *args)
+                with self.statsLock:
+                    self.writeLatencies.append(time.time() - queueTime)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+
+    def _writeCheckpoint(self, path, *args):
+        fd, scratchPath = tempfile.mkstemp(suffix=".ckpt", dir=self.scratchDir)
+        os.close(fd)
+        try:
+            saveCheckpoint(scratchPath, *args)
+            # Move may copy across filesystems, so move next to final path
+            # first and then rename, which is atomic
+            shutil.move(scratchPath, path + ".tmp")
+        finally:
+            if os.path.exists(scratchPath):
+                os.remove(scratchPath)
+
+        if self.keepLast > 1 and os.path.exists(path):
+            for idx in reversed(xrange(2, self.keepLast)):
+                olderPath = "{0}.{1}".format(path, idx - 1)
+                if os.path.exists(olderPath):
+                    os.rename(olderPath, "{0}.{1}".format(path, idx))
+            # Keep previous checkpoint at path until the new one is renamed
+            # over it, so a crash in between never leaves path missing
+            previousPath = path + ".1"
+            if os.path.exists(previousPath):
+                os.remove(previousPath)
+            try:
+                os.link(path, previousPath)
+            except (OSError, AttributeError):
+                shutil.copy2(path, previousPath)
+        os.rename(path + ".tmp", path)
+
+
+    def _raiseError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+    def flush(self):
+        """
+        Block until all queued checkpoints are written.
+        """
+        self.queue.join()
+        self._raiseError()
+
+
+    def close(self):
+        """
+        Write pending checkpoints and stop background thread.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.worker.join()
+        self._raiseError()
+
+
+    def stats(self):
+        """
+        Return number of checkpoints written and their latency from queueing
+        to being in place.
+        """
+        with self.statsLock:
+            latencies = np.array(self.writeLatencies)
+            return {"checkpointsWritten": len(latencies),
+                    "meanCheckpointWriteSec": float(latencies.mean()) if len(latencies) else None,
+                    "maxCheckpointWriteSec": float(latencies.max()) if len(latencies) else None}
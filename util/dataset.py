@@ -0,0 +1,226 @@
+"""
+Binary format for preprocessed SNLI-format data, and parallel preprocessing
+of JSONL files into it.
+
+A dataset file is a checkpoint (see util/checkpoint) holding the word idx
+of all premises and all hypotheses concatenated, the number of tokens of
+each sentence and the label idx of each example:
+    premiseIdx, hypothesisIdx            int32 idx into the embedding table
+    premiseLengths, hypothesisLengths    int32 tokens per sentence
+    labels                               int32 idx as given by LABEL_MAP
+Its config records the source file, data stats and a fingerprint of the
+embedding vocabulary the idx refer to, so a dataset can't silently be used
+with a different embedding table.
+
+Preprocessing splits the JSONL file into byte ranges that are parsed,
+tokenized and mapped to idx in a pool of worker processes. Shards are
+merged in file order, so the output doesn't depend on the number of workers.
+"""
+import collections
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+
+from checkpoint import isCheckpoint, loadCheckpoint, readHeader, saveCheckpoint
+from length_stats import lengthStats
+from load_snli_data import LABEL_MAP, convert_binary_bracketing
+
+DATASET_FORMAT = "snliDataset"
+
+ARRAY_NAMES = ["premiseIdx", "premiseLengths", "hypothesisIdx", "hypothesisLengths", "labels"]
+
+# Vocabulary of current worker process
+workerWordToIndex = None
+workerUnkIdx = None
+
+
+def vocabFingerprint(embeddingTable):
+    """
+    Return md5 of words of embedding table in idx order.
+    """
+    md5 = hashlib.md5()
+    for idx in xrange(embeddingTable.sizeVocab):
+        word = embeddingTable.indexToWord.get(idx)
+        md5.update((word if word is not None else "").encode("utf-8") + b"\n")
+    return md5.hexdigest()
+
+
+def isDataset(path):
+    """
+    Return whether file is a preprocessed dataset rather than a JSONL file.
+    """
+    return isCheckpoint(path) and \
+        readHeader(path)[0]["config"].get("format") == DATASET_FORMAT
+
+
+def shardByteRanges(path, numShards):
+    """
+    Split file into at most numShards byte ranges of about equal size. Each
+    line belongs to the range it starts in.
+    :return: List of (start, end) byte offsets
+    """
+    size = os.path.getsize(path)
+    bounds = sorted(set(size * shard // numShards for shard in xrange(numShards + 1)))
+    return zip(bounds[:-1], bounds[1:])
+
+
+def initWorker(wordToIndex, unkIdx):
+    global workerWordToIndex, workerUnkIdx
+    workerWordToIndex = wordToIndex
+    workerUnkIdx = unkIdx
+
+
+def processShard(args):
+    """
+    Parse, tokenize and map to idx the labeled examples of a byte range of
+    a JSONL file, with the worker's vocabulary.
+    :param args: Path and (start, end) byte offsets of shard
+    :return: Dict of arrays of shard, named as in ARRAY_NAMES
+    """
+    path, (start, end) = args
+    sentences = {"premise": [], "hypothesis": []}
+    labels = []
+    with open(path, "rb") as f:
+        pos = start
+        if start > 0:
+            # Skip rest of line started in previous shard
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            if not line.strip():
+                continue
+
+            example = json.loads(line)
+            if example["gold_label"] not in LABEL_MAP:
+                continue
+            labels.append(LABEL_MAP[example["gold_label"]])
+            sentences["premise"].append(
+                convert_binary_bracketing(example["sentence1_binary_parse"])[0])
+            sentences["hypothesis"].append(
+                convert_binary_bracketing(example["sentence2_binary_parse"])[0])
+
+    arrays = {"labels": np.array(labels, dtype=np.int32)}
+    for name, sents in sentences.iteritems():
+        arrays[name + "Idx"] = np.array([workerWordToIndex.get(word.lower(), workerUnkIdx)
+                                         for sent in sents for word in sent], dtype=np.int32)
+        arrays[name + "Lengths"] = np.array([len(sent) for sent in sents], dtype=np.int32)
+    return arrays
+
+
+def preprocessCorpus(dataPath, embeddingTable, outputPath, numWorkers=None, shardsPerWorker=4):
+    """
+    Preprocess an SNLI-format JSONL file into a dataset file.
+    :param embeddingTable: EmbeddingTable whose idx words are mapped to
+    :param numWorkers: Number of worker processes; number of CPUs if not given
+    :param shardsPerWorker: Number of shards per worker, so that workers
+                            finishing early can take more shards
+    :return: Config of dataset
+    """
+    numWorkers = numWorkers or multiprocessing.cpu_count()
+    shards = [(dataPath, byteRange) for byteRange in
+              shardByteRanges(dataPath, numWorkers * shardsPerWorker)]
+    initArgs = (embeddingTable.wordToIndex, embeddingTable.sizeVocab - 2)
+
+    if numWorkers > 1:
+        pool = multiprocessing.Pool(numWorkers, initWorker, initArgs)
+        try:
+            # map returns shards in order
+            results = pool.map(processShard, shards, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        initWorker(*initArgs)
+        results = [processShard(shard) for shard in shards]
+
+    arrays = collections.OrderedDict()
+    for name in ARRAY_NAMES:
+        arrays[name] = np.concatenate([result[name] for result in results]) \
+                       if results else np.zeros(0, dtype=np.int32)
+
+    config = {"format": DATASET_FORMAT, "source": os.path.abspath(dataPath),
+              "numExamples": len(arrays["labels"]),
+              "embedData": embeddingTable.dataPath,
+              "sizeVocab": embeddingTable.sizeVocab,
+              "vocabFingerprint": vocabFingerprint(embeddingTable)}
+    for name in ["premise", "hypothesis"]:
+        lengths = arrays[name + "Lengths"]
+        suffix = name[0].upper() + name[1:]
+        config["minSentLen" + suffix] = int(lengths.min()) if len(lengths) else 0
+        config["maxSentLen" + suffix] = int(lengths.max()) if len(lengths) else 0
+        config.update(lengthStats(lengths, suffix))
+    saveCheckpoint(outputPath, arrays, config)
+
+    return config
+
+
+def padMask(lengths, seqLen, padDir):
+    """
+    Return mask of dim (numSamples, seqLen) with ones where tokens of each
+    sentence go when padded to seqLen, truncating sentences longer than seqLen.
+    :param lengths: Number of tokens of each sentence
+    :param padDir: Whether to pad on the 'left' or 'right'
+    """
+    keptLengths = np.minimum(lengths, seqLen)[:, np.newaxis]
+    positions = np.arange(seqLen)[np.newaxis, :]
+    if padDir == "right":
+        return (positions < keptLengths).astype(np.float32)
+    elif padDir == "left":
+        return (positions >= seqLen - keptLengths).astype(np.float32)
+    raise ValueError("Unknown pad direction: {0}".format(padDir))
+
+
+def padIdxMatrix(flatIdx, lengths, seqLen, padDir, padIdx):
+    """
+    Build padded idx matrix from the idx of all sentences concatenated.
+    Sentences longer than seqLen keep their first seqLen tokens.
+    :param flatIdx: Array of idx of all tokens of all sentences
+    :param lengths: Number of tokens of each sentence
+    :param seqLen: Number of columns of matrix
+    :param padDir: Whether to pad on the 'left' or 'right'
+    :param padIdx: Idx to fill padding with
+    :return: Idx matrix of dim (numSamples, seqLen) and its mask
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    mask = padMask(lengths, seqLen, padDir)
+    filled = mask.astype(bool)
+
+    # Position within its sentence of the token for each filled cell
+    starts = np.cumsum(lengths) - lengths
+    tokenPos = np.cumsum(filled, axis=1) - 1
+    idxMat = np.empty((len(lengths), seqLen), dtype=np.int32)
+    idxMat.fill(padIdx)
+    idxMat[filled] = np.asarray(flatIdx)[(starts[:, np.newaxis] + tokenPos)[filled]]
+
+    return idxMat, mask
+
+
+def loadDataset(path, embeddingTable=None, limit=None):
+    """
+    Load a dataset file, memory-mapped.
+    :param embeddingTable: If given, check that idx of dataset refer to its vocabulary
+    :param limit: Number of examples to keep from start of dataset; all if None
+    :return: Dict of arrays named as in ARRAY_NAMES, and config of dataset
+    """
+    arrays, _, config = loadCheckpoint(path)
+    if config.get("format") != DATASET_FORMAT:
+        raise ValueError("{0} is not a dataset file".format(path))
+    if embeddingTable is not None and \
+            config["vocabFingerprint"] != vocabFingerprint(embeddingTable):
+        raise ValueError("{0} was preprocessed with embeddings {1}, whose vocabulary differs "
+                         "from that of {2}".format(path, config["embedData"],
+                                                   embeddingTable.dataPath))
+
+    if limit is not None:
+        arrays["labels"] = arrays["labels"][:limit]
+        for name in ["premise", "hypothesis"]:
+            lengths = arrays[name + "Lengths"][:limit]
+            arrays[name + "Lengths"] = lengths
+            arrays[name + "Idx"] = arrays[name + "Idx"][:lengths.sum()]
+    return arrays, config
@@ -0,0 +1,88 @@
+"""
+Inspects compiled Theano functions for float64 variables, upcasts, large
+constant-folded values and host/device transfers.
+"""
+import theano
+
+# Names of ops that move data between host and device (old and new GPU backends)
+TRANSFER_OPS = ["HostFromGpu", "GpuFromHost", "GpuToGpu"]
+
+
+class GraphAuditError(Exception):
+    pass
+
+
+def _floatBits(dtype):
+    """
+    Return the number of bits of a float dtype, or None if dtype isn't a float.
+    """
+    if dtype is not None and dtype.startswith("float"):
+        return int(dtype[len("float"):])
+    return None
+
+
+def auditFunction(fn, largeConstantSize=10000):
+    """
+    Audit the optimized graph of a compiled Theano function.
+    :param fn: Compiled theano function
+    :param largeConstantSize: Number of elements above which a constant in the
+                              graph is reported
+    :return: Dict of issues found, keyed by type of issue
+    """
+    fgraph = fn.maker.fgraph
+    issues = {"float64": [], "upcasts": [], "largeConstants": [], "transfers": []}
+
+    for var in fgraph.variables:
+        if getattr(var.type, "dtype", None) == "float64":
+            issues["float64"].append(str(var.owner) if var.owner else str(var))
+
+        if isinstance(var, theano.gof.Constant) and \
+                getattr(var.data, "size", 1) >= largeConstantSize:
+            issues["largeConstants"].append("{0} of shape {1}".format(var, var.data.shape))
+
+    for node in fgraph.apply_nodes:
+        inBits = [_floatBits(getattr(i.type, "dtype", None)) for i in node.inputs]
+        inBits = [b for b in inBits if b is not None]
+        for out in node.outputs:
+            outBits = _floatBits(getattr(out.type, "dtype", None))
+            if outBits is not None and inBits and outBits > min(inBits):
+                issues["upcasts"].append(str(node))
+                break
+
+        # Transfers of function inputs to device and of outputs back to host are expected
+        opName = type(node.op).__name__
+        if opName in TRANSFER_OPS:
+            isInputTransfer = all(i in fgraph.inputs for i in node.inputs)
+            isOutputTransfer = all(o in fgraph.outputs for o in node.outputs)
+            if not (isInputTransfer or isOutputTransfer):
+                issues["transfers"].append(str(node))
+
+    return issues
+
+
+def auditFunctions(functions, logger, strict=False, largeConstantSize=10000):
+    """
+    Audit a collection of compiled functions and log all issues found.
+    :param functions: List of (name, compiled theano function) pairs
+    :param logger: Logger to report issues to
+    :param strict: Whether to raise a GraphAuditError if any issue is found
+    :return: Dict of function name to issues found
+    """
+    allIssues = {}
+    numIssues = 0
+    for name, fn in functions:
+        issues = auditFunction(fn, largeConstantSize)
+        allIssues[name] = issues
+
+        fnIssues = sum(len(found) for found in issues.values())
+        numIssues += fnIssues
+        logger.Log("Audit of {0}: {1} nodes, {2} issues".format(
+                    name, len(fn.maker.fgraph.apply_nodes), fnIssues))
+        for issueType, found in issues.iteritems():
+            for issue in found:
+                logger.Log("    {0}: {1}".format(issueType, issue), level=logger.WARNING)
+
+    if numIssues > 0 and strict:
+        raise GraphAuditError("Found {0} issues in compiled graphs".format(numIssues))
+
+    return allIssues
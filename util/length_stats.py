@@ -0,0 +1,99 @@
+"""
+Sentence length distributions of a dataset, and choosing how many steps to
+unroll the premise and hypothesis LSTMs for from them.
+
+Data stats files hold for each side ('Premise' and 'Hypothesis') a histogram
+of sentence lengths ('lengthHistogram<Side>', count of sentences of each
+length from 0 on) and a few of its percentiles ('lengthPercentiles<Side>').
+"""
+import numpy as np
+
+SIDES = ["Premise", "Hypothesis"]
+
+PERCENTILES = [50, 90, 95, 99, 99.9, 100]
+
+AUTO_PREFIX = "auto:"
+
+
+def lengthHistogram(lengths):
+    """
+    Return list of number of sentences of each length from 0 to the max length.
+    """
+    return np.bincount(np.asarray(lengths, dtype=np.int64), minlength=1).tolist()
+
+
+def histogramPercentile(histogram, q):
+    """
+    Return smallest length that at least q percent of sentences fit in.
+    """
+    counts = np.cumsum(histogram)
+    if counts[-1] == 0:
+        return 0
+    return int(np.searchsorted(counts, q / 100. * counts[-1]))
+
+
+def percentileName(q):
+    return "p{0:g}".format(q)
+
+
+def lengthStats(lengths, side):
+    """
+    Return histogram and percentiles of sentence lengths of one side, with
+    the keys they have in data stats files.
+    :param side: 'Premise' or 'Hypothesis'
+    """
+    histogram = lengthHistogram(lengths)
+    return {"lengthHistogram" + side: histogram,
+            "lengthPercentiles" + side: {percentileName(q): histogramPercentile(histogram, q)
+                                         for q in PERCENTILES}}
+
+
+def parseUnrollSteps(unrollSteps, dataStats):
+    """
+    Return number of steps to unroll premise and hypothesis LSTMs for.
+    :param unrollSteps: Number of steps for both, or 'auto:p<q>' (e.g. 'auto:p99')
+                        for the q-th percentile of sentence lengths of each side
+    :param dataStats: Dict of data stats, with length histograms if unrollSteps is 'auto'
+    :return: Premise and hypothesis steps
+    """
+    unrollSteps = str(unrollSteps)
+    if not unrollSteps.startswith(AUTO_PREFIX):
+        return int(unrollSteps), int(unrollSteps)
+
+    q = float(unrollSteps[len(AUTO_PREFIX):].lstrip("p"))
+    if not 0 < q <= 100:
+        raise ValueError("Percentile of {0} must be in (0, 100]".format(unrollSteps))
+    if "lengthHistogramPremise" not in dataStats:
+        raise ValueError("Data stats have no length histograms; recompute them with "
+                         "computeDataStatistics to use --unrollSteps {0}".format(unrollSteps))
+    return tuple(max(1, histogramPercentile(dataStats["lengthHistogram" + side], q))
+                 for side in SIDES)
+
+
+def lstmStepFlops(dimEmbedding, dimInput, dimHidden):
+    """
+    Return forward FLOPs of one LSTM step for one sentence: projection of
+    the embedding to dimInput and the four gates.
+    """
+    return 2 * dimEmbedding * dimInput + 8 * dimHidden * (dimInput + dimHidden)
+
+
+def unrollCost(histogram, numSteps, stepFlops=0):
+    """
+    Return how much of an LSTM unrolled for numSteps is spent on padding
+    and how many sentences and tokens are truncated, for sentences of a
+    given length histogram.
+    :param stepFlops: FLOPs of one step for one sentence, see lstmStepFlops
+    """
+    histogram = np.asarray(histogram, dtype=np.float64)
+    lengths = np.arange(len(histogram))
+    numSentences = max(histogram.sum(), 1)
+    numTokens = max((histogram * lengths).sum(), 1)
+    paddingSteps = (histogram * np.maximum(numSteps - lengths, 0)).sum()
+    truncatedTokens = (histogram * np.maximum(lengths - numSteps, 0)).sum()
+
+    return {"numSteps": numSteps,
+            "paddingRate": paddingSteps / (numSteps * numSentences),
+            "paddingFlopsPerEpoch": paddingSteps * stepFlops,
+            "truncationRate": histogram[lengths > numSteps].sum() / numSentences,
+            "truncatedTokenRate": truncatedTokens / numTokens}
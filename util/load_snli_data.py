@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import json
+import numpy as np
+import re
 
 SENTENCE_PAIR_DATA = True
 
@@ -10,6 +12,31 @@ LABEL_MAP = {
     "contradiction": 2
 }
 
+# Label names in order of their idx, which is the order of the columns of
+# the softmax output of all models
+LABELS = sorted(LABEL_MAP, key=LABEL_MAP.get)
+
+# Approximates the Penn Treebank tokenization of the SNLI parses: clitics
+# ("n't", "'s", ...) and punctuation are separate tokens, while numbers
+# like "3.5" and hyphenated words stay whole
+TOKEN_RE = re.compile(r"n't|'(?:s|re|ve|ll|d|m)\b|\d+(?:[.,]\d+)+|\w+(?=n't)|[\w-]+|[^\w\s]",
+                      re.UNICODE | re.IGNORECASE)
+
+
+def encodeLabels(labels):
+    """
+    Convert label names to an int32 vector of label idx.
+    """
+    return np.array([LABEL_MAP[label] for label in labels], dtype=np.int32)
+
+
+def decodeLabels(labelIdx):
+    """
+    Convert label idx (e.g. argmax of the softmax output) to label names.
+    """
+    return [LABELS[idx] for idx in labelIdx]
+
+
 def convert_binary_bracketing(parse):
     transitions = []
     tokens = []
@@ -23,6 +50,13 @@ def convert_binary_bracketing(parse):
                 transitions.append(0)
     return tokens, transitions
 
+def tokenizeSentence(sentence):
+    """
+    Split raw text into lowercased tokens the way words of the SNLI binary
+    parses are, e.g. "The man's dog." -> ['the', 'man', "'s", 'dog', '.'].
+    """
+    return [token.lower() for token in TOKEN_RE.findall(sentence)]
+
 def load_data(path):
     print "Loading", path
     examples = []
@@ -43,10 +77,15 @@ def load_data(path):
     return examples, None
 
 
-def loadExampleSentences(path):
+def loadExampleSentences(path, limit=None):
+    """
+    :param limit: Number of labeled examples to read from start of file; all if None
+    """
     with open(path, 'r') as f:
         examples = []
         for line in f:
+            if limit is not None and len(examples) >= limit:
+                break
             loaded_example = json.loads(line)
             if loaded_example["gold_label"] not in LABEL_MAP:
                 continue
@@ -59,11 +98,16 @@ def loadExampleSentences(path):
     return examples
 
 
-def loadExampleLabels(path):
+def loadExampleLabels(path, limit=None):
+    """
+    :param limit: Number of labeled examples to read from start of file; all if None
+    """
     print "Loading gold labels from {0}".format(path)
     with open(path, 'r') as f:
         examplesLabels = []
         for line in f:
+            if limit is not None and len(examplesLabels) >= limit:
+                break
             loaded_example = json.loads(line)
             if loaded_example["gold_label"] not in LABEL_MAP:
                 continue
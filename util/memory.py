@@ -0,0 +1,130 @@
+"""
+Records process memory (RSS and, where available, tracemalloc snapshots) at
+phases of training and attributes bytes to datasets, embeddings, params and
+optimizer state.
+"""
+import resource
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    # Only in the standard library from python 3.4 on; the pytracemalloc
+    # backport provides it for python 2
+    tracemalloc = None
+
+MB = 1024. * 1024.
+
+
+def currentRSS():
+    """
+    Return current resident set size of process in bytes, or None if it
+    can't be determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return None
+
+
+def peakRSS():
+    """
+    Return peak resident set size of process in bytes.
+    """
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return maxRSS
+    return maxRSS * 1024
+
+
+def arrayBytes(arrays):
+    """
+    Return total bytes held by a collection of numpy arrays.
+    """
+    return sum(array.nbytes for array in arrays if array is not None)
+
+
+def sharedBytes(sharedVars):
+    """
+    Return total bytes held by the values of a collection of theano shared variables.
+    """
+    return sum(var.get_value(borrow=True).nbytes for var in sharedVars)
+
+
+class MemoryProfiler(object):
+    """
+    Takes memory snapshots at named phases of a run, logging each one and
+    recording them as metrics in a Stats object at the end of the run.
+    """
+    def __init__(self, logger, useTracemalloc=True, numTopAllocations=5):
+        """
+        :param logger: Logger to write snapshots to
+        :param useTracemalloc: Whether to trace python allocations, if tracemalloc is available
+        :param numTopAllocations: Number of biggest allocation sites to log per snapshot
+        """
+        self.logger = logger
+        self.numTopAllocations = numTopAllocations
+        self.snapshots = []
+        self.traceSnapshot = None
+
+        self.useTracemalloc = useTracemalloc and tracemalloc is not None
+        if self.useTracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def snapshot(self, phase, components=None):
+        """
+        Record memory usage at given phase.
+        :param phase: Name of phase, e.g. 'load', 'compile', 'firstStep', 'eval'
+        :param components: Dict of component name to bytes attributed to it
+        :return: Dict with snapshot
+        """
+        components = components or {}
+        snapshot = {"phase": phase, "rss": currentRSS(), "peakRSS": peakRSS(),
+                    "components": components}
+
+        self.logger.Log("Memory at {0}: RSS {1}, peak RSS {2:.1f}MB".format(phase,
+                        "{0:.1f}MB".format(snapshot["rss"] / MB) if snapshot["rss"] else "unknown",
+                        snapshot["peakRSS"] / MB))
+        for name, numBytes in sorted(components.iteritems(), key=lambda x: x[1], reverse=True):
+            self.logger.Log("    {0}: {1:.1f}MB".format(name, numBytes / MB))
+        if snapshot["rss"] is not None:
+            unattributed = snapshot["rss"] - sum(components.values())
+            self.logger.Log("    unattributed (interpreter, theano intermediates, ...): "
+                            "{0:.1f}MB".format(unattributed / MB))
+
+        if self.useTracemalloc:
+            traced, tracedPeak = tracemalloc.get_traced_memory()
+            snapshot["traced"] = traced
+            snapshot["tracedPeak"] = tracedPeak
+            self.logger.Log("    traced python allocations: {0:.1f}MB (peak {1:.1f}MB)".format(
+                            traced / MB, tracedPeak / MB))
+
+            traceSnapshot = tracemalloc.take_snapshot()
+            if self.traceSnapshot is not None:
+                topStats = traceSnapshot.compare_to(self.traceSnapshot, "lineno")
+            else:
+                topStats = traceSnapshot.statistics("lineno")
+            for stat in topStats[:self.numTopAllocations]:
+                self.logger.Log("    {0}".format(stat))
+            self.traceSnapshot = traceSnapshot
+
+        self.snapshots.append(snapshot)
+        return snapshot
+
+
+    def recordMetrics(self, stats, numEx):
+        """
+        Record all snapshots taken so far as metrics in given Stats object.
+        """
+        for snapshot in self.snapshots:
+            prefix = "memory_" + snapshot["phase"] + "_"
+            if snapshot["rss"] is not None:
+                stats.recordMetric(numEx, prefix + "rssMB", snapshot["rss"] / MB)
+            stats.recordMetric(numEx, prefix + "peakRSSMB", snapshot["peakRSS"] / MB)
+            for name, numBytes in snapshot["components"].iteritems():
+                stats.recordMetric(numEx, prefix + name + "MB", numBytes / MB)
+            if "traced" in snapshot:
+                stats.recordMetric(numEx, prefix + "tracedMB", snapshot["traced"] / MB)
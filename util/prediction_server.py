@@ -0,0 +1,258 @@
+"""
+HTTP prediction server that coalesces concurrent requests into micro-batches
+before calling a single batched predict function. Can listen on a TCP port
+or on a Unix domain socket.
+
+Endpoints:
+    POST /predict  {"premise": "...", "hypothesis": "..."} or
+                   {"pairs": [{"premise": "...", "hypothesis": "..."}, ...]}
+    GET  /stats    latency percentiles, throughput and batching counters
+
+Sentences are raw text, tokenized and lowercased like the SNLI parses the
+model was trained on (see load_snli_data.tokenizeSentence). Pre-tokenized,
+space-separated text gives the same tokens.
+"""
+import BaseHTTPServer
+import collections
+import httplib
+import json
+import numpy as np
+import os
+import Queue
+import socket
+import SocketServer
+import threading
+import time
+
+from load_snli_data import tokenizeSentence
+
+
+class PendingRequest(object):
+    """
+    A single premise/hypothesis pair waiting to be scored.
+    """
+    def __init__(self, premise, hypothesis):
+        self.premise = premise
+        self.hypothesis = hypothesis
+        self.arrivalTime = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+    """
+    Collects requests submitted from many threads and scores them in batches.
+    A batch is run once it has maxBatchSize requests or the oldest request
+    in it has waited maxLatency seconds, whichever comes first.
+    """
+    def __init__(self, predictFn, maxBatchSize=32, maxLatency=0.005, numLatencies=10000):
+        """
+        :param predictFn: Function taking lists of premises and hypotheses and
+                          returning a list with a result per pair
+        :param maxBatchSize: Max number of pairs per call of predictFn
+        :param maxLatency: Max seconds a request waits for a batch to fill
+        :param numLatencies: Number of most recent request latencies kept for percentiles
+        """
+        self.predictFn = predictFn
+        self.maxBatchSize = maxBatchSize
+        self.maxLatency = maxLatency
+
+        self.queue = Queue.Queue()
+        self.statsLock = threading.Lock()
+        self.latencies = collections.deque(maxlen=numLatencies)
+        self.numRequests = 0
+        self.numBatches = 0
+        self.numErrors = 0
+        self.predictTime = 0.
+        self.startTime = time.time()
+
+        self.worker = threading.Thread(target=self._run, name="microBatcher")
+        self.worker.daemon = True
+        self.worker.start()
+
+
+    def submitMany(self, pairs, timeout=None):
+        """
+        Score pairs, blocking until all have run. All pairs are queued before
+        waiting, so they can share a batch.
+        :param pairs: List of (premise, hypothesis) pairs
+        :return: List of results of predictFn for the pairs
+        """
+        requests = [PendingRequest(premise, hypothesis) for premise, hypothesis in pairs]
+        for request in requests:
+            self.queue.put(request)
+
+        for request in requests:
+            if not request.done.wait(timeout):
+                raise RuntimeError("Timed out waiting for prediction")
+            if request.error is not None:
+                raise request.error
+        return [request.result for request in requests]
+
+
+    def submit(self, premise, hypothesis, timeout=None):
+        """
+        Score a pair, blocking until its batch has run.
+        :return: Result of predictFn for the pair
+        """
+        return self.submitMany([(premise, hypothesis)], timeout)[0]
+
+
+    def _nextBatch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0].arrivalTime + self.maxLatency
+        while len(batch) < self.maxBatchSize:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except Queue.Empty:
+                break
+
+        return batch
+
+
+    def _run(self):
+        while True:
+            batch = self._nextBatch()
+            predictStart = time.time()
+            try:
+                results = self.predictFn([r.premise for r in batch],
+                                         [r.hypothesis for r in batch])
+                if len(results) != len(batch):
+                    raise ValueError("Predict function returned {0} results for {1} "
+                                     "requests".format(len(results), len(batch)))
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+
+            finished = time.time()
+            with self.statsLock:
+                self.numBatches += 1
+                self.numRequests += len(batch)
+                self.predictTime += finished - predictStart
+                if batch[0].error is not None:
+                    self.numErrors += len(batch)
+                self.latencies.extend(finished - r.arrivalTime for r in batch)
+            for request in batch:
+                request.done.set()
+
+
+    def stats(self):
+        """
+        Return dict of latency percentiles (in ms), throughput and batching counters.
+        """
+        with self.statsLock:
+            latencies = np.array(self.latencies) * 1000.
+            elapsed = time.time() - self.startTime
+            stats = {"requests": self.numRequests,
+                     "batches": self.numBatches,
+                     "errors": self.numErrors,
+                     "meanBatchSize": self.numRequests / float(max(self.numBatches, 1)),
+                     "requestsPerSec": self.numRequests / elapsed,
+                     "predictTimeSec": self.predictTime,
+                     "uptimeSec": elapsed,
+                     "queueSize": self.queue.qsize()}
+
+        for percentile in [50, 90, 99]:
+            stats["p{0}LatencyMs".format(percentile)] = \
+                float(np.percentile(latencies, percentile)) if len(latencies) else None
+        return stats
+
+
+class PredictionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles /predict and /stats; the server is expected to have a 'batcher'.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _sendJSON(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._sendJSON(200, self.server.batcher.stats())
+        else:
+            self._sendJSON(404, {"error": "Unknown path {0}".format(self.path)})
+
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._sendJSON(404, {"error": "Unknown path {0}".format(self.path)})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            pairs = request["pairs"] if "pairs" in request else [request]
+            pairs = [(tokenizeSentence(pair["premise"]), tokenizeSentence(pair["hypothesis"]))
+                     for pair in pairs]
+        except (ValueError, KeyError, AttributeError, TypeError) as e:
+            self._sendJSON(400, {"error": "Bad request: {0}".format(e)})
+            return
+
+        try:
+            predictions = self.server.batcher.submitMany(pairs)
+        except Exception as e:
+            self._sendJSON(500, {"error": str(e)})
+            return
+        self._sendJSON(200, {"predictions": predictions})
+
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+    def log_message(self, format, *args):
+        # Per-request logging to stderr would dominate latency under load
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def makeServer(batcher, host="localhost", port=8000, unixSocket=None):
+    """
+    Create a threaded HTTP server for given batcher, listening on a Unix
+    socket if a path is given and on host:port otherwise.
+    """
+    if unixSocket is not None:
+        if os.path.exists(unixSocket):
+            os.remove(unixSocket)
+        server = ThreadingUnixHTTPServer(unixSocket, PredictionHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.batcher = batcher
+    return server
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """
+    HTTP connection over a Unix domain socket.
+    """
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.path = path
+        self.socketTimeout = timeout
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.socketTimeout is not None:
+            self.sock.settimeout(self.socketTimeout)
+        self.sock.connect(self.path)
@@ -0,0 +1,106 @@
+"""
+Collects Theano per-op profiles and compile statistics for the functions
+compiled by a model and dumps them to a report file.
+"""
+import json
+import theano
+
+from theano.compile.profiling import ScanProfileStats, _atexit_print_list
+
+
+def enableProfiling():
+    """
+    Turn on Theano profiling for every function compiled from now on. Needs to
+    be called before the model compiles its train/predict functions.
+    """
+    theano.config.profile = True
+
+
+def _topOps(profileStats, topK):
+    """
+    Return the 'topK' ops of the given profile sorted by total time spent in them.
+    :param profileStats: Theano ProfileStats object
+    :return: List of dicts with op name, time, fraction of time and number of calls
+    """
+    opTime = profileStats.op_time()
+    opCallcount = profileStats.op_callcount()
+    totalTime = sum(opTime.values())
+
+    topOps = []
+    for op, opT in sorted(opTime.iteritems(), key=lambda x: x[1], reverse=True)[:topK]:
+        topOps.append({"op": str(op), "time": opT,
+                       "fraction": opT / totalTime if totalTime > 0 else 0.,
+                       "callcount": opCallcount.get(op, 0)})
+    return topOps
+
+
+def summarizeProfile(profileStats, topK=10):
+    """
+    Extract the numbers we care about from a Theano ProfileStats object.
+    :param profileStats: Theano ProfileStats object
+    :param topK: Number of most expensive ops to keep
+    :return: Dict summary of the profile
+    """
+    summary = {"name": profileStats.message,
+               "numNodes": profileStats.nb_nodes,
+               "compileTime": profileStats.compile_time,
+               "optimizerTime": profileStats.optimizer_time,
+               "linkerTime": profileStats.linker_time,
+               "callCount": profileStats.fct_callcount,
+               "callTime": profileStats.fct_call_time,
+               "topOps": _topOps(profileStats, topK)}
+
+    if isinstance(profileStats, ScanProfileStats):
+        summary["name"] = profileStats.name
+        summary["callCount"] = profileStats.callcount
+        summary["callTime"] = profileStats.call_time
+        summary["numSteps"] = profileStats.nbsteps
+        # Time spent inside the inner function of the scan loop
+        summary["innerLoopTime"] = profileStats.vm_call_time
+        summary["timePerStep"] = profileStats.call_time / profileStats.nbsteps \
+                                    if profileStats.nbsteps > 0 else 0.
+
+    return summary
+
+
+def writeProfileReport(reportPath, logger=None, topK=10):
+    """
+    Write a JSON report with the profiles of all functions compiled since
+    profiling was enabled, along with Theano's own text summary next to it.
+    :param reportPath: Path to JSON report; text summary goes to reportPath + ".txt"
+    :param logger: Optional logger to also log the per-function summary to
+    :param topK: Number of most expensive ops to report for each function
+    :return: Dict written to report
+    """
+    functions = []
+    scans = []
+    for profileStats in _atexit_print_list:
+        if isinstance(profileStats, ScanProfileStats):
+            # Scan compiles dummy inner functions that are never called
+            if profileStats.callcount > 0:
+                scans.append(summarizeProfile(profileStats, topK))
+        else:
+            functions.append(summarizeProfile(profileStats, topK))
+
+    report = {"functions": functions, "scans": scans}
+    with open(reportPath, "w") as f:
+        json.dump(report, f, indent=2)
+
+    with open(reportPath + ".txt", "w") as f:
+        for profileStats in _atexit_print_list:
+            profileStats.summary(file=f, n_ops_to_print=topK, n_apply_to_print=topK)
+
+    if logger is not None:
+        for summary in functions:
+            logger.Log("Profile {0}: {1} nodes, {2:.2f}s compile, {3} calls, "
+                       "{4:.4f}s call time".format(summary["name"], summary["numNodes"],
+                        summary["compileTime"], summary["callCount"], summary["callTime"]))
+            for op in summary["topOps"]:
+                logger.Log("    {0:.4f}s ({1:.1%}) {2}".format(op["time"], op["fraction"], op["op"]))
+        for summary in scans:
+            logger.Log("Scan {0}: {1} steps, {2:.4f}s per step, {3:.4f}s in inner loop".format(
+                summary["name"], summary["numSteps"], summary["timePerStep"],
+                summary["innerLoopTime"]))
+        logger.Log("Profile report written to {0}".format(reportPath))
+
+    return report
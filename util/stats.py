@@ -16,11 +16,14 @@ class Stats(object):
     accuracies and cost values. Will also be used to plot appropriate graphs.
     Note 'expName' must be full path for where to log experiment info.
     """
-    def __init__(self, expName):
-        self.logger = Logger(expName)
+    def __init__(self, expName, logger=None):
+        if logger is None:
+            logger = Logger(expName)
+        self.logger = logger
         self.startTime = time.time()
         self.acc = collections.defaultdict(list)
         self.cost = []
+        self.metrics = collections.defaultdict(list)
         self.totalNumEx = 0
         self.expName = expName
 
@@ -32,9 +35,30 @@ class Stats(object):
     def reset(self):
         self.acc.clear()
         self.cost = []
+        self.metrics.clear()
         self.totalNumEx = 0
 
 
+    def getState(self):
+        """
+        Return recorded history and elapsed time, e.g. to checkpoint it.
+        """
+        return {"acc": dict(self.acc), "cost": self.cost, "metrics": dict(self.metrics),
+                "totalNumEx": self.totalNumEx, "elapsedTime": time.time() - self.startTime}
+
+
+    def setState(self, state):
+        """
+        Restore history returned by getState, counting its elapsed time
+        towards total training time.
+        """
+        self.acc = collections.defaultdict(list, state["acc"])
+        self.cost = state["cost"]
+        self.metrics = collections.defaultdict(list, state["metrics"])
+        self.totalNumEx = state["totalNumEx"]
+        self.startTime = time.time() - state["elapsedTime"]
+
+
     def recordAcc(self, numEx, acc, dataset="train"):
         self.acc[dataset].append((numEx, acc))
         self.logger.Log("Current " + dataset + " accuracy after {0} examples:"
@@ -62,6 +86,28 @@ class Stats(object):
 
 
 
+    def recordMetric(self, numEx, name, value):
+        """
+        Record value of a named metric (e.g. timings, throughput) after
+        given number of examples.
+        """
+        self.metrics[name].append((numEx, value))
+        self.logger.Log("Metric {0} after {1} examples: {2}".format(name, numEx, value))
+
+
+    def getMetric(self, name):
+        return [stat[1] for stat in self.metrics[name]]
+
+
+    def recordFinalTrainingTime(self, numEx):
+        """
+        Record total training time and overall training throughput.
+        """
+        totalTime = time.time() - self.startTime
+        self.recordMetric(numEx, "totalTrainingTime", totalTime)
+        self.recordMetric(numEx, "overallExamplesPerSec", numEx / totalTime)
+
+
     def plotAndSaveFig(self, fileName, title, xLabel, yLabel, xCoord, yCoord):
         plt.plot(xCoord, yCoord)
         plt.xlabel(xLabel)
@@ -105,6 +151,7 @@ class Stats(object):
         with open(self.expName+".pickle", "w") as f:
             cPickle.dump(self.acc, f)
             cPickle.dump(self.cost, f)
+            cPickle.dump(self.metrics, f)
 
         # Plot accuracies and loss function
         numEx = self.getExNum(dataList="cost")
@@ -126,8 +173,8 @@ class Stats(object):
                      "Accuracy", devEx, devAcc)
 
         self.logger.Log("Training complete! "
-                        "Total training time: {0} ".format(time.time() -
-                                                    self.startTime)/SEC_HOUR)
+                        "Total training time: {0} ".format((time.time() -
+                                                    self.startTime)/SEC_HOUR))
 
 
         self.reset()
@@ -0,0 +1,150 @@
+"""
+Generators for synthetic GloVe-format embeddings and SNLI-format JSONL data,
+so that loaders, trainers and benchmarks can be run without the real corpora.
+"""
+import json
+import numpy as np
+
+from length_stats import lengthStats
+
+LABELS = ["entailment", "neutral", "contradiction"]
+
+# Number of pairs sampled at once when writing a corpus
+CHUNK_SIZE = 10000
+
+
+def syntheticWord(idx):
+    """
+    Return the synthetic word for a given vocabulary idx.
+    """
+    return "w{0}".format(idx)
+
+
+def writeSyntheticEmbeddings(path, vocabSize, dimEmbedding, seed=0):
+    """
+    Write a GloVe-format file with random vectors for words 'w0', ..., 'w{vocabSize-1}'.
+    :param path: Path of embedding file to write
+    :param vocabSize: Number of words in file
+    :param dimEmbedding: Dimension of embedding vectors
+    """
+    rng = np.random.RandomState(seed)
+    with open(path, "w") as f:
+        for start in xrange(0, vocabSize, CHUNK_SIZE):
+            vectors = rng.randn(min(CHUNK_SIZE, vocabSize - start), dimEmbedding) * 0.3
+            for offset, vec in enumerate(vectors):
+                f.write(syntheticWord(start + offset) + " " +
+                        " ".join("%.5f" % v for v in vec) + "\n")
+
+
+def binaryParse(tokens):
+    """
+    Return a left-branching binary bracketing of tokens in the format of
+    SNLI's 'sentence1_binary_parse' field, e.g. '( ( w1 w2 ) w3 )'.
+    """
+    parse = tokens[0]
+    for token in tokens[1:]:
+        parse = "( {0} {1} )".format(parse, token)
+    return parse
+
+
+def sampleLengths(rng, numSamples, meanLen, minLen, maxLen, distribution="lognormal"):
+    """
+    Sample sentence lengths.
+    :param distribution: One of 'lognormal' (long tail, like SNLI),
+                         'poisson' or 'uniform'
+    :return: Int array of lengths clipped to [minLen, maxLen]
+    """
+    if distribution == "lognormal":
+        sigma = 0.4
+        lengths = rng.lognormal(np.log(meanLen) - sigma ** 2 / 2, sigma, numSamples)
+    elif distribution == "poisson":
+        lengths = rng.poisson(meanLen, numSamples)
+    elif distribution == "uniform":
+        lengths = rng.randint(minLen, maxLen + 1, numSamples)
+    else:
+        raise ValueError("Unknown length distribution: {0}".format(distribution))
+
+    return np.clip(np.round(lengths), minLen, maxLen).astype(np.int32)
+
+
+def writeSyntheticSNLI(path, statsPath, numPairs, vocabSize, hypothesesPerPremise=3,
+                       meanLenPremise=14, meanLenHypothesis=8, minLen=2, maxLen=80,
+                       distribution="lognormal", oovRate=0.01, noLabelRate=0.01, seed=0):
+    """
+    Write an SNLI-format JSONL file and the matching data stats JSON file.
+    Words are drawn from a Zipfian distribution over the vocabulary and
+    each premise is paired with several hypotheses, like in SNLI.
+    :param path: Path of JSONL file to write
+    :param statsPath: Path of '*_dataStats.json' file to write
+    :param numPairs: Number of premise/hypothesis pairs to write
+    :param vocabSize: Number of words corpus is drawn from
+    :param oovRate: Fraction of tokens replaced by words without an embedding
+    :param noLabelRate: Fraction of pairs with gold label '-' (skipped by loaders)
+    :return: Dict of data stats
+    """
+    rng = np.random.RandomState(seed)
+    wordProbs = 1. / np.arange(1, vocabSize + 1)
+    wordCdf = np.cumsum(wordProbs / wordProbs.sum())
+
+    vocab = set()
+    lengthsPremise = []
+    lengthsHypothesis = []
+
+    def sampleSentences(lengths):
+        ids = np.minimum(np.searchsorted(wordCdf, rng.rand(lengths.sum())), vocabSize - 1)
+        oov = rng.rand(len(ids)) < oovRate
+        words = ["x{0}".format(idx) if isOov else syntheticWord(idx)
+                 for idx, isOov in zip(ids, oov)]
+        bounds = np.cumsum(lengths)
+        return [words[end - length:end] for end, length in zip(bounds, lengths)]
+
+    # Chunks hold whole premises, so no premise is split between two chunks
+    chunkSize = max(1, CHUNK_SIZE // hypothesesPerPremise) * hypothesesPerPremise
+    numPremisesWritten = 0
+    with open(path, "w") as f:
+        for start in xrange(0, numPairs, chunkSize):
+            numChunk = min(chunkSize, numPairs - start)
+            numPremises = -(-numChunk // hypothesesPerPremise)
+            premises = sampleSentences(sampleLengths(rng, numPremises, meanLenPremise,
+                                                     minLen, maxLen, distribution))
+            hypotheses = sampleSentences(sampleLengths(rng, numChunk, meanLenHypothesis,
+                                                       minLen, maxLen, distribution))
+            labels = rng.randint(0, len(LABELS), numChunk)
+            noLabel = rng.rand(numChunk) < noLabelRate
+
+            for idx in xrange(numChunk):
+                pairId = start + idx
+                premise = premises[idx // hypothesesPerPremise]
+                hypothesis = hypotheses[idx]
+                goldLabel = "-" if noLabel[idx] else LABELS[labels[idx]]
+                example = {"gold_label": goldLabel,
+                           "annotator_labels": [goldLabel],
+                           "captionID": "{0}.jpg#0".format(numPremisesWritten +
+                                                           idx // hypothesesPerPremise),
+                           "pairID": "{0}.jpg#0r{1}".format(pairId, idx % hypothesesPerPremise),
+                           "sentence1": " ".join(premise),
+                           "sentence2": " ".join(hypothesis),
+                           "sentence1_binary_parse": binaryParse(premise),
+                           "sentence2_binary_parse": binaryParse(hypothesis)}
+                f.write(json.dumps(example) + "\n")
+
+                if goldLabel == "-":
+                    continue
+                vocab.update(premise)
+                vocab.update(hypothesis)
+                lengthsPremise.append(len(premise))
+                lengthsHypothesis.append(len(hypothesis))
+            numPremisesWritten += numPremises
+
+    # Lengths are 0 if no pair has a label, as in util/dataset
+    stats = {"vocabSize": len(vocab),
+             "minSentLenPremise": min(lengthsPremise) if lengthsPremise else 0,
+             "maxSentLenPremise": max(lengthsPremise) if lengthsPremise else 0,
+             "minSentLenHypothesis": min(lengthsHypothesis) if lengthsHypothesis else 0,
+             "maxSentLenHypothesis": max(lengthsHypothesis) if lengthsHypothesis else 0}
+    stats.update(lengthStats(lengthsPremise, "Premise"))
+    stats.update(lengthStats(lengthsHypothesis, "Hypothesis"))
+    with open(statsPath, "w") as statsFile:
+        json.dump(stats, statsFile)
+
+    return stats
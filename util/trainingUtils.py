@@ -39,18 +39,18 @@ def rmsprop(grads, learnRate, inputPremise, inputHypothesis, yTarget, cost, para
 
             # Super hacky... to get the broadcasting to be compatible
             if paramPrefix[0:4] == "bias":
-                zippedGrads.append(theano.shared(p.get_value() * np.asarray(0.),
+                zippedGrads.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_grad" %k, broadcastable=(True, False)))
-                runningGrads2.append(theano.shared(p.get_value() * np.asarray(0.),
+                runningGrads2.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_rgrad2" %k, broadcastable=(True, False)))
-                updir.append(theano.shared(p.get_value() * np.asarray(0.),
+                updir.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_updir" %k, broadcastable=(True, False)))
             else:
-                zippedGrads.append(theano.shared(p.get_value() * np.asarray(0.),
+                zippedGrads.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_grad" %k))
-                runningGrads2.append(theano.shared(p.get_value() * np.asarray(0.),
+                runningGrads2.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_rgrad2" %k))
-                updir.append(theano.shared(p.get_value() * np.asarray(0.),
+                updir.append(theano.shared(np.zeros_like(p.get_value()),
                         name="%s_updir" %k))
 
 
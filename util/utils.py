@@ -1,6 +1,6 @@
 """Defines a series of useful utility functions for various modules."""
 import cPickle as pickle
-import csv
+import collections
 import json
 import lasagne
 import math
@@ -9,22 +9,70 @@ import os
 import re
 import sys
 import theano
+import theano.tensor as T
 
-from load_snli_data import loadExampleLabels, loadExampleSentences
+from checkpoint import loadCheckpoint, saveCheckpoint
+from dataset import isDataset, loadDataset, padIdxMatrix, padMask
+from length_stats import lengthStats
+from load_snli_data import LABEL_MAP, decodeLabels, encodeLabels, loadExampleLabels, \
+                           loadExampleSentences
 
 """Add root directory path"""
-root_dir = os.path.dirname(os.path.dirname(__file__))
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root_dir)
 
 
 WORD_RE = re.compile(r"([^ \(\)]+)", re.UNICODE)
+BRACKET_TOKEN_RE = re.compile(r"\(|\)|[^ \(\)]+", re.UNICODE)
+
+# Transitions of a shift-reduce parser over a binary bracketing
+SHIFT = 0
+REDUCE = 1
+
+def tokenizeBrackets(s):
+    """Returns brackets and words of labeled bracketing s in order, in one pass"""
+    return BRACKET_TOKEN_RE.findall(s)
+
+def bracketLeaves(s):
+    """Returns all of the words (terminal nodes) of labeled bracketing s
+    without building its tree; same as leaves(str2tree(s))"""
+    return WORD_RE.findall(s)
+
+def bracketTransitions(s):
+    """Returns words of binary bracketing s and the SHIFT/REDUCE transitions
+    that build its tree: each word is a SHIFT, each closing bracket a REDUCE"""
+    words = []
+    transitions = []
+    for token in BRACKET_TOKEN_RE.findall(s):
+        if token == ")":
+            transitions.append(REDUCE)
+        elif token != "(":
+            words.append(token)
+            transitions.append(SHIFT)
+    return words, transitions
 
 def str2tree(s):
     """Turns labeled bracketing s into a tree structure (tuple of tuples)"""
-    s = WORD_RE.sub(r'"\1",', s)
-    s = s.replace(")", "),").strip(",")
-    s = s.strip(",")
-    return eval(s)
+    stack = [[]]
+    for token in BRACKET_TOKEN_RE.findall(s):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) == 1:
+                raise ValueError("Unbalanced brackets in: {0}".format(s))
+            node = tuple(stack.pop())
+            stack[-1].append(node)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1:
+        raise ValueError("Unbalanced brackets in: {0}".format(s))
+
+    top = stack[0]
+    # A single bracketed tree is returned as is, like several top-level
+    # nodes are returned as a tuple of them
+    if len(top) == 1 and isinstance(top[0], tuple):
+        return top[0]
+    return tuple(top)
 
 def leaves(t):
     """Returns all of the words (terminal nodes) in tree t"""
@@ -36,54 +84,54 @@ def leaves(t):
             words += leaves(x)
     return words
 
-os.chdir("../")
-data_dir = os.getcwd() + "/data/"
+data_dir = root_dir + "/data/"
 
-def sick_reader(src_filename):
-    count = 1
-    for example in csv.reader(file(src_filename), delimiter="\t"):
-        print "Sentence count: ", count
-        label, t1, t2 = example[:3]
-        if not label.startswith('%') and not label=="gold_label": # Some files use leading % for comments.
-            yield (label, str2tree(t1), str2tree(t2))
-        count += 1
+def sick_reader(src_filename, parse=str2tree):
+    """
+    Yields (label, premise, hypothesis) of each example of a tab-separated
+    SICK or SNLI text file, skipping comment and header lines.
+    :param parse: Function applied to the bracketed parse of each sentence;
+                  pass bracketLeaves or bracketTransitions to skip building trees
+    """
+    with open(src_filename, "r") as f:
+        for line in f:
+            label, t1, t2 = line.rstrip("\r\n").split("\t")[:3]
+            if not label.startswith('%') and not label=="gold_label": # Some files use leading % for comments.
+                yield (label, parse(t1), parse(t2))
 
 
 #Readers for processing SICK datasets
-def sick_train_reader():
-    return sick_reader(src_filename=data_dir+"SICK_train_parsed.txt", semafor_filename=data_dir+"semafor_train.xml")
+def sick_train_reader(parse=str2tree):
+    return sick_reader(src_filename=data_dir+"SICK_train_parsed.txt", parse=parse)
 
 
-def sick_dev_reader():
-    return sick_reader(src_filename=data_dir+"SICK_dev_parsed.txt", semafor_filename=data_dir+"semafor_dev.xml")
+def sick_dev_reader(parse=str2tree):
+    return sick_reader(src_filename=data_dir+"SICK_dev_parsed.txt", parse=parse)
 
 
-def sick_test_reader():
-    return sick_reader(src_filename=data_dir+"SICK_test_parsed.txt", semafor_filename=data_dir+"semafor_test.xml")
+def sick_test_reader(parse=str2tree):
+    return sick_reader(src_filename=data_dir+"SICK_test_parsed.txt", parse=parse)
 
 
-def sick_train_dev_reader():
-    return sick_reader(src_filename=data_dir+"SICK_train+dev_parsed.txt", semafor_filename=data_dir+"semafor_traindev.xml")
+def sick_train_dev_reader(parse=str2tree):
+    return sick_reader(src_filename=data_dir+"SICK_train+dev_parsed.txt", parse=parse)
 
 
-def snli_reader(src_filename):
-    for example in csv.reader(file(src_filename), delimiter="\t"):
-        label, t1, t2 = example[:3]
-        if not label.startswith('%'): # Some files use leading % for comments.
-            yield (label, str2tree(t1), str2tree(t2))
+def snli_reader(src_filename, parse=str2tree):
+    return sick_reader(src_filename, parse=parse)
 
 
-#Readers for processing SICK datasets
-def snli_train_reader():
-    return sick_reader(src_filename=data_dir+"snli_1.0rc3_train.txt")
+#Readers for processing SNLI datasets
+def snli_train_reader(parse=str2tree):
+    return snli_reader(src_filename=data_dir+"snli_1.0rc3_train.txt", parse=parse)
 
 
-def snli_dev_reader():
-    return sick_reader(src_filename=data_dir+"snli_1.0rc3_dev.txt")
+def snli_dev_reader(parse=str2tree):
+    return snli_reader(src_filename=data_dir+"snli_1.0rc3_dev.txt", parse=parse)
 
 
-def snli_test_reader():
-    return sick_reader(src_filename=data_dir+"snli_1.0rc3_test.txt")
+def snli_test_reader(parse=str2tree):
+    return snli_reader(src_filename=data_dir+"snli_1.0rc3_test.txt", parse=parse)
 
 
 def computeDataStatistics(dataSet="dev"):
@@ -111,14 +159,11 @@ def computeDataStatistics(dataSet="dev"):
     maxSenLengthHypothesis = float("-inf")
     allLabels = ['entailment', 'contradiction', 'neutral']
 
-    for label, t1Tree, t2Tree in reader():
+    for label, t1Tokens, t2Tokens in reader(parse=bracketLeaves):
         if label not in allLabels:
             continue
         labels.append(label)
 
-        t1Tokens = leaves(t1Tree)
-        t2Tokens = leaves(t2Tree)
-
         if len(t1Tokens) > maxSenLengthPremise:
             maxSenLengthPremise = len(t1Tokens)
         if len(t1Tokens) < minSenLengthPremise:
@@ -140,10 +185,13 @@ def computeDataStatistics(dataSet="dev"):
     with open(dataSet+"_labels.json", "w") as labelsFile:
         json.dump({'labels': labels}, labelsFile)
 
+    dataStats = {"vocabSize": len(vocab), "minSentLenPremise": minSenLengthPremise,
+                 "maxSentLenPremise": maxSenLengthPremise, "minSentLenHypothesis": minSenLengthHypothesis,
+                 "maxSentLenHypothesis": maxSenLengthHypothesis}
+    dataStats.update(lengthStats([len(premise) for premise, _ in sentences], "Premise"))
+    dataStats.update(lengthStats([len(hypothesis) for _, hypothesis in sentences], "Hypothesis"))
     with open(dataSet+"_dataStats.json", "w") as dataStatsFile:
-        json.dump({"vocabSize": len(vocab), "minSentLenPremise": minSenLengthPremise,
-                   "maxSentLenPremise": maxSenLengthPremise, "minSentLenHypothesis": minSenLengthHypothesis,
-                   "maxSentLenHypothesis": maxSenLengthHypothesis}, dataStatsFile)
+        json.dump(dataStats, dataStatsFile)
 
     with open(dataSet+"_sentences.json", "w") as sentenceFile:
         json.dump({"sentences": sentences}, sentenceFile)
@@ -153,6 +201,19 @@ def computeDataStatistics(dataSet="dev"):
            minSenLengthHypothesis, maxSenLengthHypothesis
 
 
+def convertLabelsToIdx(dataFile, limit=None):
+    """
+    Converts json file of labels to an int32 vector of label idx, as given
+    by LABEL_MAP.
+    :param dataFile: Path to JSON data file, or dataset file of util/dataset
+    :param limit: Number of examples to read from start of file; all if None
+    :return: numpy vector of dim (numSamples,) corresponding to the labels
+    """
+    if isDataset(dataFile):
+        return np.array(loadDataset(dataFile, limit=limit)[0]["labels"])
+    return encodeLabels(loadExampleLabels(dataFile, limit))
+
+
 def convertLabelsToMat(dataFile):
     """
     Converts json file of labels to a (numSamples, 3) matrix with a 1 in the column
@@ -160,33 +221,19 @@ def convertLabelsToMat(dataFile):
     :param dataFile: Path to JSON data file
     :return: numpy matrix corresponding to the labels
     """
-    labelsList = ["entailment", "neutral", "contradiction"]
-    with open(dataFile, "r") as f:
-        labels = loadExampleLabels(dataFile)
-
-        labelsMat = np.zeros((len(labels), 3), dtype=np.float32)
-        for idx, label in enumerate(labels):
-            labelIdx = labelsList.index(label)
-            labelsMat[idx][labelIdx] = 1.
-
-    return labelsMat
+    return np.eye(len(LABEL_MAP), dtype=np.float32)[convertLabelsToIdx(dataFile)]
 
 
 def convertMatsToLabel(labelsMat):
     """
-    Convert a matrix of labels to a list of labels
+    Convert a one-hot matrix of labels (or vector of label idx) to a list of labels
     :param labelsMat:
     :return:
     """
-    labels = []
-    labelsList = ["entailment", "contradiction", "neutral"]
-    numSamples, _ = labelsMat.shape
-    for idx in range(numSamples):
-        sample = labelsMat[idx, :]
-        label = labelsList[np.where(sample == 1.)[0][0]]
-        labels.append(label)
-
-    return labels
+    labelsMat = np.asarray(labelsMat)
+    if labelsMat.ndim == 2:
+        labelsMat = labelsMat.argmax(axis=1)
+    return decodeLabels(labelsMat)
 
 
 def getMinibatchesIdx(numDataPoints, minibatchSize, shuffle=False):
@@ -215,20 +262,25 @@ def getMinibatchesIdx(numDataPoints, minibatchSize, shuffle=False):
 
 
 def convertDataToTrainingBatch(premiseIdxMat, timestepsPremise, hypothesisIdxMat,
-                               timestepsHypothesis, pad, embeddingTable, labels, minibatch):
+                               timestepsHypothesis, pad, embeddingTable, labels, minibatch,
+                               premiseMinibatch=None):
     """
     Convert idxMats to batch tensors for training.
     :param premiseIdxMat:
     :param hypothesisIdxMat:
     :param labels:
     :param pad: Whether zero-padded on left or right
+    :param premiseMinibatch: Idx of premises to convert, if different from minibatch
     :return: premise tensor, hypothesis tensor, and batch labels
     """
+    if premiseMinibatch is None:
+        premiseMinibatch = minibatch
+
     if pad == 'right':
-        batchPremise = premiseIdxMat[0:timestepsPremise, minibatch, :]
+        batchPremise = premiseIdxMat[0:timestepsPremise, premiseMinibatch, :]
         batchHypothesis = hypothesisIdxMat[0:timestepsHypothesis, minibatch, :]
     else:
-        batchPremise = premiseIdxMat[-timestepsPremise:, minibatch, :]
+        batchPremise = premiseIdxMat[-timestepsPremise:, premiseMinibatch, :]
         batchHypothesis = hypothesisIdxMat[-timestepsHypothesis:, minibatch, :]
 
     batchPremiseTensor = embeddingTable.convertIdxMatToIdxTensor(batchPremise)
@@ -239,6 +291,34 @@ def convertDataToTrainingBatch(premiseIdxMat, timestepsPremise, hypothesisIdxMat
     return batchPremiseTensor, batchHypothesisTensor, batchLabels
 
 
+def dedupPremises(premiseIdxMat, timestepsPremise, pad, minibatch):
+    """
+    Group examples of a minibatch that share a premise, as seen within the
+    timesteps the network is unrolled for.
+    :param premiseIdxMat: Premise idx mat of dim (maxSentLength, numSamples, 1)
+    :param pad: Whether zero-padded on left or right
+    :return: Idx of examples with unique premises, and for each example of
+             minibatch the position of its premise among the unique ones
+    """
+    if pad == 'right':
+        premises = premiseIdxMat[0:timestepsPremise, minibatch, 0]
+    else:
+        premises = premiseIdxMat[-timestepsPremise:, minibatch, 0]
+
+    uniqueMinibatch = []
+    premiseIdx = np.empty(len(minibatch), dtype=np.int32)
+    seen = {}
+    for pos, exampleIdx in enumerate(minibatch):
+        # Compare raw bytes so that 'nan' padding compares equal
+        key = premises[:, pos].tobytes()
+        if key not in seen:
+            seen[key] = len(uniqueMinibatch)
+            uniqueMinibatch.append(exampleIdx)
+        premiseIdx[pos] = seen[key]
+
+    return uniqueMinibatch, premiseIdx
+
+
 def initShared(value):
     """
     Initialize a shared tensor variable with the given float value
@@ -257,57 +337,51 @@ def computeParamNorms(params, L2regularization):
     """
     rCoef = theano.shared(np.array(L2regularization).astype(np.float32),
                           "regularizationStrength")
-    paramSum = 0.
+    paramSum = T.constant(np.float32(0.))
     for param in params:
         paramSum += (param**2).sum()
     paramSum *= rCoef
     return paramSum
 
 
-def generate_data(data_json_file, data_stats, pad_dir_prem, pad_dir_hyp, embed_table, seq_len):
+def sentencesToFlatIdx(sentences, embed_table):
+    """
+    Return idx of all tokens of tokenized sentences concatenated, with
+    unknown words mapped to the UNK idx, and number of tokens of each sentence.
+    """
+    unkIdx = embed_table.sizeVocab - 2
+    wordToIndex = embed_table.wordToIndex
+    flatIdx = np.array([wordToIndex.get(word.lower(), unkIdx)
+                        for sent in sentences for word in sent], dtype=np.int32)
+    lengths = np.array([len(sent) for sent in sentences], dtype=np.int64)
+    return flatIdx, lengths
+
+
+def generate_data(data_json_file, data_stats, pad_dir_prem, pad_dir_hyp, embed_table, seq_len,
+                  limit=None):
     """
     Return data of form (num_sample, max_seq_len) where there
     are len in idx list if in masked indices
-    :param data_json_file:
+    :param data_json_file: JSONL file, or dataset file of util/dataset
     :param data_stats:
     :param pad_dir:
     :param seq_len: desired sequence length
+    :param limit: number of examples to read from start of file; all if None
     :return:
     """
-    sentences = loadExampleSentences(data_json_file)
-
-    # Not sure if this is completely necessary
-    with open(data_stats, "r") as statsFile:
-        statsJSON = json.load(statsFile)
-        max_len_prem = statsJSON["maxSentLenPremise"]
-        max_len_hyp = statsJSON["maxSentLenHypothesis"]
-
-    num_samples = len(sentences)
-    prem_mat = np.zeros((num_samples, seq_len)).astype(np.int32)
-    hyp_mat = np.zeros((num_samples, seq_len)).astype(np.int32)
-
-    len_vocab = embed_table.sizeVocab
-
-    # Start by filling with idx corresponding to zero embedding vec
-    prem_mat.fill(len_vocab-1)
-    hyp_mat.fill(len_vocab-1)
-
-    for idx, (premiseSent, hypothesisSent) in enumerate(sentences):
-        prem_idx = np.array(embed_table.convertSentListToIdxMatrix(premiseSent))
-        hyp_idx = np.array(embed_table.convertSentListToIdxMatrix(hypothesisSent))
-
-        # Pad premise
-        if pad_dir_prem == "right":
-            prem_mat[idx, 0:len(prem_idx)] = prem_idx[0:seq_len]
-        elif pad_dir_prem == "left":
-            prem_mat[idx, -len(prem_idx):] = prem_idx[0:seq_len]
-
-        # Pad hypothesis
-        if pad_dir_hyp == "right":
-            hyp_mat[idx, 0:len(hyp_idx)] = hyp_idx[0:seq_len]
-        elif pad_dir_hyp == "left":
-            hyp_mat[idx, -len(hyp_idx):] = hyp_idx[0:seq_len]
+    if isDataset(data_json_file):
+        arrays, _ = loadDataset(data_json_file, embed_table, limit)
+        prem_idx = (arrays["premiseIdx"], arrays["premiseLengths"])
+        hyp_idx = (arrays["hypothesisIdx"], arrays["hypothesisLengths"])
+    else:
+        sentences = loadExampleSentences(data_json_file, limit)
+        prem_idx = sentencesToFlatIdx([prem for prem, _ in sentences], embed_table)
+        hyp_idx = sentencesToFlatIdx([hyp for _, hyp in sentences], embed_table)
 
+    # Idx of last row of embedding table, which is the zero vector
+    pad_idx = embed_table.sizeVocab - 1
+    prem_mat, _ = padIdxMatrix(*prem_idx, seqLen=seq_len, padDir=pad_dir_prem, padIdx=pad_idx)
+    hyp_mat, _ = padIdxMatrix(*hyp_idx, seqLen=seq_len, padDir=pad_dir_hyp, padIdx=pad_idx)
 
     return prem_mat, hyp_mat
 
@@ -320,35 +394,24 @@ def saveModel(l_output, file_name):
     :return:
     """
     all_params = lasagne.layers.get_all_params(l_output)
-    all_param_values = [p.get_value() for p in all_params]
 
-    # Hacky -- first array saved is a single entry array with number of
-    # arrays of being saved
-    num_params = len(all_param_values)
-    with open(file_name, 'w') as f:
-        np.save(f, np.array(num_params))
-        for param in all_param_values:
-            np.save(f, param)
+    # Lasagne params aren't uniquely named, so prefix names with their position
+    params = collections.OrderedDict(("{0:03d}_{1}".format(idx, p.name), p.get_value())
+                                     for idx, p in enumerate(all_params))
+    saveCheckpoint(file_name, params)
 
 
-# TODO: Test this!
 def loadModel(l_output, file_name):
     """
     Load model from given file name.
-    :param file_name:
+    :param file_name: Checkpoint or legacy file written by saveModel
     :return:
     """
-    # Stores all numerical array values
-    all_param_values = []
-    with open(file_name, 'r') as f:
-        num_params = np.load(f)[0]
-        for _ in range(num_params):
-            all_param_values.append(np.load(f))
-
+    all_param_values, _, _ = loadCheckpoint(file_name)
 
     all_params = lasagne.layers.get_all_params(l_output)
-    for p, v in zip(all_params, all_param_values):
-        p.set_value(v)
+    for p, v in zip(all_params, all_param_values.values()):
+        p.set_value(np.array(v))
 
 
 # TODO: Put these in a separate initializations util file